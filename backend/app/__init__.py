@@ -1,13 +1,21 @@
 from flask import Flask
 from flask_cors import CORS
+import functools
 import os
+import re
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
 def create_app():
     """Factory function to create Flask application"""
+    from logging_config import LOG_DIR
+    
     app = Flask(__name__)
     
     # Load configuration
@@ -16,7 +24,38 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
     app.config['MAX_FILE_SIZE'] = int(os.getenv('MAX_FILE_SIZE', 52428800))  # 50MB
     app.config['MAX_FILES_PER_DISCUSSION'] = int(os.getenv('MAX_FILES_PER_DISCUSSION', 30))
+    # Whole request bodies; larger declared uploads are refused before being read
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv(
+        'MAX_REQUEST_SIZE',
+        app.config['MAX_FILE_SIZE'] * app.config['MAX_FILES_PER_DISCUSSION'] + 1024 * 1024
+    ))
     app.config['LLM_API_KEY'] = os.getenv('LLM_API_KEY', '')
+    app.config['RETRIEVAL_TOP_K'] = int(os.getenv('RETRIEVAL_TOP_K', 8))
+    app.config['RETRIEVAL_ENGINE'] = os.getenv('RETRIEVAL_ENGINE', 'fts')
+    app.config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', 24000))
+    app.config['HISTORY_TOKEN_BUDGET'] = int(os.getenv('HISTORY_TOKEN_BUDGET', 4000))
+    app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+    app.config['RESPONSE_CACHE_PERSIST'] = os.getenv('RESPONSE_CACHE_PERSIST', 'false').lower() == 'true'
+    app.config['PROMPT_CACHE_ENABLED'] = os.getenv('PROMPT_CACHE_ENABLED', 'false').lower() == 'true'
+    app.config['PROMPT_CACHE_TTL'] = int(os.getenv('PROMPT_CACHE_TTL', 3600))
+    app.config['PROMPT_CACHE_MIN_TOKENS'] = int(os.getenv('PROMPT_CACHE_MIN_TOKENS', 1024))
+    app.config['PROMPT_CACHE_RETRY_AFTER'] = int(os.getenv('PROMPT_CACHE_RETRY_AFTER', 300))
+    app.config['CHAT_BATCH_MAX_MESSAGES'] = int(os.getenv('CHAT_BATCH_MAX_MESSAGES', 20))
+    app.config['CHAT_BATCH_CALL_TIMEOUT'] = float(os.getenv('CHAT_BATCH_CALL_TIMEOUT', 120))
+    app.config['SUMMARY_MAP_TOKENS'] = int(os.getenv('SUMMARY_MAP_TOKENS', 6000))
+    app.config['SUMMARY_REDUCE_FAN_IN'] = int(os.getenv('SUMMARY_REDUCE_FAN_IN', 8))
+    app.config['SUMMARY_CALL_TIMEOUT'] = float(os.getenv('SUMMARY_CALL_TIMEOUT', 180))
+    app.config['CONVERSATION_WINDOW_TURNS'] = int(os.getenv('CONVERSATION_WINDOW_TURNS', 8))
+    app.config['CONVERSATION_COMPACT_TURNS'] = int(os.getenv('CONVERSATION_COMPACT_TURNS', 8))
+    app.config['ASYNC_INGESTION'] = os.getenv('ASYNC_INGESTION', 'true').lower() == 'true'
+    app.config['PROFILING_ENABLED'] = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_MODE'] = os.getenv('PROFILE_MODE', 'sample')
+    app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR') or os.path.join(LOG_DIR, 'profiles')
+    app.config['PROFILE_MAX_FILES'] = int(os.getenv('PROFILE_MAX_FILES', 200))
+    app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN', '')
     
     # Configure CORS
     allowed_origins = os.getenv('ALLOWED_ORIGINS', 'http://localhost:3000,http://localhost:5173').split(',')
@@ -24,7 +63,8 @@ def create_app():
         r"/api/*": {
             "origins": allowed_origins,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"]
+            "allow_headers": ["Content-Type", "Authorization", "X-Request-ID"],
+            "expose_headers": ["X-Request-ID"]
         }
     })
     
@@ -36,19 +76,120 @@ def create_app():
     from app.services.database_service import init_db
     init_db(app.config['DATABASE_PATH'])
     
+    # Cache of chat answers, shared by all requests
+    from app.services.response_cache import ResponseCache
+    app.extensions['response_cache'] = ResponseCache(
+        max_entries=app.config['RESPONSE_CACHE_SIZE'],
+        ttl=app.config['RESPONSE_CACHE_TTL'],
+        db_path=app.config['DATABASE_PATH'] if app.config['RESPONSE_CACHE_PERSIST'] else None
+    )
+    
+    # Per-discussion prompt prefixes cached on the LLM API side
+    from app.services.prompt_cache import PromptCache
+    app.extensions['prompt_cache'] = PromptCache.from_config(app.config)
+    
+    # Ingestion jobs only live in memory; files a crash or restart left
+    # 'processing' (and no live process has claimed) are queued again
+    from app.services.ingestion_service import ingestion_queue
+    from app.services.vector_index import vector_index_cache
+    
+    def invalidate_discussion_caches(discussion_id):
+        vector_index_cache.invalidate(app.config['DATABASE_PATH'], discussion_id)
+        app.extensions['prompt_cache'].invalidate(app.config['DATABASE_PATH'], discussion_id)
+        app.extensions['response_cache'].invalidate_discussion(discussion_id)
+    
+    ingestion_queue.start_recovery(app.config['DATABASE_PATH'], on_complete=invalidate_discussion_caches)
+    
+    # Correlation ID on every log record of a request and of the jobs it starts;
+    # taken from X-Request-ID when the client (or a proxy) sends a sane one
+    from flask import g, request
+    from logging_config import request_id_var
+    
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        request_id_var.set(g.request_id)
+    
+    @app.after_request
+    def add_request_id_header(response):
+        response.headers['X-Request-ID'] = g.request_id
+        return response
+    
+    @app.teardown_request
+    def clear_request_id(exc):
+        request_id_var.set(None)
+    
+    # Opt-in request profiling; installs no hooks unless PROFILING_ENABLED. Set
+    # up first so a profile spans every other hook
+    from app.services.profiler import RequestProfiler
+    RequestProfiler.from_config(app.config).init_app(app)
+    
+    # Per-route latency histograms, served at /api/metrics
+    from app.services.metrics import registry, request_duration
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_duration(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # The URL rule (e.g. /api/discussions/<int:discussion_id>) keeps label values bounded
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_duration.observe(
+                time.perf_counter() - started,
+                method=request.method, route=route, status=response.status_code
+            )
+        return response
+    
     # Register blueprints
     from app.routes.discussions import discussions_bp
     from app.routes.files import files_bp
     from app.routes.chat import chat_bp
+    from app.routes.conversations import conversations_bp
+    from app.routes.admin import admin_bp
     
     app.register_blueprint(discussions_bp, url_prefix='/api/discussions')
     app.register_blueprint(files_bp, url_prefix='/api/discussions')
     app.register_blueprint(chat_bp, url_prefix='/api/discussions')
+    app.register_blueprint(conversations_bp, url_prefix='/api/discussions')
+    if app.config['PROFILING_ENABLED']:
+        # Profile listing/downloads only exist while profiling is on
+        app.register_blueprint(admin_bp, url_prefix='/api/admin')
     
     # Health check route
     @app.route('/api/health', methods=['GET'])
     def health_check():
         return {'status': 'healthy', 'message': 'API is running'}, 200
     
+    # Cache statistics and metrics expose traffic and timings; like the admin
+    # routes they require an X-Profile-Token matching PROFILE_TOKEN
+    from app.utils.response_helpers import success_response, error_response
+    
+    def operator_only(view):
+        @functools.wraps(view)
+        def checked(*args, **kwargs):
+            if not app.extensions['profiler'].authorized(request.headers):
+                return error_response("Invalid or missing X-Profile-Token", status_code=403)
+            return view(*args, **kwargs)
+        return checked
+    
+    # Answer cache statistics
+    @app.route('/api/cache/stats', methods=['GET'])
+    @operator_only
+    def cache_stats():
+        return success_response(data=dict(
+            app.extensions['response_cache'].stats(),
+            prompt_cache=app.extensions['prompt_cache'].stats()
+        ))
+    
+    # Prometheus metrics of this process
+    @app.route('/api/metrics', methods=['GET'])
+    @operator_only
+    def metrics():
+        return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    
     return app
 
@@ -0,0 +1,59 @@
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
+
+@timed_model
+class ContentBlob:
+    """ContentBlob model for the content-addressed chunk store shared by identical files"""
+    
+    @staticmethod
+    def get(db_path, content_hash):
+        """Get the stored content for a hash (chunk_count is None until its chunks are stored)"""
+        try:
+            with transaction(db_path) as conn:
+                row = conn.execute('''
+                    SELECT content_hash, chunk_count, ref_count, created_at
+                    FROM ContentBlobs
+                    WHERE content_hash = ?
+                ''', (content_hash,)).fetchone()
+            
+            return dict(row) if row else None
+        except Exception as e:
+            error_logger.error(f"Error fetching content blob {content_hash}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def mark_stored(db_path, content_hash, chunk_count):
+        """Record that all chunks for a hash are stored"""
+        try:
+            with transaction(db_path, write=True) as conn:
+                conn.execute(
+                    'UPDATE ContentBlobs SET chunk_count = ? WHERE content_hash = ?',
+                    (chunk_count, content_hash)
+                )
+            
+            db_logger.info(f"Stored {chunk_count} chunks for content {content_hash[:12]}")
+            return True
+        except Exception as e:
+            error_logger.error(f"Error updating content blob {content_hash}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_missing(db_path, content_hashes):
+        """Get the hashes among content_hashes that no file refers to any more"""
+        content_hashes = set(content_hashes)
+        if not content_hashes:
+            return []
+        
+        try:
+            placeholders = ', '.join('?' for _ in content_hashes)
+            with transaction(db_path) as conn:
+                stored = {row[0] for row in conn.execute(
+                    f'SELECT content_hash FROM ContentBlobs WHERE content_hash IN ({placeholders})',
+                    list(content_hashes)
+                )}
+            
+            return sorted(content_hashes - stored)
+        except Exception as e:
+            error_logger.error(f"Error fetching content blobs: {e}", exc_info=True)
+            raise
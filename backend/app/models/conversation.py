@@ -0,0 +1,111 @@
+from datetime import datetime
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
+
+@timed_model
+class Conversation:
+    """Conversation model for chat sessions stored server-side"""
+    
+    @staticmethod
+    def create(db_path, discussion_id, title=None):
+        """Create a new conversation in a discussion"""
+        try:
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    INSERT INTO Conversations (discussion_id, title, created_at, updated_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (discussion_id, title, datetime.now(), datetime.now()))
+                
+                conversation_id = cursor.lastrowid
+            
+            db_logger.info(f"Conversation created with ID: {conversation_id}")
+            return conversation_id
+        except Exception as e:
+            error_logger.error(f"Error creating conversation: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_by_id(db_path, conversation_id):
+        """Get a conversation by ID, with its turn count"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT c.id, c.discussion_id, c.title, c.summary, c.summarized_through,
+                           c.created_at, c.updated_at,
+                           (SELECT COUNT(*) FROM ConversationTurns t WHERE t.conversation_id = c.id) AS turn_count
+                    FROM Conversations c
+                    WHERE c.id = ?
+                ''', (conversation_id,))
+                
+                row = cursor.fetchone()
+            
+            return dict(row) if row else None
+        except Exception as e:
+            error_logger.error(f"Error fetching conversation {conversation_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_by_discussion(db_path, discussion_id):
+        """Get the conversations of a discussion, most recently active first"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT c.id, c.discussion_id, c.title, c.created_at, c.updated_at,
+                           (SELECT COUNT(*) FROM ConversationTurns t WHERE t.conversation_id = c.id) AS turn_count
+                    FROM Conversations c
+                    WHERE c.discussion_id = ?
+                    ORDER BY c.updated_at DESC, c.id DESC
+                ''', (discussion_id,))
+                
+                conversations = [dict(row) for row in cursor.fetchall()]
+            
+            db_logger.info(f"Retrieved {len(conversations)} conversations for discussion {discussion_id}")
+            return conversations
+        except Exception as e:
+            error_logger.error(f"Error fetching conversations for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def set_summary(db_path, conversation_id, summary, summarized_through, expected_through):
+        """
+        Replace the running summary, unless another compaction got there first
+        
+        Args:
+            db_path: Path to the database
+            conversation_id: Conversation to update
+            summary: New running summary
+            summarized_through: ID of the last turn the summary covers
+            expected_through: summarized_through the summary was built on
+        
+        Returns:
+            True if the summary was stored
+        """
+        try:
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    UPDATE Conversations
+                    SET summary = ?, summarized_through = ?
+                    WHERE id = ? AND summarized_through = ?
+                ''', (summary, summarized_through, conversation_id, expected_through))
+                
+                updated = cursor.rowcount > 0
+            
+            db_logger.info(f"Conversation {conversation_id} summarized through turn {summarized_through}: {updated}")
+            return updated
+        except Exception as e:
+            error_logger.error(f"Error summarizing conversation {conversation_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def delete(db_path, conversation_id):
+        """Delete a conversation (cascade deletes its turns)"""
+        try:
+            with transaction(db_path, write=True) as conn:
+                conn.execute('DELETE FROM Conversations WHERE id = ?', (conversation_id,))
+            
+            db_logger.info(f"Conversation deleted: {conversation_id}")
+            return True
+        except Exception as e:
+            error_logger.error(f"Error deleting conversation {conversation_id}: {e}", exc_info=True)
+            raise
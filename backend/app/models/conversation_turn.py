@@ -0,0 +1,79 @@
+from datetime import datetime
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
+
+@timed_model
+class ConversationTurn:
+    """ConversationTurn model for the messages of a stored conversation"""
+    
+    @staticmethod
+    def add(db_path, conversation_id, turns, default_title=None):
+        """
+        Append turns to a conversation and mark it as active
+        
+        Args:
+            db_path: Path to the database
+            conversation_id: Conversation to append to
+            turns: (role, content) pairs in order, role being 'user' or 'model'
+            default_title: Title to give the conversation if it has none yet
+        
+        Returns:
+            IDs of the new turns
+        """
+        try:
+            created_at = datetime.now()
+            with transaction(db_path, write=True) as conn:
+                turn_ids = []
+                for role, content in turns:
+                    cursor = conn.execute('''
+                        INSERT INTO ConversationTurns (conversation_id, role, content, created_at)
+                        VALUES (?, ?, ?, ?)
+                    ''', (conversation_id, role, content, created_at))
+                    turn_ids.append(cursor.lastrowid)
+                
+                conn.execute(
+                    'UPDATE Conversations SET updated_at = ?, title = COALESCE(title, ?) WHERE id = ?',
+                    (created_at, default_title, conversation_id)
+                )
+            
+            db_logger.info(f"Added {len(turn_ids)} turns to conversation {conversation_id}")
+            return turn_ids
+        except Exception as e:
+            error_logger.error(f"Error adding turns to conversation {conversation_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_by_conversation(db_path, conversation_id, after_id=0):
+        """Get the turns of a conversation with an ID above after_id, oldest first"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT id, role, content, created_at
+                    FROM ConversationTurns
+                    WHERE conversation_id = ? AND id > ?
+                    ORDER BY id
+                ''', (conversation_id, after_id))
+                
+                turns = [dict(row) for row in cursor.fetchall()]
+            
+            db_logger.info(f"Retrieved {len(turns)} turns of conversation {conversation_id}")
+            return turns
+        except Exception as e:
+            error_logger.error(f"Error fetching turns of conversation {conversation_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def count(db_path, conversation_id, after_id=0):
+        """Count the turns of a conversation with an ID above after_id"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute(
+                    'SELECT COUNT(*) FROM ConversationTurns WHERE conversation_id = ? AND id > ?',
+                    (conversation_id, after_id)
+                )
+                
+                return cursor.fetchone()[0]
+        except Exception as e:
+            error_logger.error(f"Error counting turns of conversation {conversation_id}: {e}", exc_info=True)
+            raise
@@ -1,7 +1,9 @@
-import sqlite3
 from datetime import datetime
-from logging_config import app_logger, error_logger
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
 
+@timed_model
 class Discussion:
     """Discussion model for managing discussion records"""
     
@@ -9,42 +11,74 @@ class Discussion:
     def create(db_path, name, description=None):
         """Create a new discussion"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO Discussions (name, description, created_at, updated_at)
-                VALUES (?, ?, ?, ?)
-            ''', (name, description, datetime.now(), datetime.now()))
-            
-            discussion_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            app_logger.info(f"Discussion created with ID: {discussion_id}")
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    INSERT INTO Discussions (name, description, created_at, updated_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (name, description, datetime.now(), datetime.now()))
+                
+                discussion_id = cursor.lastrowid
+            
+            db_logger.info(f"Discussion created with ID: {discussion_id}")
             return discussion_id
         except Exception as e:
             error_logger.error(f"Error creating discussion: {e}", exc_info=True)
             raise
     
     @staticmethod
-    def get_all(db_path):
+    def get_all(db_path, with_counts=False):
         """Get all discussions"""
+        return Discussion.get_page(db_path, limit=None, with_counts=with_counts)
+    
+    @staticmethod
+    def get_page(db_path, limit=None, after=None, with_counts=False):
+        """
+        Get discussions by most recently updated, one keyset page at a time
+        
+        Args:
+            db_path: Path to the database
+            limit: Maximum number of discussions, or None for all
+            after: (updated_at, id) of the last discussion of the previous page
+            with_counts: Add file_count, chunk_count and total_size of each
+                discussion's files (failed uploads excluded)
+        
+        Returns:
+            List of discussion dicts
+        """
         try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            where = 'WHERE (updated_at, id) < (?, ?)' if after else ''
+            params = list(after) if after else []
+            params.append(limit if limit is not None else -1)
             
-            cursor.execute('''
+            # The page is cut from the (updated_at, id) index first, so the
+            # aggregates only touch the files of the discussions returned
+            page = f'''
                 SELECT id, name, description, created_at, updated_at
                 FROM Discussions
-                ORDER BY updated_at DESC
-            ''')
+                {where}
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            '''
+            if with_counts:
+                query = f'''
+                    SELECT d.id, d.name, d.description, d.created_at, d.updated_at,
+                           COUNT(f.id) AS file_count,
+                           COALESCE(SUM(f.chunk_count), 0) AS chunk_count,
+                           COALESCE(SUM(f.file_size), 0) AS total_size
+                    FROM ({page}) d
+                    LEFT JOIN Files f ON f.discussion_id = d.id AND f.status != 'failed'
+                    GROUP BY d.id
+                    ORDER BY d.updated_at DESC, d.id DESC
+                '''
+            else:
+                query = page
             
-            discussions = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+            with transaction(db_path) as conn:
+                cursor = conn.execute(query, params)
+                
+                discussions = [dict(row) for row in cursor.fetchall()]
             
-            app_logger.info(f"Retrieved {len(discussions)} discussions")
+            db_logger.info(f"Retrieved {len(discussions)} discussions")
             return discussions
         except Exception as e:
             error_logger.error(f"Error fetching discussions: {e}", exc_info=True)
@@ -54,24 +88,20 @@ class Discussion:
     def get_by_id(db_path, discussion_id):
         """Get a discussion by ID"""
         try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, name, description, created_at, updated_at
-                FROM Discussions
-                WHERE id = ?
-            ''', (discussion_id,))
-            
-            discussion = cursor.fetchone()
-            conn.close()
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT id, name, description, created_at, updated_at
+                    FROM Discussions
+                    WHERE id = ?
+                ''', (discussion_id,))
+                
+                discussion = cursor.fetchone()
             
             if discussion:
-                app_logger.info(f"Retrieved discussion ID: {discussion_id}")
+                db_logger.info(f"Retrieved discussion ID: {discussion_id}")
                 return dict(discussion)
             else:
-                app_logger.warning(f"Discussion not found: {discussion_id}")
+                db_logger.warning(f"Discussion not found: {discussion_id}")
                 return None
         except Exception as e:
             error_logger.error(f"Error fetching discussion {discussion_id}: {e}", exc_info=True)
@@ -81,31 +111,27 @@ class Discussion:
     def update(db_path, discussion_id, name=None, description=None):
         """Update a discussion"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Get current discussion
-            cursor.execute('SELECT name, description FROM Discussions WHERE id = ?', (discussion_id,))
-            current = cursor.fetchone()
-            
-            if not current:
-                conn.close()
-                return False
-            
-            # Update with new values or keep current
-            new_name = name if name is not None else current[0]
-            new_description = description if description is not None else current[1]
-            
-            cursor.execute('''
-                UPDATE Discussions
-                SET name = ?, description = ?, updated_at = ?
-                WHERE id = ?
-            ''', (new_name, new_description, datetime.now(), discussion_id))
-            
-            conn.commit()
-            conn.close()
-            
-            app_logger.info(f"Discussion updated: {discussion_id}")
+            with transaction(db_path, write=True) as conn:
+                # Get current discussion
+                current = conn.execute(
+                    'SELECT name, description FROM Discussions WHERE id = ?',
+                    (discussion_id,)
+                ).fetchone()
+                
+                if not current:
+                    return False
+                
+                # Update with new values or keep current
+                new_name = name if name is not None else current[0]
+                new_description = description if description is not None else current[1]
+                
+                conn.execute('''
+                    UPDATE Discussions
+                    SET name = ?, description = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (new_name, new_description, datetime.now(), discussion_id))
+            
+            db_logger.info(f"Discussion updated: {discussion_id}")
             return True
         except Exception as e:
             error_logger.error(f"Error updating discussion {discussion_id}: {e}", exc_info=True)
@@ -115,17 +141,11 @@ class Discussion:
     def delete(db_path, discussion_id):
         """Delete a discussion (cascade deletes files and chunks)"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM Discussions WHERE id = ?', (discussion_id,))
+            with transaction(db_path, write=True) as conn:
+                conn.execute('DELETE FROM Discussions WHERE id = ?', (discussion_id,))
             
-            conn.commit()
-            conn.close()
-            
-            app_logger.info(f"Discussion deleted: {discussion_id}")
+            db_logger.info(f"Discussion deleted: {discussion_id}")
             return True
         except Exception as e:
             error_logger.error(f"Error deleting discussion {discussion_id}: {e}", exc_info=True)
             raise
-
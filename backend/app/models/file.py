@@ -1,66 +1,162 @@
-import sqlite3
+import time
 from datetime import datetime
-from logging_config import app_logger, error_logger
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
 
+@timed_model
 class File:
     """File model for managing file records"""
     
     @staticmethod
-    def create(db_path, discussion_id, filename, file_path, file_size):
-        """Create a new file record"""
+    def create(db_path, discussion_id, filename, file_path, file_size, status='ready',
+               content_hash=None, chunk_count=None):
+        """Create a new file record (referencing the stored content for content_hash)"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    INSERT INTO Files (discussion_id, filename, file_path, file_size, uploaded_at, status,
+                                       content_hash, chunk_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (discussion_id, filename, file_path, file_size, datetime.now(), status,
+                      content_hash, chunk_count))
+                
+                file_id = cursor.lastrowid
             
-            cursor.execute('''
-                INSERT INTO Files (discussion_id, filename, file_path, file_size, uploaded_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (discussion_id, filename, file_path, file_size, datetime.now()))
-            
-            file_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            app_logger.info(f"File record created with ID: {file_id}")
+            db_logger.info(f"File record created with ID: {file_id}")
             return file_id
         except Exception as e:
             error_logger.error(f"Error creating file record: {e}", exc_info=True)
             raise
     
     @staticmethod
-    def get_by_discussion(db_path, discussion_id):
-        """Get all files for a discussion"""
+    def get_by_discussion(db_path, discussion_id, limit=None, after=None):
+        """
+        Get files for a discussion, newest first, one keyset page at a time
+        
+        Args:
+            db_path: Path to the database
+            discussion_id: Discussion the files belong to
+            limit: Maximum number of files, or None for all
+            after: (uploaded_at, id) of the last file of the previous page
+        
+        Returns:
+            List of file dicts
+        """
         try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            where = 'AND (uploaded_at, id) < (?, ?)' if after else ''
+            params = [discussion_id] + (list(after) if after else [])
+            params.append(limit if limit is not None else -1)
             
-            cursor.execute('''
-                SELECT id, discussion_id, filename, file_path, file_size, uploaded_at
-                FROM Files
-                WHERE discussion_id = ?
-                ORDER BY uploaded_at DESC
-            ''', (discussion_id,))
+            with transaction(db_path) as conn:
+                cursor = conn.execute(f'''
+                    SELECT id, discussion_id, filename, file_path, file_size, uploaded_at,
+                           status, error_message, chunk_count, content_hash
+                    FROM Files
+                    WHERE discussion_id = ? {where}
+                    ORDER BY uploaded_at DESC, id DESC
+                    LIMIT ?
+                ''', params)
+                
+                files = [dict(row) for row in cursor.fetchall()]
             
-            files = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            
-            app_logger.info(f"Retrieved {len(files)} files for discussion {discussion_id}")
+            db_logger.info(f"Retrieved {len(files)} files for discussion {discussion_id}")
             return files
         except Exception as e:
             error_logger.error(f"Error fetching files for discussion {discussion_id}: {e}", exc_info=True)
             raise
     
     @staticmethod
-    def count_by_discussion(db_path, discussion_id):
-        """Count files in a discussion"""
+    def get_totals(db_path, discussion_id):
+        """Get file_count, chunk_count and total_size of a discussion's files (failed uploads excluded)"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            with transaction(db_path) as conn:
+                row = conn.execute('''
+                    SELECT COUNT(*) AS file_count,
+                           COALESCE(SUM(chunk_count), 0) AS chunk_count,
+                           COALESCE(SUM(file_size), 0) AS total_size
+                    FROM Files
+                    WHERE discussion_id = ? AND status != 'failed'
+                ''', (discussion_id,)).fetchone()
             
-            cursor.execute('SELECT COUNT(*) FROM Files WHERE discussion_id = ?', (discussion_id,))
-            count = cursor.fetchone()[0]
-            conn.close()
+            return dict(row)
+        except Exception as e:
+            error_logger.error(f"Error fetching file totals for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_by_id(db_path, file_id):
+        """Get a file by ID"""
+        try:
+            with transaction(db_path) as conn:
+                row = conn.execute('''
+                    SELECT id, discussion_id, filename, file_path, file_size, uploaded_at,
+                           status, error_message, chunk_count, content_hash
+                    FROM Files
+                    WHERE id = ?
+                ''', (file_id,)).fetchone()
+            
+            return dict(row) if row else None
+        except Exception as e:
+            error_logger.error(f"Error fetching file {file_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_claimable(db_path, stale_before):
+        """Get the 'processing' files nobody has claimed since stale_before (a time.time() value), oldest first"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT id, discussion_id, filename, file_path, file_size, uploaded_at,
+                           status, error_message, chunk_count, content_hash
+                    FROM Files
+                    WHERE status = 'processing' AND (claimed_by IS NULL OR claimed_at < ?)
+                    ORDER BY id
+                ''', (stale_before,))
+                
+                files = [dict(row) for row in cursor.fetchall()]
+            
+            return files
+        except Exception as e:
+            error_logger.error(f"Error fetching claimable files: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def claim(db_path, file_id, owner, stale_before):
+        """
+        Claim a 'processing' file for one app process to work on
+        
+        Succeeds if the file is unclaimed, already claimed by owner, or its
+        claim is older than stale_before (a time.time() value).
+        
+        Returns:
+            True if owner now holds the claim
+        """
+        try:
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    UPDATE Files
+                    SET claimed_by = ?, claimed_at = ?
+                    WHERE id = ? AND status = 'processing'
+                      AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?)
+                ''', (owner, time.time(), file_id, owner, stale_before))
+                claimed = cursor.rowcount == 1
+            
+            db_logger.info(f"File {file_id} {'claimed by' if claimed else 'not claimed for'} {owner}")
+            return claimed
+        except Exception as e:
+            error_logger.error(f"Error claiming file {file_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def count_by_discussion(db_path, discussion_id):
+        """Count files in a discussion (failed uploads do not count)"""
+        try:
+            with transaction(db_path) as conn:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM Files WHERE discussion_id = ? AND status != 'failed'",
+                    (discussion_id,)
+                ).fetchone()[0]
             
             return count
         except Exception as e:
@@ -68,20 +164,74 @@ class File:
             raise
     
     @staticmethod
-    def delete(db_path, file_id):
-        """Delete a file record"""
+    def get_corpus_version(db_path, discussion_id):
+        """Get a token that changes whenever files are added, removed or finish processing"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            with transaction(db_path) as conn:
+                row = conn.execute('''
+                    SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(status = 'ready'), 0)
+                    FROM Files
+                    WHERE discussion_id = ?
+                ''', (discussion_id,)).fetchone()
             
-            cursor.execute('DELETE FROM Files WHERE id = ?', (file_id,))
+            return f"{row[0]}:{row[1]}:{row[2]}"
+        except Exception as e:
+            error_logger.error(f"Error fetching corpus version for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_content_hashes(db_path, discussion_id):
+        """Get the distinct content hashes of the files in a discussion"""
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT DISTINCT content_hash FROM Files
+                    WHERE discussion_id = ? AND content_hash IS NOT NULL
+                ''', (discussion_id,))
+                
+                content_hashes = [row[0] for row in cursor.fetchall()]
             
-            conn.commit()
-            conn.close()
+            return content_hashes
+        except Exception as e:
+            error_logger.error(f"Error fetching content hashes for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def set_status(db_path, file_id, status, error_message=None, chunk_count=None, owner=None):
+        """
+        Record the processing state of a file
+        
+        With owner, only a file that owner still holds the claim of is updated.
+        
+        Returns:
+            True if the file was updated
+        """
+        try:
+            claimed = 'AND claimed_by = ?' if owner is not None else ''
+            params = [status, error_message, chunk_count, file_id] + ([owner] if owner is not None else [])
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute(f'''
+                    UPDATE Files
+                    SET status = ?, error_message = ?, chunk_count = COALESCE(?, chunk_count)
+                    WHERE id = ? {claimed}
+                ''', params)
+                updated = cursor.rowcount == 1
+            
+            db_logger.info(f"File {file_id} status: {status}" if updated else f"File {file_id} status not updated")
+            return updated
+        except Exception as e:
+            error_logger.error(f"Error updating status of file {file_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def delete(db_path, file_id):
+        """Delete a file record"""
+        try:
+            with transaction(db_path, write=True) as conn:
+                conn.execute('DELETE FROM Files WHERE id = ?', (file_id,))
             
-            app_logger.info(f"File deleted: {file_id}")
+            db_logger.info(f"File deleted: {file_id}")
             return True
         except Exception as e:
             error_logger.error(f"Error deleting file {file_id}: {e}", exc_info=True)
             raise
-
@@ -1,25 +1,42 @@
-import sqlite3
+import re
 from datetime import datetime
-from logging_config import app_logger, error_logger
+from app.services import chunk_codec, text_store
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
 
+# Chunks are stored once per content hash (ContentChunks) and reach a discussion
+# through its Files; this condition keeps only the earliest file with that content
+FIRST_FILE_WITH_CONTENT = '''(
+    SELECT MIN(dup.id) FROM Files dup
+    WHERE dup.discussion_id = f.discussion_id AND dup.content_hash = f.content_hash
+)'''
+
+@timed_model
 class FileChunk:
     """FileChunk model for managing file chunk records"""
     
+    @staticmethod
+    def decode_rows(db_path, rows):
+        """Turn fetched chunk rows into dicts, reading their text from the text store or decompressing it"""
+        chunks = [dict(row) for row in rows]
+        for chunk in chunks:
+            chunk['content'] = text_store.chunk_text(
+                db_path, chunk['content'], chunk['content_hash'], chunk['start_offset'], chunk['end_offset']
+            )
+        return chunks
+    
     @staticmethod
     def create(db_path, file_id, chunk_index, content):
-        """Create a new file chunk"""
+        """Create a chunk of a file's content (a no-op if identical content already stored it)"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO FileChunks (file_id, chunk_index, content, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', (file_id, chunk_index, content, datetime.now()))
-            
-            chunk_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO ContentChunks (content_hash, chunk_index, content, created_at)
+                    SELECT content_hash, ?, ?, ? FROM Files WHERE id = ?
+                ''', (chunk_index, chunk_codec.encode_for_storage(db_path, content), datetime.now(), file_id))
+                
+                chunk_id = cursor.lastrowid
             
             return chunk_id
         except Exception as e:
@@ -27,45 +44,68 @@ class FileChunk:
             raise
     
     @staticmethod
-    def create_batch(db_path, file_id, chunks):
-        """Create multiple chunks for a file"""
+    def create_batch(db_path, file_id, spans, start_index=0):
+        """
+        Create multiple chunks for a file, numbered from start_index
+        
+        Chunks are stored once per content hash, so chunks that identical
+        content already stored are skipped.
+        
+        Args:
+            db_path: Path to the database
+            file_id: File whose content the chunks belong to
+            spans: (start, end) byte offsets of each chunk in the content's
+                stored text (see text_store)
+            start_index: Index of the first chunk
+        """
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            created_at = datetime.now()
+            chunk_data = [
+                (idx, start, end, created_at, file_id)
+                for idx, (start, end) in enumerate(spans, start_index)
+            ]
             
-            chunk_data = [(file_id, idx, content, datetime.now()) for idx, content in enumerate(chunks)]
+            with transaction(db_path, write=True) as conn:
+                conn.executemany('''
+                    INSERT OR IGNORE INTO ContentChunks (content_hash, chunk_index, start_offset, end_offset, created_at)
+                    SELECT content_hash, ?, ?, ?, ? FROM Files WHERE id = ?
+                ''', chunk_data)
             
-            cursor.executemany('''
-                INSERT INTO FileChunks (file_id, chunk_index, content, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', chunk_data)
-            
-            conn.commit()
-            conn.close()
-            
-            app_logger.info(f"Created {len(chunks)} chunks for file {file_id}")
+            db_logger.info(f"Created {len(chunk_data)} chunks for file {file_id}")
             return True
         except Exception as e:
             error_logger.error(f"Error creating batch chunks: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    def delete_by_content(db_path, content_hash):
+        """Delete every chunk of a content hash, before it is chunked again"""
+        try:
+            with transaction(db_path, write=True) as conn:
+                cursor = conn.execute('DELETE FROM ContentChunks WHERE content_hash = ?', (content_hash,))
+                deleted = cursor.rowcount
+            
+            db_logger.info(f"Deleted {deleted} chunks of content {content_hash[:12]}")
+            return deleted
+        except Exception as e:
+            error_logger.error(f"Error deleting chunks of content {content_hash}: {e}", exc_info=True)
+            raise
+    
     @staticmethod
     def get_by_file(db_path, file_id):
         """Get all chunks for a file"""
         try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, file_id, chunk_index, content, created_at
-                FROM FileChunks
-                WHERE file_id = ?
-                ORDER BY chunk_index ASC
-            ''', (file_id,))
-            
-            chunks = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+            with transaction(db_path) as conn:
+                cursor = conn.execute('''
+                    SELECT cc.id, f.id AS file_id, cc.chunk_index, cc.content, cc.content_hash,
+                           cc.start_offset, cc.end_offset, cc.created_at
+                    FROM Files f
+                    JOIN ContentChunks cc ON cc.content_hash = f.content_hash
+                    WHERE f.id = ?
+                    ORDER BY cc.chunk_index ASC
+                ''', (file_id,))
+                
+                chunks = FileChunk.decode_rows(db_path, cursor.fetchall())
             
             return chunks
         except Exception as e:
@@ -73,27 +113,101 @@ class FileChunk:
             raise
     
     @staticmethod
-    def get_by_discussion(db_path, discussion_id):
-        """Get all chunks for all files in a discussion"""
+    def get_by_discussion(db_path, discussion_id, limit=None):
+        """
+        Get all chunks (or the first `limit` chunks) for all files in a discussion
+        
+        Content uploaded more than once to the discussion is returned once, under
+        the earliest of its files.
+        """
         try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            with transaction(db_path) as conn:
+                cursor = conn.execute(f'''
+                    SELECT cc.id, f.id AS file_id, cc.chunk_index, cc.content, cc.content_hash,
+                           cc.start_offset, cc.end_offset, cc.created_at, f.filename
+                    FROM Files f
+                    JOIN ContentChunks cc ON cc.content_hash = f.content_hash
+                    WHERE f.discussion_id = ? AND f.id = {FIRST_FILE_WITH_CONTENT}
+                    ORDER BY f.id ASC, cc.chunk_index ASC
+                    LIMIT ?
+                ''', (discussion_id, limit if limit is not None else -1))
+                
+                chunks = FileChunk.decode_rows(db_path, cursor.fetchall())
             
-            cursor.execute('''
-                SELECT fc.id, fc.file_id, fc.chunk_index, fc.content, fc.created_at, f.filename
-                FROM FileChunks fc
-                JOIN Files f ON fc.file_id = f.id
-                WHERE f.discussion_id = ?
-                ORDER BY f.id ASC, fc.chunk_index ASC
-            ''', (discussion_id,))
+            db_logger.info(f"Retrieved {len(chunks)} chunks for discussion {discussion_id}")
+            return chunks
+        except Exception as e:
+            error_logger.error(f"Error fetching chunks for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def get_by_ids(db_path, discussion_id, chunk_ids):
+        """Get chunks of a discussion by ID, in the order the IDs are given"""
+        if not chunk_ids:
+            return []
+        
+        try:
+            placeholders = ', '.join('?' for _ in chunk_ids)
+            with transaction(db_path) as conn:
+                cursor = conn.execute(f'''
+                    SELECT cc.id, f.id AS file_id, cc.chunk_index, cc.content, cc.content_hash,
+                           cc.start_offset, cc.end_offset, cc.created_at, f.filename
+                    FROM ContentChunks cc
+                    JOIN Files f ON f.discussion_id = ? AND f.content_hash = cc.content_hash
+                    WHERE cc.id IN ({placeholders}) AND f.id = {FIRST_FILE_WITH_CONTENT}
+                ''', [discussion_id] + list(chunk_ids))
+                
+                by_id = {chunk['id']: chunk for chunk in FileChunk.decode_rows(db_path, cursor.fetchall())}
             
-            chunks = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+            return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+        except Exception as e:
+            error_logger.error(f"Error fetching chunks by ID: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def count_by_discussion(db_path, discussion_id):
+        """Count chunks across all files in a discussion"""
+        try:
+            with transaction(db_path) as conn:
+                count = conn.execute(f'''
+                    SELECT COUNT(*)
+                    FROM Files f
+                    JOIN ContentChunks cc ON cc.content_hash = f.content_hash
+                    WHERE f.discussion_id = ? AND f.id = {FIRST_FILE_WITH_CONTENT}
+                ''', (discussion_id,)).fetchone()[0]
             
-            app_logger.info(f"Retrieved {len(chunks)} chunks for discussion {discussion_id}")
+            return count
+        except Exception as e:
+            error_logger.error(f"Error counting chunks for discussion {discussion_id}: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def search(db_path, discussion_id, query, k=8):
+        """Get the k chunks in a discussion that best match a query, ranked by BM25"""
+        # Quote every term so user input is never parsed as FTS5 query syntax
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return []
+        match_expr = ' OR '.join(f'"{term}"' for term in dict.fromkeys(terms))
+        
+        try:
+            with transaction(db_path) as conn:
+                cursor = conn.execute(f'''
+                    SELECT cc.id, f.id AS file_id, cc.chunk_index, cc.content, cc.content_hash,
+                           cc.start_offset, cc.end_offset, cc.created_at, f.filename,
+                           -bm25(ContentChunksFts) AS score
+                    FROM ContentChunksFts
+                    JOIN ContentChunks cc ON cc.id = ContentChunksFts.rowid
+                    JOIN Files f ON f.discussion_id = ? AND f.content_hash = cc.content_hash
+                    WHERE ContentChunksFts MATCH ? AND f.id = {FIRST_FILE_WITH_CONTENT}
+                    ORDER BY bm25(ContentChunksFts)
+                    LIMIT ?
+                ''', (discussion_id, match_expr, k))
+                
+                chunks = FileChunk.decode_rows(db_path, cursor.fetchall())
+            
+            db_logger.info(f"Search matched {len(chunks)} chunks for discussion {discussion_id}")
             return chunks
         except Exception as e:
-            error_logger.error(f"Error fetching chunks for discussion {discussion_id}: {e}", exc_info=True)
+            error_logger.error(f"Error searching chunks for discussion {discussion_id}: {e}", exc_info=True)
             raise
-
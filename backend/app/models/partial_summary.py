@@ -0,0 +1,50 @@
+from datetime import datetime
+from app.services.database_service import transaction
+from app.services.metrics import timed_model
+from logging_config import db_logger, error_logger
+
+@timed_model
+class PartialSummary:
+    """PartialSummary model for map and reduce results of topic summaries, keyed by input hash"""
+    
+    @staticmethod
+    def get_many(db_path, cache_keys):
+        """Get the stored summaries for the given keys as {cache_key: summary}"""
+        if not cache_keys:
+            return {}
+        
+        try:
+            keys = list(cache_keys)
+            found = {}
+            with transaction(db_path) as conn:
+                # Stay under SQLite's bound parameter limit
+                for offset in range(0, len(keys), 500):
+                    batch = keys[offset:offset + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    cursor = conn.execute(
+                        f'SELECT cache_key, summary FROM PartialSummaries WHERE cache_key IN ({placeholders})',
+                        batch
+                    )
+                    found.update((row['cache_key'], row['summary']) for row in cursor.fetchall())
+            
+            return found
+        except Exception as e:
+            error_logger.error(f"Error fetching partial summaries: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def save_many(db_path, summaries):
+        """Store summaries given as {cache_key: summary}"""
+        try:
+            created_at = datetime.now()
+            with transaction(db_path, write=True) as conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO PartialSummaries (cache_key, summary, created_at)
+                    VALUES (?, ?, ?)
+                ''', [(key, summary, created_at) for key, summary in summaries.items()])
+            
+            db_logger.info(f"Stored {len(summaries)} partial summaries")
+            return True
+        except Exception as e:
+            error_logger.error(f"Error storing partial summaries: {e}", exc_info=True)
+            raise
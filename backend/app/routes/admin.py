@@ -0,0 +1,39 @@
+import os
+from flask import Blueprint, request, current_app, send_from_directory
+from app.utils.response_helpers import success_response, error_response
+from logging_config import error_logger
+
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.before_request
+def check_profile_token():
+    """Profiles expose code paths and timings; refuse unless PROFILE_TOKEN is set and matched"""
+    if not current_app.extensions['profiler'].authorized(request.headers):
+        return error_response("Invalid or missing X-Profile-Token", status_code=403)
+
+@admin_bp.route('/profiles', methods=['GET'])
+def list_profiles():
+    """List stored request profiles, newest first"""
+    try:
+        profiler = current_app.extensions['profiler']
+        return success_response(data={
+            'enabled': profiler.enabled,
+            'profiles': profiler.list_profiles()
+        })
+    except Exception as e:
+        error_logger.error(f"Error in list_profiles: {e}", exc_info=True)
+        return error_response("Failed to list profiles", status_code=500)
+
+@admin_bp.route('/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a profile (.collapsed stacks or .pstats)"""
+    try:
+        found = current_app.extensions['profiler'].get_profile(profile_id)
+        if not found:
+            return error_response("Profile not found", status_code=404)
+        
+        directory, filename = found
+        return send_from_directory(os.path.abspath(directory), filename, as_attachment=True)
+    except Exception as e:
+        error_logger.error(f"Error in download_profile: {e}", exc_info=True)
+        return error_response("Failed to download profile", status_code=500)
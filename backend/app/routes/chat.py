@@ -1,15 +1,256 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, Response, request, current_app, stream_with_context
+from app.models.conversation import Conversation
 from app.models.discussion import Discussion
+from app.models.file import File
 from app.models.file_chunk import FileChunk
+from app.services.context_packer import ContextPacker
+from app.services.conversation_service import ConversationService
 from app.services.gemini_service import GeminiService
-from app.utils.response_helpers import success_response, error_response
+from app.services.response_cache import ResponseCache
+from app.services.retrieval_service import RetrievalService
+from app.services.summary_service import SummaryService
+from app.utils.response_helpers import success_response, error_response, sse_event
 from logging_config import app_logger, error_logger
 
 chat_bp = Blueprint('chat', __name__)
 
+def _get_gemini_service():
+    """Get the app-wide Gemini service (it shares the pooled LLM client)"""
+    service = current_app.extensions.get('gemini_service')
+    if service is None:
+        service = GeminiService(current_app.config['LLM_API_KEY'], prompt_cache=current_app.extensions['prompt_cache'])
+        current_app.extensions['gemini_service'] = service
+    return service
+
+def _get_conversation_service():
+    return ConversationService.from_config(_get_gemini_service(), current_app.config)
+
+def _prepare_chat(discussion_id):
+    """
+    Validate a chat request and assemble its prompt context
+    
+    Returns:
+        (error, chat) where error is an error response or None, and chat holds
+        the message, the packed context and the answer cache key
+    """
+    db_path = current_app.config['DATABASE_PATH']
+    
+    # Check if discussion exists
+    discussion = Discussion.get_by_id(db_path, discussion_id)
+    if not discussion:
+        return error_response("Discussion not found", status_code=404), None
+    
+    # Get request data
+    data = request.get_json()
+    if not data or 'message' not in data:
+        return error_response("Message is required", status_code=400), None
+    
+    user_message = data['message'].strip()
+    if not user_message:
+        return error_response("Message cannot be empty", status_code=400), None
+    
+    # A stored conversation supplies its own history; otherwise the client sends it
+    conversation = None
+    summary = None
+    history = data.get('history', [])
+    conversation_id = data.get('conversation_id')
+    if conversation_id is not None:
+        if not isinstance(conversation_id, int) or isinstance(conversation_id, bool):
+            return error_response("conversation_id must be an integer", status_code=400), None
+        conversation = Conversation.get_by_id(db_path, conversation_id)
+        if not conversation or conversation['discussion_id'] != discussion_id:
+            return error_response("Conversation not found", status_code=404), None
+        summary, history = _get_conversation_service().context(db_path, conversation)
+    
+    if FileChunk.count_by_discussion(db_path, discussion_id) == 0:
+        return error_response(
+            "No files uploaded yet. Please upload documents before chatting.",
+            status_code=400
+        ), None
+    
+    return None, _build_chat(db_path, discussion_id, user_message, history, summary, conversation)
+
+def _build_chat(db_path, discussion_id, user_message, history, summary=None, conversation=None,
+                use_prompt_cache=True):
+    """Retrieve and pack the context for one question and derive its answer cache key"""
+    corpus_version = File.get_corpus_version(db_path, discussion_id)
+    packer = ContextPacker.from_config(current_app.config)
+    
+    # A discussion small enough to send whole may have its prompt prefix cached by the API
+    prefix = None
+    if use_prompt_cache:
+        prefix = current_app.extensions['prompt_cache'].get(_get_gemini_service(), db_path, discussion_id, corpus_version)
+    
+    if prefix:
+        packed = {'chunks': prefix['chunks'], 'history': packer.pack_history(history or [])}
+    else:
+        # Retrieve only the chunks most relevant to the question
+        chunks = RetrievalService.retrieve(
+            db_path,
+            discussion_id,
+            user_message,
+            k=current_app.config['RETRIEVAL_TOP_K'],
+            engine=current_app.config['RETRIEVAL_ENGINE']
+        )
+        
+        # Fit the chunks and history into the prompt token budget
+        packed = packer.pack(chunks, history)
+    
+    cache_key = ResponseCache.make_key(
+        corpus_version,
+        packed['chunks'],
+        user_message,
+        packed['history'],
+        summary
+    )
+    
+    return {
+        'discussion_id': discussion_id,
+        'message': user_message,
+        'chunks': packed['chunks'],
+        'history': packed['history'],
+        'summary': summary,
+        'conversation': conversation,
+        'cached_content': prefix['name'] if prefix else None,
+        'cache_key': cache_key
+    }
+
+def _record_turn(chat, answer):
+    """
+    Append a question and its answer to the chat's stored conversation, if any
+    
+    Returns:
+        False if the turn could not be stored (the answer is still returned to
+        the client), True otherwise
+    """
+    if chat['conversation'] is None or answer == GeminiService.ERROR_RESPONSE:
+        return True
+    try:
+        _get_conversation_service().record(
+            current_app.config['DATABASE_PATH'], chat['conversation'], chat['message'], answer
+        )
+        return True
+    except Exception as e:
+        error_logger.error(f"Error recording turn of conversation {chat['conversation']['id']}: {e}", exc_info=True)
+        return False
+
 @chat_bp.route('/<int:discussion_id>/chat', methods=['POST'])
 def send_message(discussion_id):
     """Send a message to the AI chat"""
+    try:
+        error, chat = _prepare_chat(discussion_id)
+        if error:
+            return error
+        
+        response_cache = current_app.extensions['response_cache']
+        gemini_service = _get_gemini_service()
+        
+        # Get AI response
+        try:
+            ai_response = response_cache.get(chat['cache_key'])
+            cached = ai_response is not None
+            if not cached:
+                ai_response = gemini_service.get_chat_response(
+                    user_message=chat['message'],
+                    context_chunks=chat['chunks'],
+                    history=chat['history'],
+                    conversation_summary=chat['summary'],
+                    cached_content=chat['cached_content']
+                )
+                if ai_response != GeminiService.ERROR_RESPONSE:
+                    response_cache.set(chat['cache_key'], ai_response, discussion_id)
+            
+            recorded = _record_turn(chat, ai_response)
+            
+            return success_response(
+                data={
+                    'message': ai_response,
+                    'chunks_used': len(chat['chunks']),
+                    'cached': cached,
+                    'conversation_id': chat['conversation']['id'] if chat['conversation'] else None,
+                    'recorded': recorded
+                }
+            )
+        except Exception as ai_error:
+            error_logger.error(f"AI service error: {ai_error}", exc_info=True)
+            return error_response(
+                "Failed to generate AI response. Please try again.",
+                status_code=500
+            )
+    
+    except Exception as e:
+        error_logger.error(f"Error in send_message: {e}", exc_info=True)
+        return error_response("Failed to process chat message", status_code=500)
+
+@chat_bp.route('/<int:discussion_id>/chat/stream', methods=['POST'])
+def stream_message(discussion_id):
+    """Send a message to the AI chat and stream the answer as server-sent events"""
+    try:
+        error, chat = _prepare_chat(discussion_id)
+        if error:
+            return error
+        
+        response_cache = current_app.extensions['response_cache']
+        gemini_service = _get_gemini_service()
+        chunks_used = len(chat['chunks'])
+        conversation_id = chat['conversation']['id'] if chat['conversation'] else None
+        cached_response = response_cache.get(chat['cache_key'])
+        
+        def generate():
+            yield sse_event({'chunks_used': chunks_used, 'cached': cached_response is not None}, event='start')
+            if cached_response is not None:
+                answer = cached_response
+                yield sse_event({'text': answer})
+            else:
+                try:
+                    fragments = []
+                    for text in gemini_service.stream_chat_response(
+                        user_message=chat['message'],
+                        context_chunks=chat['chunks'],
+                        history=chat['history'],
+                        conversation_summary=chat['summary'],
+                        cached_content=chat['cached_content']
+                    ):
+                        fragments.append(text)
+                        yield sse_event({'text': text})
+                    answer = ''.join(fragments)
+                    if not answer:
+                        # Neither cached nor recorded: a retry should ask the model again
+                        raise ValueError("Gemini API streamed an empty response")
+                    response_cache.set(chat['cache_key'], answer, discussion_id)
+                except Exception as ai_error:
+                    error_logger.error(f"AI streaming error: {ai_error}", exc_info=True)
+                    yield sse_event(
+                        {'message': "Failed to generate AI response. Please try again."},
+                        event='error'
+                    )
+                    return
+            
+            # The body has started, so a failure to store the turn is reported as an event
+            if not _record_turn(chat, answer):
+                yield sse_event(
+                    {'message': "The answer could not be saved to the conversation.", 'conversation_id': conversation_id},
+                    event='error'
+                )
+                return
+            yield sse_event({'chunks_used': chunks_used, 'conversation_id': conversation_id}, event='done')
+        
+        app_logger.info(f"Streaming chat response for discussion {discussion_id}")
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    except Exception as e:
+        error_logger.error(f"Error in stream_message: {e}", exc_info=True)
+        return error_response("Failed to process chat message", status_code=500)
+
+@chat_bp.route('/<int:discussion_id>/chat/batch', methods=['POST'])
+def send_messages(discussion_id):
+    """Answer several independent questions at once, generating the uncached answers concurrently"""
     try:
         db_path = current_app.config['DATABASE_PATH']
         
@@ -18,51 +259,94 @@ def send_message(discussion_id):
         if not discussion:
             return error_response("Discussion not found", status_code=404)
         
-        # Get request data
-        data = request.get_json()
-        if not data or 'message' not in data:
-            return error_response("Message is required", status_code=400)
+        data = request.get_json(silent=True) or {}
+        messages = data.get('messages')
+        if not isinstance(messages, list) or not messages:
+            return error_response("Messages are required", status_code=400)
         
-        user_message = data['message'].strip()
-        if not user_message:
-            return error_response("Message cannot be empty", status_code=400)
+        max_messages = current_app.config['CHAT_BATCH_MAX_MESSAGES']
+        if len(messages) > max_messages:
+            return error_response(f"At most {max_messages} messages per batch", status_code=400)
         
-        history = data.get('history', [])
+        messages = [message.strip() if isinstance(message, str) else '' for message in messages]
+        if not all(messages):
+            return error_response("Messages cannot be empty", status_code=400)
         
-        # Get all chunks for this discussion
-        chunks = FileChunk.get_by_discussion(db_path, discussion_id)
-        
-        if len(chunks) == 0:
+        if FileChunk.count_by_discussion(db_path, discussion_id) == 0:
             return error_response(
                 "No files uploaded yet. Please upload documents before chatting.",
                 status_code=400
             )
         
-        # Initialize Gemini service
-        gemini_service = GeminiService(current_app.config['LLM_API_KEY'])
+        history = data.get('history', [])
+        # Batch calls go through the async client, which has no inline fallback for expired prefixes
+        chats = [
+            _build_chat(db_path, discussion_id, message, history, use_prompt_cache=False)
+            for message in messages
+        ]
         
-        # Get AI response
-        try:
-            ai_response = gemini_service.get_chat_response(
-                user_message=user_message,
-                context_chunks=chunks,
-                history=history
-            )
-            
-            return success_response(
-                data={
-                    'message': ai_response,
-                    'chunks_used': len(chunks)
-                }
+        response_cache = current_app.extensions['response_cache']
+        gemini_service = _get_gemini_service()
+        answers = [response_cache.get(chat['cache_key']) for chat in chats]
+        cached = [answer is not None for answer in answers]
+        
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        if pending:
+            results = gemini_service.generate_many([
+                gemini_service.build_payload(chats[i]['message'], chats[i]['chunks'], chats[i]['history'])
+                for i in pending
+            ], timeout=current_app.config['CHAT_BATCH_CALL_TIMEOUT'] or None)
+            for i, (text, ai_error) in zip(pending, results):
+                if ai_error is not None:
+                    error_logger.error(f"AI service error for batch message {i}: {ai_error!r}")
+                    continue
+                answers[i] = text
+                response_cache.set(chats[i]['cache_key'], text, discussion_id)
+        
+        return success_response(data={'answers': [
+            {
+                'message': answer if answer is not None else GeminiService.ERROR_RESPONSE,
+                'chunks_used': len(chat['chunks']),
+                'cached': was_cached,
+                'failed': answer is None
+            }
+            for chat, answer, was_cached in zip(chats, answers, cached)
+        ]})
+    except Exception as e:
+        error_logger.error(f"Error in send_messages: {e}", exc_info=True)
+        return error_response("Failed to process chat messages", status_code=500)
+
+@chat_bp.route('/<int:discussion_id>/summary', methods=['POST'])
+def summarize_discussion(discussion_id):
+    """Summarize all files of a discussion, optionally focused on a topic"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        
+        # Check if discussion exists
+        discussion = Discussion.get_by_id(db_path, discussion_id)
+        if not discussion:
+            return error_response("Discussion not found", status_code=404)
+        
+        data = request.get_json(silent=True) or {}
+        topic = (data.get('topic') or '').strip() or None
+        
+        if FileChunk.count_by_discussion(db_path, discussion_id) == 0:
+            return error_response(
+                "No files uploaded yet. Please upload documents before summarizing.",
+                status_code=400
             )
+        
+        summary_service = SummaryService.from_config(_get_gemini_service(), current_app.config)
+        try:
+            result = summary_service.summarize(db_path, discussion_id, topic)
         except Exception as ai_error:
-            error_logger.error(f"AI service error: {ai_error}", exc_info=True)
+            error_logger.error(f"AI summary error: {ai_error}", exc_info=True)
             return error_response(
-                "Failed to generate AI response. Please try again.",
+                "Failed to generate summary. Please try again.",
                 status_code=500
             )
         
+        return success_response(data=dict(result, topic=topic))
     except Exception as e:
-        error_logger.error(f"Error in send_message: {e}", exc_info=True)
-        return error_response("Failed to process chat message", status_code=500)
-
+        error_logger.error(f"Error in summarize_discussion: {e}", exc_info=True)
+        return error_response("Failed to summarize discussion", status_code=500)
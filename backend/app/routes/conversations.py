@@ -0,0 +1,89 @@
+from flask import Blueprint, request, current_app
+from app.models.conversation import Conversation
+from app.models.conversation_turn import ConversationTurn
+from app.models.discussion import Discussion
+from app.utils.response_helpers import success_response, error_response
+from logging_config import error_logger
+
+conversations_bp = Blueprint('conversations', __name__)
+
+def _get_conversation(db_path, discussion_id, conversation_id):
+    """Get a conversation if it belongs to the discussion, else None"""
+    conversation = Conversation.get_by_id(db_path, conversation_id)
+    if not conversation or conversation['discussion_id'] != discussion_id:
+        return None
+    return conversation
+
+@conversations_bp.route('/<int:discussion_id>/conversations', methods=['GET'])
+def get_conversations(discussion_id):
+    """Get the conversations of a discussion"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        
+        # Check if discussion exists
+        discussion = Discussion.get_by_id(db_path, discussion_id)
+        if not discussion:
+            return error_response("Discussion not found", status_code=404)
+        
+        conversations = Conversation.get_by_discussion(db_path, discussion_id)
+        return success_response(data=conversations)
+    except Exception as e:
+        error_logger.error(f"Error in get_conversations: {e}", exc_info=True)
+        return error_response("Failed to fetch conversations", status_code=500)
+
+@conversations_bp.route('/<int:discussion_id>/conversations', methods=['POST'])
+def create_conversation(discussion_id):
+    """Start a new conversation in a discussion"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        
+        # Check if discussion exists
+        discussion = Discussion.get_by_id(db_path, discussion_id)
+        if not discussion:
+            return error_response("Discussion not found", status_code=404)
+        
+        data = request.get_json(silent=True) or {}
+        title = (data.get('title') or '').strip() or None
+        
+        conversation_id = Conversation.create(db_path, discussion_id, title)
+        conversation = Conversation.get_by_id(db_path, conversation_id)
+        
+        return success_response(
+            data=conversation,
+            message="Conversation created successfully",
+            status_code=201
+        )
+    except Exception as e:
+        error_logger.error(f"Error in create_conversation: {e}", exc_info=True)
+        return error_response("Failed to create conversation", status_code=500)
+
+@conversations_bp.route('/<int:discussion_id>/conversations/<int:conversation_id>', methods=['GET'])
+def get_conversation(discussion_id, conversation_id):
+    """Get a conversation with all of its turns"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        conversation = _get_conversation(db_path, discussion_id, conversation_id)
+        if not conversation:
+            return error_response("Conversation not found", status_code=404)
+        
+        conversation['turns'] = ConversationTurn.get_by_conversation(db_path, conversation_id)
+        return success_response(data=conversation)
+    except Exception as e:
+        error_logger.error(f"Error in get_conversation: {e}", exc_info=True)
+        return error_response("Failed to fetch conversation", status_code=500)
+
+@conversations_bp.route('/<int:discussion_id>/conversations/<int:conversation_id>', methods=['DELETE'])
+def delete_conversation(discussion_id, conversation_id):
+    """Delete a conversation and its turns"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        conversation = _get_conversation(db_path, discussion_id, conversation_id)
+        if not conversation:
+            return error_response("Conversation not found", status_code=404)
+        
+        Conversation.delete(db_path, conversation_id)
+        
+        return success_response(message="Conversation deleted successfully")
+    except Exception as e:
+        error_logger.error(f"Error in delete_conversation: {e}", exc_info=True)
+        return error_response("Failed to delete conversation", status_code=500)
@@ -1,5 +1,10 @@
 from flask import Blueprint, request, current_app
 from app.models.discussion import Discussion
+from app.models.file import File
+from app.services.database_service import call_after_commit, transaction
+from app.services.ingestion_service import discard_texts
+from app.services.vector_index import vector_index_cache
+from app.utils.pagination import parse_page_args, page_response
 from app.utils.response_helpers import success_response, error_response
 from logging_config import app_logger, error_logger
 
@@ -7,11 +12,23 @@ discussions_bp = Blueprint('discussions', __name__)
 
 @discussions_bp.route('', methods=['GET'])
 def get_discussions():
-    """Get all discussions"""
+    """Get discussions, all at once or a page at a time with ?limit=&cursor="""
     try:
         db_path = current_app.config['DATABASE_PATH']
-        discussions = Discussion.get_all(db_path)
-        return success_response(data=discussions)
+        with_counts = request.args.get('counts', '').lower() in ('1', 'true', 'yes')
+        
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return error_response(str(e), status_code=400)
+        
+        if page is None:
+            discussions = Discussion.get_all(db_path, with_counts=with_counts)
+            return success_response(data=discussions)
+        
+        limit, after = page
+        discussions = Discussion.get_page(db_path, limit + 1, after, with_counts)
+        return success_response(data=page_response(discussions, limit, 'updated_at'))
     except Exception as e:
         error_logger.error(f"Error in get_discussions: {e}", exc_info=True)
         return error_response("Failed to fetch discussions", status_code=500)
@@ -104,8 +121,18 @@ def delete_discussion(discussion_id):
         if not discussion:
             return error_response("Discussion not found", status_code=404)
         
-        # Delete discussion
-        Discussion.delete(db_path, discussion_id)
+        # Delete discussion; content its files alone referred to goes with it. The
+        # hashes are read under the same write lock, so no upload slips in between,
+        # and the caches are only dropped once the delete has committed
+        response_cache = current_app.extensions['response_cache']
+        prompt_cache = current_app.extensions['prompt_cache']
+        with transaction(db_path, write=True):
+            content_hashes = File.get_content_hashes(db_path, discussion_id)
+            Discussion.delete(db_path, discussion_id)
+            call_after_commit(lambda: discard_texts(db_path, content_hashes))
+            call_after_commit(lambda: vector_index_cache.invalidate(db_path, discussion_id))
+            call_after_commit(lambda: prompt_cache.invalidate(db_path, discussion_id))
+            call_after_commit(lambda: response_cache.invalidate_discussion(discussion_id))
         
         return success_response(message="Discussion deleted successfully")
     except Exception as e:
@@ -1,29 +1,64 @@
 from flask import Blueprint, request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from functools import partial
 import os
+import uuid
+from app.models.content_blob import ContentBlob
 from app.models.discussion import Discussion
 from app.models.file import File
 from app.models.file_chunk import FileChunk
 from app.services.file_processor import FileProcessor
+from app.services.database_service import call_after_commit, transaction
+from app.services.ingestion_service import IngestionClaimLostError, discard_texts, ingestion_queue
+from app.services.upload_stream import UploadStream
+from app.services.vector_index import vector_index_cache
+from app.utils.pagination import parse_page_args, page_response
 from app.utils.validators import validate_file_upload, sanitize_filename
 from app.utils.response_helpers import success_response, error_response
 from logging_config import app_logger, error_logger
 
 files_bp = Blueprint('files', __name__)
 
+def _reserve_path(folder, filename):
+    """Create an empty file under filename, or filename_1, filename_2... if taken, and return its path"""
+    base_name, ext = os.path.splitext(filename)
+    counter = 0
+    while True:
+        file_path = os.path.join(folder, f"{base_name}_{counter}{ext}" if counter else filename)
+        try:
+            # O_EXCL makes the check and the claim one step, so concurrent uploads can't collide
+            os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return file_path
+        except FileExistsError:
+            counter += 1
+
 @files_bp.route('/<int:discussion_id>/files', methods=['GET'])
 def get_files(discussion_id):
-    """Get all files for a discussion"""
+    """Get files for a discussion, all at once or a page at a time with ?limit=&cursor="""
     try:
         db_path = current_app.config['DATABASE_PATH']
         
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return error_response(str(e), status_code=400)
+        
         # Check if discussion exists
         discussion = Discussion.get_by_id(db_path, discussion_id)
         if not discussion:
             return error_response("Discussion not found", status_code=404)
         
-        files = File.get_by_discussion(db_path, discussion_id)
-        return success_response(data=files)
+        if page is None:
+            files = File.get_by_discussion(db_path, discussion_id)
+            return success_response(data=files)
+        
+        limit, after = page
+        files = File.get_by_discussion(db_path, discussion_id, limit + 1, after)
+        data = page_response(files, limit, 'uploaded_at')
+        if request.args.get('counts', '').lower() in ('1', 'true', 'yes'):
+            data['totals'] = File.get_totals(db_path, discussion_id)
+        return success_response(data=data)
     except Exception as e:
         error_logger.error(f"Error in get_files: {e}", exc_info=True)
         return error_response("Failed to fetch files", status_code=500)
@@ -39,92 +74,192 @@ def upload_files(discussion_id):
         if not discussion:
             return error_response("Discussion not found", status_code=404)
         
-        # Check if files are in request
-        if 'files' not in request.files:
+        # Files are parsed from the body as it arrives and written straight to disk
+        try:
+            uploads = UploadStream(request.stream, request.content_type, 'files', current_app.config['MAX_FILE_SIZE'])
+        except ValueError:
             return error_response("No files provided", status_code=400)
+        except RequestEntityTooLarge:
+            # Refused from the Content-Length header, before reading the body
+            return error_response("Upload exceeds the maximum request size", status_code=413)
         
-        files = request.files.getlist('files')
-        if not files or len(files) == 0:
-            return error_response("No files selected", status_code=400)
-        
-        # Check file count limit
+        # Check file count limit as files arrive; the ones past it are rejected
         current_file_count = File.count_by_discussion(db_path, discussion_id)
         max_files = current_app.config['MAX_FILES_PER_DISCUSSION']
+        accepted = []
         
-        if current_file_count + len(files) > max_files:
-            return error_response(
-                f"File limit exceeded. Maximum {max_files} files per discussion. "
-                f"Currently {current_file_count} files uploaded.",
-                status_code=400
-            )
+        discussion_folder = os.path.join(
+            current_app.config['UPLOAD_FOLDER'],
+            f"discussion_{discussion_id}"
+        )
+        os.makedirs(discussion_folder, exist_ok=True)
+        
+        def destination(original_filename):
+            # Validate file before any of its bytes are read
+            is_valid, error_msg = validate_file_upload(original_filename)
+            if not is_valid:
+                raise ValueError(error_msg)
+            if current_file_count + len(accepted) >= max_files:
+                raise ValueError(
+                    f"File limit exceeded. Maximum {max_files} files per discussion. "
+                    f"Currently {current_file_count} files uploaded."
+                )
+            file_path = _reserve_path(discussion_folder, sanitize_filename(original_filename))
+            accepted.append(file_path)
+            return file_path
         
         # Process each file
         uploaded_files = []
+        saved_files = []  # (file_id, filename, file_path, file_size, content_hash) awaiting processing
         errors = []
+        received = []
+        async_ingestion = current_app.config['ASYNC_INGESTION']
+        response_cache = current_app.extensions['response_cache']
+        prompt_cache = current_app.extensions['prompt_cache']
         
-        for file in files:
-            try:
-                # Validate file
-                is_valid, error_msg = validate_file_upload(file, current_app.config['MAX_FILE_SIZE'])
-                if not is_valid:
+        def invalidate_caches():
+            # New chunks make the cached retrieval index, prompt prefix and answers stale
+            vector_index_cache.invalidate(db_path, discussion_id)
+            prompt_cache.invalidate(db_path, discussion_id)
+            response_cache.invalidate_discussion(discussion_id)
+        
+        # The body streams in at client speed, so nothing is written to the
+        # database until every part has been received
+        try:
+            for upload in uploads.receive(destination):
+                if upload.error:
+                    if upload.file_path in accepted:
+                        accepted.remove(upload.file_path)
                     errors.append({
-                        'filename': file.filename,
-                        'error': error_msg
+                        'filename': upload.filename,
+                        'error': upload.error
                     })
                     continue
-                
-                # Save file
-                filename = sanitize_filename(file.filename)
-                discussion_folder = os.path.join(
-                    current_app.config['UPLOAD_FOLDER'],
-                    f"discussion_{discussion_id}"
-                )
-                os.makedirs(discussion_folder, exist_ok=True)
-                
-                file_path = os.path.join(discussion_folder, filename)
-                
-                # Handle duplicate filenames
-                counter = 1
-                base_name, ext = os.path.splitext(filename)
-                while os.path.exists(file_path):
-                    filename = f"{base_name}_{counter}{ext}"
-                    file_path = os.path.join(discussion_folder, filename)
-                    counter += 1
-                
-                file.save(file_path)
-                file_size = os.path.getsize(file_path)
-                
-                # Create file record
-                file_id = File.create(db_path, discussion_id, filename, file_path, file_size)
-                
-                # Process file and create chunks
-                try:
-                    chunks = FileProcessor.process_file(file_path)
-                    FileChunk.create_batch(db_path, file_id, chunks)
+                received.append(upload)
+        except (ValueError, RequestEntityTooLarge) as stream_error:
+            # Malformed or truncated body; files received before it are kept
+            error_logger.error(f"Error reading upload: {stream_error}", exc_info=True)
+            errors.append({
+                'filename': 'unknown',
+                'error': f"Upload was interrupted: {stream_error}"
+            })
+        
+        if not received and not errors:
+            return error_response("No files provided", status_code=400)
+        
+        # All file records in one short write transaction
+        try:
+            with transaction(db_path, write=True):
+                for upload in received:
+                    try:
+                        file_path = upload.file_path
+                        filename = os.path.basename(file_path)
+                        file_size, content_hash = upload.size, upload.content_hash
+                        
+                        # Content uploaded before (to any discussion) is already chunked;
+                        # the new record just references it
+                        blob = ContentBlob.get(db_path, content_hash)
+                        if blob and blob['chunk_count'] is not None:
+                            file_id = File.create(
+                                db_path, discussion_id, filename, file_path, file_size,
+                                content_hash=content_hash, chunk_count=blob['chunk_count']
+                            )
+                            uploaded_files.append({
+                                'id': file_id,
+                                'filename': filename,
+                                'size': file_size,
+                                'chunks': blob['chunk_count'],
+                                'deduplicated': True
+                            })
+                            continue
+                        
+                        file_id = File.create(
+                            db_path, discussion_id, filename, file_path, file_size,
+                            status='processing', content_hash=content_hash
+                        )
+                        # Claimed with the record, so recovery in other processes leaves it alone
+                        ingestion_queue.claim(db_path, file_id)
+                        if not async_ingestion:
+                            saved_files.append((file_id, filename, file_path, file_size, content_hash))
+                            continue
+                        
+                        # Hand processing to the background workers once the records are committed
+                        job_id = uuid.uuid4().hex
+                        call_after_commit(partial(
+                            ingestion_queue.submit, db_path, file_id, file_path,
+                            job_id=job_id, on_complete=[invalidate_caches]
+                        ))
+                        uploaded_files.append({
+                            'id': file_id,
+                            'filename': filename,
+                            'size': file_size,
+                            'status': 'processing',
+                            'job_id': job_id
+                        })
                     
-                    uploaded_files.append({
-                        'id': file_id,
-                        'filename': filename,
-                        'size': file_size,
-                        'chunks': len(chunks)
-                    })
-                except Exception as proc_error:
-                    error_logger.error(f"Error processing file {filename}: {proc_error}", exc_info=True)
-                    errors.append({
-                        'filename': filename,
-                        'error': f"Failed to process file: {str(proc_error)}"
-                    })
-                    # Delete file record if processing failed
-                    File.delete(db_path, file_id)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    except Exception as file_error:
+                        error_logger.error(f"Error uploading file: {file_error}", exc_info=True)
+                        errors.append({
+                            'filename': upload.filename,
+                            'error': str(file_error)
+                        })
+                        if os.path.exists(upload.file_path):
+                            os.remove(upload.file_path)
+        except Exception:
+            # No record was kept, so none of the received files are either
+            for upload in received:
+                if os.path.exists(upload.file_path):
+                    os.remove(upload.file_path)
+            raise
+        
+        # Process saved files in parallel (identical content only once) and create chunks;
+        # with nothing to process (e.g. only duplicates) the process pool is left alone
+        paths_by_hash = {}
+        for _, _, file_path, _, content_hash in saved_files:
+            paths_by_hash.setdefault(content_hash, file_path)
+        results = {}
+        if paths_by_hash:
+            results = dict(zip(paths_by_hash, FileProcessor.process_files(db_path, list(paths_by_hash.items()))))
+        
+        for file_id, filename, file_path, file_size, content_hash in saved_files:
+            try:
+                spans, proc_error = results[content_hash]
+                if proc_error is not None:
+                    raise proc_error
+                with transaction(db_path, write=True):
+                    FileChunk.create_batch(db_path, file_id, spans)
+                    ContentBlob.mark_stored(db_path, content_hash, len(spans))
+                    if not File.set_status(db_path, file_id, 'ready', chunk_count=len(spans),
+                                           owner=ingestion_queue.owner):
+                        raise IngestionClaimLostError(f"File {file_id} was claimed by another process")
                 
-            except Exception as file_error:
-                error_logger.error(f"Error uploading file: {file_error}", exc_info=True)
+                uploaded_files.append({
+                    'id': file_id,
+                    'filename': filename,
+                    'size': file_size,
+                    'chunks': len(spans)
+                })
+            except IngestionClaimLostError:
+                # Processing took so long that recovery handed the file to another process
+                uploaded_files.append({
+                    'id': file_id,
+                    'filename': filename,
+                    'size': file_size,
+                    'status': 'processing'
+                })
+            except Exception as proc_error:
+                error_logger.error(f"Error processing file {filename}: {proc_error}", exc_info=True)
                 errors.append({
-                    'filename': file.filename if file else 'unknown',
-                    'error': str(file_error)
+                    'filename': filename,
+                    'error': f"Failed to process file: {str(proc_error)}"
                 })
+                # Delete file record if processing failed
+                File.delete(db_path, file_id)
+                discard_texts(db_path, [content_hash])
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        
+        invalidate_caches()
         
         # Return response
         if len(uploaded_files) == 0 and len(errors) > 0:
@@ -142,13 +277,49 @@ def upload_files(discussion_id):
         if errors:
             response_data['errors'] = errors
         
+        if async_ingestion:
+            return success_response(
+                data=response_data,
+                message=f"Accepted {len(uploaded_files)} file(s) for processing",
+                status_code=202
+            )
+        
         return success_response(
             data=response_data,
             message=f"Successfully uploaded {len(uploaded_files)} file(s)",
             status_code=201
         )
-        
+    
     except Exception as e:
         error_logger.error(f"Error in upload_files: {e}", exc_info=True)
         return error_response("Failed to upload files", status_code=500)
 
+@files_bp.route('/<int:discussion_id>/files/<int:file_id>/status', methods=['GET'])
+def get_file_status(discussion_id, file_id):
+    """Get the processing status of an uploaded file"""
+    try:
+        db_path = current_app.config['DATABASE_PATH']
+        
+        file = File.get_by_id(db_path, file_id)
+        if not file or file['discussion_id'] != discussion_id:
+            return error_response("File not found", status_code=404)
+        
+        status = {
+            'id': file['id'],
+            'filename': file['filename'],
+            'status': file['status'],
+            'chunks': file['chunk_count'],
+            'error': file['error_message'],
+            'progress': 1.0 if file['status'] in ('ready', 'failed') else 0.0
+        }
+        
+        # Running jobs report their current stage
+        job = ingestion_queue.progress(file_id)
+        if job and file['status'] == 'processing':
+            status.update(job_id=job['job_id'], stage=job['stage'], progress=job['progress'])
+        
+        return success_response(data=status)
+    except Exception as e:
+        error_logger.error(f"Error in get_file_status: {e}", exc_info=True)
+        return error_response("Failed to fetch file status", status_code=500)
+
@@ -0,0 +1,248 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.services.context_packer import estimate_tokens
+from app.services.llm_client import LLMDeadlineExceededError, get_llm_client
+from logging_config import llm_logger, error_logger, request_id_var
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets for asyncio callers
+    
+    Waiters are served in arrival order. Token costs are estimated up front and
+    corrected with the usage the API reports, so a burst of long prompts slows
+    the calls after it down instead of running into 429s. A limit of 0 is off.
+    """
+    
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = None
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+    
+    async def acquire(self, tokens):
+        """Wait until one request of about `tokens` tokens may be sent"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        if self.tokens_per_minute:
+            # A prompt larger than a minute's budget still goes, once the bucket is full
+            tokens = min(tokens, self.tokens_per_minute)
+        
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            
+            self._requests -= 1
+            self._tokens -= tokens
+    
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Charge (or refund) the difference between a call's estimate and its reported usage"""
+        if self.tokens_per_minute and actual_tokens is not None:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens - (actual_tokens - estimated_tokens))
+
+class AsyncLLMClient:
+    """
+    asyncio front end to the pooled LLMClient
+    
+    At most max_concurrency calls are in flight, and calls wait for the
+    RateLimiter before they are sent. Each call can have a deadline; cancelling
+    or timing out a call stops waiting for it at once, the HTTP request's read
+    timeout is cut to the time left and no further retries are made. Requests
+    are sent with LLMClient (keeping its retries and circuit breaker) on a
+    thread pool, since no asyncio HTTP library is a dependency.
+    
+    All scheduling runs on one event loop owned by the client, in a background
+    thread. Coroutines may be awaited from any event loop, and synchronous code
+    (such as Flask routes) uses submit() and post_many(). Calls that need the
+    raw response, such as streamed answers, are sent with LLMClient directly
+    after acquire(), so every call shares the same rate limits.
+    """
+    
+    def __init__(self, client=None, max_concurrency=8, requests_per_minute=0, tokens_per_minute=0):
+        self.client = client or get_llm_client()
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm-call')
+        self._semaphore = None
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                # A forked child inherits neither the loop thread nor the executor's threads
+                if self._pid is not None and self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm-call')
+                    self.limiter = RateLimiter(self.limiter.requests_per_minute, self.limiter.tokens_per_minute)
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name='llm-event-loop', daemon=True).start()
+                llm_logger.info(f"Started LLM event loop (max {self.max_concurrency} concurrent calls)")
+            return self._loop
+    
+    async def post(self, url, payload, headers=None, timeout=None):
+        """
+        POST a JSON payload and return the decoded JSON response
+        
+        Args:
+            url: Endpoint to call
+            payload: JSON-serializable request body
+            headers: Request headers
+            timeout: Seconds the whole call (queueing included) may take, or None
+        
+        Raises:
+            asyncio.TimeoutError when the deadline passes, or whatever LLMClient.post raises
+        """
+        loop = self._get_loop()
+        if asyncio.get_running_loop() is not loop:
+            return await asyncio.wrap_future(self.submit(url, payload, headers, timeout))
+        return await self._post(url, payload, headers, timeout)
+    
+    async def _post(self, url, payload, headers, timeout, request_id=None):
+        if request_id:
+            # Tasks run in a copy of the loop's context, so this stays with the call
+            request_id_var.set(request_id)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return await asyncio.wait_for(self._send(url, payload, headers, deadline), timeout)
+    
+    async def _send(self, url, payload, headers, deadline):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        estimated = estimate_tokens(json.dumps(payload))
+        async with self._semaphore:
+            await self.limiter.acquire(estimated)
+            # Tells the worker thread to stop retrying once nobody waits for the result
+            cancelled = threading.Event()
+            post = partial(self.client.post, url, json=payload, headers=headers, deadline=deadline, cancelled=cancelled)
+            try:
+                response = await loop.run_in_executor(self._executor, contextvars.copy_context().run, post)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            data = response.json()
+        
+        self.limiter.record_usage(estimated, data.get('usageMetadata', {}).get('totalTokenCount'))
+        return data
+    
+    def acquire(self, payload, deadline=None):
+        """
+        Wait, from synchronous code, until the rate limiter lets a call with payload through
+        
+        Pass the call's reported token count to record_usage once it is known.
+        
+        Args:
+            payload: JSON-serializable request body (or None)
+            deadline: time.monotonic() value to stop waiting at, or None
+        
+        Returns:
+            The call's estimated token cost
+        
+        Raises:
+            LLMDeadlineExceededError when the deadline passes first
+        """
+        estimated = estimate_tokens(json.dumps(payload))
+        if not self.limiter.requests_per_minute and not self.limiter.tokens_per_minute:
+            return estimated
+        
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        loop = self._get_loop()
+        future = asyncio.run_coroutine_threadsafe(self.limiter.acquire(estimated), loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise LLMDeadlineExceededError("Deadline passed while waiting for the LLM rate limits")
+        return estimated
+    
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Correct the estimate of an acquire()d call with its reported usage"""
+        if actual_tokens is None or not self.limiter.tokens_per_minute:
+            return
+        # The limiter is only touched from the event loop
+        self._get_loop().call_soon_threadsafe(self.limiter.record_usage, estimated_tokens, actual_tokens)
+    
+    def submit(self, url, payload, headers=None, timeout=None):
+        """Schedule a call from synchronous code; returns a concurrent.futures.Future of the JSON response"""
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(
+            self._post(url, payload, headers, timeout, request_id_var.get()), loop
+        )
+    
+    def post_many(self, calls, timeout=None):
+        """
+        Send many calls concurrently and wait for all of them
+        
+        Args:
+            calls: (url, payload, headers) tuples
+            timeout: Deadline in seconds for each call
+        
+        Returns:
+            List of (response JSON, error) pairs in the order of calls, where
+            error is the exception raised for that call or None
+        """
+        futures = [self.submit(url, payload, headers, timeout) for url, payload, headers in calls]
+        results = []
+        try:
+            for future in futures:
+                try:
+                    results.append((future.result(), None))
+                except Exception as e:
+                    results.append((None, e))
+        except BaseException:
+            # The caller is going away (e.g. KeyboardInterrupt): stop the remaining calls
+            for future in futures:
+                future.cancel()
+            raise
+        
+        failed = sum(1 for _, error in results if error is not None)
+        if failed:
+            error_logger.error(f"{failed} of {len(results)} concurrent LLM calls failed")
+        return results
+
+_async_client = None
+_async_client_lock = threading.Lock()
+
+def get_async_llm_client():
+    """Get the process-wide asyncio LLM client, configured from the environment"""
+    global _async_client
+    if _async_client is None:
+        with _async_client_lock:
+            if _async_client is None:
+                _async_client = AsyncLLMClient(
+                    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+                    requests_per_minute=int(os.getenv('LLM_REQUESTS_PER_MINUTE', 0)),
+                    tokens_per_minute=int(os.getenv('LLM_TOKENS_PER_MINUTE', 0))
+                )
+    return _async_client
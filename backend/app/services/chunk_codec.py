@@ -0,0 +1,133 @@
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from logging_config import ingest_logger, error_logger
+
+# 'zlib' stores new chunk content compressed; 'none' stores plain TEXT.
+# Either way both formats are always readable.
+CHUNK_COMPRESSION = os.getenv('CHUNK_COMPRESSION', 'none').lower()
+COMPRESSION_LEVEL = int(os.getenv('CHUNK_COMPRESSION_LEVEL', 6))
+
+# Format byte leading every compressed value; plain TEXT values have none
+RAW_DEFLATE = 1  # followed by a raw deflate stream
+DICTIONARY_DEFLATE = 2  # followed by a 4-byte dictionary id and a raw deflate stream
+
+DICTIONARY_SIZE = 32768  # Deflate can only refer back 32KB, so larger dictionaries are wasted
+DICTIONARY_SEGMENT = 512  # Bytes taken from each sampled chunk when training
+LATEST_DICTIONARY_TTL = 60  # Seconds before checking for a newer dictionary
+
+_dictionaries = {}  # (db_path, dictionary_id) -> bytes
+_latest = {}  # db_path -> (checked_at, dictionary_id)
+_lock = threading.Lock()
+
+def train_dictionary(samples, size=DICTIONARY_SIZE, seed=0):
+    """
+    Build a zlib preset dictionary from sample chunk texts
+    
+    Concatenates segments of randomly ordered samples. Deflate can then encode
+    the words and phrases common to the corpus as back-references even in a
+    chunk of only a few hundred bytes.
+    """
+    rng = random.Random(seed)
+    samples = list(samples)
+    rng.shuffle(samples)
+    
+    segments = []
+    total = 0
+    for sample in samples:
+        data = sample.encode('utf-8')
+        offset = rng.randint(0, max(0, len(data) - DICTIONARY_SEGMENT))
+        segment = data[offset:offset + DICTIONARY_SEGMENT]
+        segments.append(segment)
+        total += len(segment)
+        if total >= size:
+            break
+    return b''.join(segments)[-size:]
+
+def encode(text, dictionary=None, dictionary_id=None, level=COMPRESSION_LEVEL):
+    """Compress chunk text into the stored BLOB format"""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+        header = struct.pack('>BI', DICTIONARY_DEFLATE, dictionary_id)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        header = bytes([RAW_DEFLATE])
+    return header + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+def decode(value, db_path, conn=None):
+    """Get chunk text back from a stored value (plain TEXT is returned as is); see get_dictionary for conn"""
+    if value is None or isinstance(value, str):
+        return value
+    
+    value = bytes(value)
+    if value[0] == RAW_DEFLATE:
+        decompressor = zlib.decompressobj(-15)
+        return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
+    if value[0] == DICTIONARY_DEFLATE:
+        dictionary_id = struct.unpack_from('>I', value, 1)[0]
+        decompressor = zlib.decompressobj(-15, zdict=get_dictionary(db_path, dictionary_id, conn))
+        return (decompressor.decompress(value[5:]) + decompressor.flush()).decode('utf-8')
+    raise ValueError(f"Unknown chunk encoding {value[0]}")
+
+def encode_for_storage(db_path, text):
+    """Encode chunk text as configured by CHUNK_COMPRESSION, using the newest dictionary"""
+    if CHUNK_COMPRESSION != 'zlib':
+        return text
+    dictionary_id = get_latest_dictionary_id(db_path)
+    if dictionary_id is None:
+        return encode(text)
+    return encode(text, get_dictionary(db_path, dictionary_id), dictionary_id)
+
+def get_dictionary(db_path, dictionary_id, conn=None):
+    """
+    Get a stored dictionary, cached for the life of the process (they are never modified)
+    
+    SQL functions pass the connection running their statement, so a dictionary
+    stored earlier in the same transaction is found; other callers read it in
+    the transaction open on their thread, if any.
+    """
+    key = (db_path, dictionary_id)
+    dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        query = 'SELECT dictionary FROM ChunkDictionaries WHERE id = ?'
+        if conn is not None:
+            row = conn.execute(query, (dictionary_id,)).fetchone()
+        else:
+            # Imported here: database_service registers this module's SQL functions
+            from app.services.database_service import transaction
+            with transaction(db_path) as db:
+                row = db.execute(query, (dictionary_id,)).fetchone()
+        if row is None:
+            error_logger.error(f"Chunk dictionary {dictionary_id} not found in {db_path}")
+            raise KeyError(f"Chunk dictionary {dictionary_id} not found")
+        dictionary = bytes(row[0])
+        with _lock:
+            _dictionaries[key] = dictionary
+    return dictionary
+
+def get_latest_dictionary_id(db_path):
+    """ID of the newest dictionary, or None if none has been trained"""
+    now = time.monotonic()
+    cached = _latest.get(db_path)
+    if cached and now - cached[0] < LATEST_DICTIONARY_TTL:
+        return cached[1]
+    
+    from app.services.database_service import transaction
+    with transaction(db_path) as conn:
+        dictionary_id = conn.execute('SELECT MAX(id) FROM ChunkDictionaries').fetchone()[0]
+    with _lock:
+        _latest[db_path] = (now, dictionary_id)
+    return dictionary_id
+
+def store_dictionary(conn, dictionary):
+    """Save a trained dictionary and return its ID"""
+    cursor = conn.execute('INSERT INTO ChunkDictionaries (dictionary) VALUES (?)', (dictionary,))
+    with _lock:
+        # The ID of a dictionary whose transaction rolled back is handed out again
+        for key in [key for key in _dictionaries if key[1] == cursor.lastrowid]:
+            del _dictionaries[key]
+    ingest_logger.info(f"Stored chunk dictionary {cursor.lastrowid} ({len(dictionary)} bytes)")
+    return cursor.lastrowid
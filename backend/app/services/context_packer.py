@@ -0,0 +1,139 @@
+from app.services.file_processor import FileProcessor
+from logging_config import app_logger
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+class ContextPacker:
+    """Assemble ranked chunks and chat history into a prompt of bounded size"""
+    
+    def __init__(self, context_token_budget=24000, history_token_budget=4000):
+        self.context_token_budget = context_token_budget
+        self.history_token_budget = history_token_budget
+    
+    @classmethod
+    def from_config(cls, config):
+        """Create a packer with the budgets from the Flask config"""
+        return cls(
+            context_token_budget=config['CONTEXT_TOKEN_BUDGET'],
+            history_token_budget=config['HISTORY_TOKEN_BUDGET']
+        )
+    
+    def pack(self, chunks, history=None):
+        """
+        Fit ranked chunks and conversation history into the token budgets
+        
+        Args:
+            chunks: Chunk dicts, best match first
+            history: Previous conversation turns, oldest first
+        
+        Returns:
+            Dict with 'chunks' (selected chunks in document order, overlap removed)
+            and 'history' (the most recent turns that fit)
+        """
+        packed_chunks = self.pack_chunks(chunks)
+        packed_history = self.pack_history(history or [])
+        
+        app_logger.info(
+            f"Packed {len(packed_chunks)}/{len(chunks)} chunks and "
+            f"{len(packed_history)}/{len(history or [])} history turns"
+        )
+        return {'chunks': packed_chunks, 'history': packed_history}
+    
+    def pack_chunks(self, chunks):
+        """Select chunks by rank until the context budget is spent"""
+        selected = {}
+        used = 0
+        for chunk in chunks:
+            key = (chunk.get('file_id'), chunk.get('chunk_index'))
+            if key in selected:
+                continue
+            
+            content = chunk.get('content', '')
+            # Text shared with an already selected neighbour is only sent once
+            cost = estimate_tokens(content)
+            previous = selected.get((key[0], key[1] - 1)) if key[1] is not None else None
+            if previous is not None:
+                cost -= estimate_tokens(content[:shared_length(previous, chunk)])
+            
+            if used + cost > self.context_token_budget:
+                continue
+            selected[key] = chunk
+            used += cost
+        
+        # Emit in document order so neighbouring chunks can be stitched together
+        ordered = [selected[key] for key in sorted(selected, key=_document_order)]
+        packed = []
+        for chunk in ordered:
+            content = chunk.get('content', '')
+            if packed and _follows(packed[-1], chunk):
+                content = content[shared_length(packed[-1], chunk):]
+            packed.append(dict(chunk, content=content))
+        return packed
+    
+    def pack_history(self, history):
+        """Keep the most recent turns that fit, truncating the oldest one kept"""
+        kept = []
+        remaining = self.history_token_budget
+        for turn in reversed(history):
+            text = _turn_text(turn)
+            cost = estimate_tokens(text)
+            if cost <= remaining:
+                kept.append(turn)
+                remaining -= cost
+                continue
+            
+            # Keep the tail of the turn that crosses the budget, then stop
+            if remaining > 0:
+                keep_chars = remaining * 4
+                kept.append({
+                    'role': turn.get('role', 'user'),
+                    'parts': [{'text': '...' + text[-keep_chars:]}]
+                })
+            break
+        
+        kept.reverse()
+        return kept
+
+def overlap_length(previous, current, max_overlap=None):
+    """Length of the longest prefix of `current` that is a suffix of `previous`"""
+    if max_overlap is None:
+        # Stripping and boundary search can stretch the overlap slightly
+        max_overlap = FileProcessor.CHUNK_OVERLAP + 50
+    
+    limit = min(len(previous), len(current), max_overlap)
+    for length in range(limit, 0, -1):
+        if previous.endswith(current[:length]):
+            return length
+    return 0
+
+def shared_length(previous, chunk):
+    """
+    Length of the start of a chunk that repeats the end of the chunk before it
+    
+    Chunks that are ranges of the stored text overlap by exactly the bytes
+    between the start of one and the end of the other; for chunks stored with
+    their own text the overlap is searched for.
+    """
+    if previous.get('end_offset') is None or chunk.get('start_offset') is None:
+        return overlap_length(previous['content'], chunk['content'])
+    
+    shared = previous['end_offset'] - chunk['start_offset']
+    if shared <= 0:
+        return 0
+    return len(chunk['content'].encode('utf-8')[:shared].decode('utf-8'))
+
+def _document_order(key):
+    file_id, chunk_index = key
+    return (file_id if file_id is not None else -1, chunk_index if chunk_index is not None else -1)
+
+def _follows(previous, chunk):
+    """Whether a chunk directly follows another chunk of the same file"""
+    if previous.get('chunk_index') is None or chunk.get('chunk_index') is None:
+        return False
+    return previous.get('file_id') == chunk.get('file_id') and \
+        previous['chunk_index'] + 1 == chunk['chunk_index']
+
+def _turn_text(turn):
+    return ''.join(part.get('text', '') for part in turn.get('parts', []))
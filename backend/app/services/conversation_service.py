@@ -0,0 +1,149 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.models.conversation import Conversation
+from app.models.conversation_turn import ConversationTurn
+from app.services.database_service import call_after_commit, transaction
+from logging_config import app_logger, error_logger
+
+COMPACT_PROMPT = """You maintain the running summary of a conversation between a user and an AI assistant about the user's documents.
+
+You are given the current summary (possibly empty) and the turns that followed it.
+Return an updated summary (at most 300 words) that keeps the questions asked, the
+facts, figures and conclusions given in the answers, and anything the user may
+refer back to. Write it in the third person and return only the summary.
+"""
+
+TITLE_LENGTH = 80
+
+class ConversationService:
+    """
+    Chat history kept server-side, with older turns compacted into a summary
+    
+    Each LLM call gets the conversation's running summary plus the turns not
+    yet folded into it (which the ContextPacker still fits into the history
+    budget). Once window_turns + compact_turns turns are unsummarized, a
+    background job folds all but the newest window_turns of them into the
+    summary, so the prompt stays bounded however long the conversation runs.
+    """
+    
+    def __init__(self, gemini_service, window_turns=8, compact_turns=8):
+        self.gemini_service = gemini_service
+        self.window_turns = max(0, window_turns)
+        self.compact_turns = max(1, compact_turns)
+    
+    @classmethod
+    def from_config(cls, gemini_service, config):
+        """Create a conversation service with the settings from the Flask config"""
+        return cls(
+            gemini_service,
+            window_turns=config['CONVERSATION_WINDOW_TURNS'],
+            compact_turns=config['CONVERSATION_COMPACT_TURNS']
+        )
+    
+    def context(self, db_path, conversation):
+        """
+        History to send with the next message of a conversation
+        
+        Returns:
+            (summary, history) where summary is the running summary or None and
+            history holds the unsummarized turns in Gemini contents format
+        """
+        turns = ConversationTurn.get_by_conversation(db_path, conversation['id'], conversation['summarized_through'])
+        history = [{'role': turn['role'], 'parts': [{'text': turn['content']}]} for turn in turns]
+        return conversation['summary'], history
+    
+    def record(self, db_path, conversation, user_message, answer):
+        """
+        Store a question and its answer, and compact the conversation once enough turns piled up
+        
+        Called once the answer is generated, so the write transaction only
+        spans these statements and never the LLM call.
+        """
+        with transaction(db_path, write=True):
+            ConversationTurn.add(
+                db_path, conversation['id'],
+                [('user', user_message), ('model', answer)],
+                default_title=user_message[:TITLE_LENGTH]
+            )
+            
+            unsummarized = ConversationTurn.count(db_path, conversation['id'], conversation['summarized_through'])
+            if unsummarized >= self.window_turns + self.compact_turns:
+                # The job must see the new turns, so it starts once they are committed
+                call_after_commit(lambda: compaction_queue.submit(self, db_path, conversation['id']))
+    
+    def compact(self, db_path, conversation_id):
+        """
+        Fold all but the newest window_turns unsummarized turns into the summary
+        
+        Returns:
+            Number of turns folded (0 if there was nothing to do or another
+            compaction of the conversation finished first)
+        """
+        conversation = Conversation.get_by_id(db_path, conversation_id)
+        if not conversation:
+            return 0
+        
+        turns = ConversationTurn.get_by_conversation(db_path, conversation_id, conversation['summarized_through'])
+        folded = turns[:len(turns) - self.window_turns]
+        if not folded:
+            return 0
+        
+        transcript = '\n\n'.join(
+            f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in folded
+        )
+        prompt = f"Current summary:\n{conversation['summary'] or '(none)'}\n\nNew turns:\n{transcript}"
+        summary = self.gemini_service.generate(prompt, COMPACT_PROMPT)
+        
+        stored = Conversation.set_summary(
+            db_path, conversation_id, summary,
+            summarized_through=folded[-1]['id'],
+            expected_through=conversation['summarized_through']
+        )
+        if not stored:
+            return 0
+        
+        app_logger.info(f"Compacted {len(folded)} turns of conversation {conversation_id}")
+        return len(folded)
+
+class CompactionQueue:
+    """Background worker that compacts conversations, one job per conversation at a time"""
+    
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = set()  # (db_path, conversation_id) queued or running
+        self._lock = threading.Lock()
+    
+    def submit(self, service, db_path, conversation_id):
+        """Queue a compaction unless one is already pending for the conversation"""
+        key = (db_path, conversation_id)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='compact')
+            # The job logs under the request ID of the message that triggered it
+            context = contextvars.copy_context()
+            self._executor.submit(context.run, self._run, service, db_path, conversation_id)
+        return True
+    
+    def _run(self, service, db_path, conversation_id):
+        try:
+            service.compact(db_path, conversation_id)
+        except Exception as e:
+            # The turns stay unsummarized; the next message schedules another attempt
+            error_logger.error(f"Error compacting conversation {conversation_id}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard((db_path, conversation_id))
+    
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and optionally wait for running ones"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+compaction_queue = CompactionQueue()
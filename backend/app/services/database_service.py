@@ -1,58 +1,367 @@
 import sqlite3
 import os
+import threading
+from contextlib import contextmanager
+from functools import partial
+from app.services import chunk_codec, text_store
 from logging_config import app_logger, error_logger
 
+# Pragmas applied to every pooled connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'cache_size': -20000,  # 20MB page cache
+    'mmap_size': 268435456,  # 256MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # milliseconds
+}
+
+# Number of prepared statements cached per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Maximum number of idle connections kept per database
+POOL_MAX_IDLE = int(os.getenv('DB_POOL_MAX_IDLE', 8))
+
+# Schema changes applied in order after the base tables exist;
+# PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+    # 1: ingestion status on Files
+    [
+        "ALTER TABLE Files ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'",
+        "ALTER TABLE Files ADD COLUMN error_message TEXT",
+        "ALTER TABLE Files ADD COLUMN chunk_count INTEGER",
+    ],
+    # 2: content-addressed chunk store shared by files with identical content
+    [
+        "ALTER TABLE Files ADD COLUMN content_hash TEXT",
+        "CREATE INDEX idx_files_discussion_content ON Files(discussion_id, content_hash)",
+        """
+        CREATE TABLE ContentBlobs (
+            content_hash TEXT PRIMARY KEY,
+            chunk_count INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE ContentChunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (content_hash, chunk_index),
+            FOREIGN KEY (content_hash) REFERENCES ContentBlobs(content_hash) ON DELETE CASCADE
+        )
+        """,
+        # Existing files were never hashed, so each keeps its chunks under its own key
+        "UPDATE Files SET content_hash = 'file:' || id",
+        """
+        INSERT INTO ContentBlobs (content_hash, chunk_count, ref_count)
+        SELECT f.content_hash, (SELECT COUNT(*) FROM FileChunks fc WHERE fc.file_id = f.id), 1
+        FROM Files f
+        """,
+        """
+        INSERT INTO ContentChunks (id, content_hash, chunk_index, content, created_at)
+        SELECT id, 'file:' || file_id, chunk_index, content, created_at
+        FROM FileChunks
+        """,
+        "DROP TRIGGER trg_chunks_fts_insert",
+        "DROP TRIGGER trg_chunks_fts_delete",
+        "DROP TRIGGER trg_chunks_fts_update",
+        "DROP TABLE FileChunksFts",
+        "DROP TABLE FileChunks",
+        """
+        CREATE VIRTUAL TABLE ContentChunksFts USING fts5(
+            content,
+            content='ContentChunks',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_insert AFTER INSERT ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_delete AFTER DELETE ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_update AFTER UPDATE OF content ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO ContentChunksFts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        "INSERT INTO ContentChunksFts (ContentChunksFts) VALUES ('rebuild')",
+        # Every file holds a reference to its content; the last one out deletes it
+        """
+        CREATE TRIGGER trg_files_content_ref AFTER INSERT ON Files WHEN new.content_hash IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO ContentBlobs (content_hash) VALUES (new.content_hash);
+            UPDATE ContentBlobs SET ref_count = ref_count + 1 WHERE content_hash = new.content_hash;
+        END
+        """,
+        """
+        CREATE TRIGGER trg_files_content_unref AFTER DELETE ON Files WHEN old.content_hash IS NOT NULL BEGIN
+            UPDATE ContentBlobs SET ref_count = ref_count - 1 WHERE content_hash = old.content_hash;
+            DELETE FROM ContentBlobs WHERE content_hash = old.content_hash AND ref_count <= 0;
+        END
+        """,
+    ],
+    # 3: optionally compressed chunk content; full-text indexing reads it through chunk_text()
+    [
+        """
+        CREATE TABLE ChunkDictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dictionary BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE VIEW ContentChunksText AS SELECT id, chunk_text(content) AS content FROM ContentChunks",
+        "DROP TRIGGER trg_content_chunks_fts_insert",
+        "DROP TRIGGER trg_content_chunks_fts_delete",
+        "DROP TRIGGER trg_content_chunks_fts_update",
+        "DROP TABLE ContentChunksFts",
+        """
+        CREATE VIRTUAL TABLE ContentChunksFts USING fts5(
+            content,
+            content='ContentChunksText',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_insert AFTER INSERT ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (rowid, content) VALUES (new.id, chunk_text(new.content));
+        END
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_delete AFTER DELETE ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content) VALUES ('delete', old.id, chunk_text(old.content));
+        END
+        """,
+        # Re-encoding (compressing) a chunk leaves its text, and so its index entries, unchanged
+        """
+        CREATE TRIGGER trg_content_chunks_fts_update AFTER UPDATE OF content ON ContentChunks
+        WHEN chunk_text(old.content) IS NOT chunk_text(new.content) BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content) VALUES ('delete', old.id, chunk_text(old.content));
+            INSERT INTO ContentChunksFts (rowid, content) VALUES (new.id, chunk_text(new.content));
+        END
+        """,
+        "INSERT INTO ContentChunksFts (ContentChunksFts) VALUES ('rebuild')",
+    ],
+    # 4: indexes for keyset pagination of discussions and files (the rowid breaks ties)
+    [
+        "CREATE INDEX idx_discussions_updated_at ON Discussions(updated_at, id)",
+        "CREATE INDEX idx_files_discussion_uploaded_at ON Files(discussion_id, uploaded_at)",
+    ],
+    # 5: map and reduce results of topic summaries, keyed by a hash of their input
+    [
+        """
+        CREATE TABLE PartialSummaries (
+            cache_key TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ],
+    # 6: server-side chat conversations; turns up to summarized_through are
+    # folded into the running summary
+    [
+        """
+        CREATE TABLE Conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discussion_id INTEGER NOT NULL,
+            title TEXT,
+            summary TEXT,
+            summarized_through INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (discussion_id) REFERENCES Discussions(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX idx_conversations_discussion_updated_at ON Conversations(discussion_id, updated_at)",
+        """
+        CREATE TABLE ConversationTurns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('user', 'model')),
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES Conversations(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX idx_conversation_turns_conversation_id ON ConversationTurns(conversation_id, id)",
+    ],
+    # 7: the text of each content is stored once, in the text store, and new
+    # chunks are byte ranges of it; chunks stored before keep their own content.
+    # The table is rebuilt to make content nullable; rowids, and so the
+    # full-text index, are kept
+    [
+        "DROP TRIGGER trg_content_chunks_fts_insert",
+        "DROP TRIGGER trg_content_chunks_fts_delete",
+        "DROP TRIGGER trg_content_chunks_fts_update",
+        "DROP VIEW ContentChunksText",
+        """
+        CREATE TABLE ContentChunksRanged (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content TEXT,
+            start_offset INTEGER,
+            end_offset INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (content_hash, chunk_index),
+            FOREIGN KEY (content_hash) REFERENCES ContentBlobs(content_hash) ON DELETE CASCADE,
+            CHECK (content IS NOT NULL OR (start_offset IS NOT NULL AND end_offset IS NOT NULL))
+        )
+        """,
+        """
+        INSERT INTO ContentChunksRanged (id, content_hash, chunk_index, content, created_at)
+        SELECT id, content_hash, chunk_index, content, created_at FROM ContentChunks
+        """,
+        "DROP TABLE ContentChunks",
+        "ALTER TABLE ContentChunksRanged RENAME TO ContentChunks",
+        """
+        CREATE VIEW ContentChunksText AS
+        SELECT id, chunk_text(content, content_hash, start_offset, end_offset) AS content FROM ContentChunks
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_insert AFTER INSERT ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (rowid, content)
+            VALUES (new.id, chunk_text(new.content, new.content_hash, new.start_offset, new.end_offset));
+        END
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_delete AFTER DELETE ON ContentChunks BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content)
+            VALUES ('delete', old.id, chunk_text(old.content, old.content_hash, old.start_offset, old.end_offset));
+        END
+        """,
+        """
+        CREATE TRIGGER trg_content_chunks_fts_update AFTER UPDATE OF content, start_offset, end_offset ON ContentChunks
+        WHEN chunk_text(old.content, old.content_hash, old.start_offset, old.end_offset)
+            IS NOT chunk_text(new.content, new.content_hash, new.start_offset, new.end_offset) BEGIN
+            INSERT INTO ContentChunksFts (ContentChunksFts, rowid, content)
+            VALUES ('delete', old.id, chunk_text(old.content, old.content_hash, old.start_offset, old.end_offset));
+            INSERT INTO ContentChunksFts (rowid, content)
+            VALUES (new.id, chunk_text(new.content, new.content_hash, new.start_offset, new.end_offset));
+        END
+        """,
+    ],
+    # 8: the app process working on a 'processing' file, and when it claimed it
+    [
+        "ALTER TABLE Files ADD COLUMN claimed_by TEXT",
+        "ALTER TABLE Files ADD COLUMN claimed_at REAL",
+    ],
+]
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
 def init_db(db_path):
     """Initialize the SQLite database with schema"""
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Create Discussions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Discussions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create Files table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discussion_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                file_size INTEGER,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (discussion_id) REFERENCES Discussions(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Create FileChunks table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS FileChunks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_id INTEGER NOT NULL,
-                chunk_index INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (file_id) REFERENCES Files(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Create indexes for better query performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_discussion_id ON Files(discussion_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON FileChunks(file_id)')
-        
-        conn.commit()
-        conn.close()
+        with transaction(db_path, write=True) as conn:
+            cursor = conn.cursor()
+            
+            # Create Discussions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS Discussions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Create Files table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS Files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    discussion_id INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_size INTEGER,
+                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (discussion_id) REFERENCES Discussions(id) ON DELETE CASCADE
+                )
+            ''')
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_discussion_id ON Files(discussion_id)')
+            
+            # Chunk tables of schema versions before 2; migration 2 moves their
+            # rows into the content-addressed ContentChunks store
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            if version < 2:
+                # Create FileChunks table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS FileChunks (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        file_id INTEGER NOT NULL,
+                        chunk_index INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (file_id) REFERENCES Files(id) ON DELETE CASCADE
+                    )
+                ''')
+                
+                # Create indexes for better query performance
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON FileChunks(file_id)')
+                
+                # Full-text index over chunk content, kept in sync by triggers
+                fts_exists = cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'FileChunksFts'"
+                ).fetchone()
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS FileChunksFts USING fts5(
+                        content,
+                        content='FileChunks',
+                        content_rowid='id',
+                        tokenize='porter unicode61'
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS trg_chunks_fts_insert AFTER INSERT ON FileChunks BEGIN
+                        INSERT INTO FileChunksFts (rowid, content) VALUES (new.id, new.content);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS trg_chunks_fts_delete AFTER DELETE ON FileChunks BEGIN
+                        INSERT INTO FileChunksFts (FileChunksFts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS trg_chunks_fts_update AFTER UPDATE OF content ON FileChunks BEGIN
+                        INSERT INTO FileChunksFts (FileChunksFts, rowid, content) VALUES ('delete', old.id, old.content);
+                        INSERT INTO FileChunksFts (rowid, content) VALUES (new.id, new.content);
+                    END
+                ''')
+                if not fts_exists:
+                    # Index chunks stored before the full-text table existed
+                    cursor.execute("INSERT INTO FileChunksFts (FileChunksFts) VALUES ('rebuild')")
+            
+            # Create ResponseCache table (persistent tier of the chat answer cache)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ResponseCache (
+                    cache_key TEXT PRIMARY KEY,
+                    discussion_id INTEGER NOT NULL,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    FOREIGN KEY (discussion_id) REFERENCES Discussions(id) ON DELETE CASCADE
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_discussion_id ON ResponseCache(discussion_id)')
+            
+            apply_migrations(conn)
         
         app_logger.info(f"Database initialized successfully at {db_path}")
         return True
@@ -60,15 +369,149 @@ def init_db(db_path):
         error_logger.error(f"Error initializing database: {e}", exc_info=True)
         raise
 
+def apply_migrations(conn):
+    """Apply any MIGRATIONS the database has not seen yet"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {number}')
+        app_logger.info(f"Applied database migration {number}")
+
 def get_db_connection(db_path):
-    """Get a database connection"""
+    """Open a new database connection configured with the pool pragmas"""
     try:
-        conn = sqlite3.connect(db_path)
+        # isolation_level=None leaves transaction control to transaction()
+        conn = sqlite3.connect(
+            db_path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row
-        # Enable foreign key support
-        conn.execute('PRAGMA foreign_keys = ON')
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        
+        # Decodes (possibly compressed) chunk content, or reads a chunk's range
+        # of the text store, for full-text indexing. Dictionaries are looked up
+        # through this connection, so one stored in the current transaction is seen
+        conn.create_function('chunk_text', 1, partial(chunk_codec.decode, db_path=db_path, conn=conn))
+        conn.create_function('chunk_text', 4, partial(text_store.chunk_text, db_path, conn=conn))
         return conn
     except Exception as e:
         error_logger.error(f"Error connecting to database: {e}", exc_info=True)
         raise
 
+class ConnectionPool:
+    """Pool of reusable connections for a single database file"""
+    
+    def __init__(self, db_path, max_idle=POOL_MAX_IDLE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take an idle connection or open a new one"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return get_db_connection(self.db_path)
+    
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+def get_pool(db_path):
+    """Get the connection pool for a database, creating it on first use"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    return pool
+
+def call_after_commit(callback):
+    """Run a callback once the current transaction commits (immediately outside one)"""
+    units = getattr(_local, 'active', None)
+    if not units:
+        _run_callback(callback)
+        return
+    # The first unit opened on this thread is the outermost one
+    next(iter(units.values()))['after_commit'].append(callback)
+
+def in_transaction(db_path):
+    """Whether this thread has a transaction open on db_path"""
+    return db_path in (getattr(_local, 'active', None) or {})
+
+def _run_callback(callback):
+    try:
+        callback()
+    except Exception as e:
+        error_logger.error(f"Error in after-commit callback: {e}", exc_info=True)
+
+@contextmanager
+def transaction(db_path, write=False):
+    """
+    Run the enclosed statements atomically as one short unit of work
+    
+    The outermost block on a thread takes a pooled connection, begins a
+    transaction and commits it when the block ends; blocks nested in it become
+    savepoints, so a failing model call only undoes its own statements. Blocks
+    that write pass write=True: their transaction starts with BEGIN IMMEDIATE,
+    which waits (up to busy_timeout) for the write lock instead of failing with
+    SQLITE_BUSY when a read transaction tries to upgrade after another
+    connection committed. Keep LLM calls, uploads and text extraction outside
+    these blocks; the write lock is held until the outermost block ends.
+    """
+    units = getattr(_local, 'active', None)
+    if units is None:
+        units = _local.active = {}
+    
+    unit = units.get(db_path)
+    if unit is not None:
+        if write and not unit['write']:
+            raise RuntimeError("A write transaction cannot be nested in a read transaction; pass write=True to the outer one")
+        conn = unit['conn']
+        conn.execute('SAVEPOINT model_call')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK TO model_call')
+            conn.execute('RELEASE model_call')
+            raise
+        conn.execute('RELEASE model_call')
+        return
+    
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    unit = units[db_path] = {'conn': conn, 'write': write, 'after_commit': []}
+    try:
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        del units[db_path]
+        pool.release(conn)
+    
+    for callback in unit['after_commit']:
+        _run_callback(callback)
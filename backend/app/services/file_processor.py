@@ -1,47 +1,80 @@
 import os
+import re
+import time
 import PyPDF2
 import docx
-from logging_config import app_logger, error_logger
+from app.services import text_store
+from app.services.metrics import file_processing_duration
+from app.services.process_pool import process_pool
+from logging_config import ingest_logger, error_logger
+
+# Match through the last sentence ending / whitespace character of the searched
+# span, backtracking from its end (\s and str.isspace() agree on every code point)
+LAST_SENTENCE_END = re.compile(r'.*[.!?\n]', re.S)
+LAST_WHITESPACE = re.compile(r'.*\s', re.S)
+
+def utf8_length(text):
+    """Length of a text in UTF-8 bytes (ASCII text is measured without encoding it)"""
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
 
 class FileProcessor:
     """Service for processing and chunking files"""
     
-    CHUNK_SIZE = 1000  # Characters per chunk
-    CHUNK_OVERLAP = 200  # Overlap between chunks for context
+    CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 1000))  # Characters per chunk
+    CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 200))  # Overlap between chunks for context
     
     @staticmethod
-    def extract_text_from_pdf(file_path):
-        """Extract text from PDF file"""
+    def iter_text_from_pdf(file_path):
+        """Yield the text of a PDF file page by page"""
         try:
-            text = ""
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 for page in pdf_reader.pages:
                     page_text = page.extract_text()
                     if page_text:
-                        text += page_text + "\n"
-            
-            app_logger.info(f"Extracted {len(text)} characters from PDF: {file_path}")
-            return text
+                        yield page_text + "\n"
         except Exception as e:
             error_logger.error(f"Error extracting text from PDF {file_path}: {e}", exc_info=True)
             raise
     
     @staticmethod
-    def extract_text_from_docx(file_path):
-        """Extract text from DOCX file"""
+    def iter_text_from_docx(file_path):
+        """Yield the text of a DOCX file paragraph by paragraph"""
         try:
             doc = docx.Document(file_path)
-            text = ""
             for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            app_logger.info(f"Extracted {len(text)} characters from DOCX: {file_path}")
-            return text
+                yield paragraph.text + "\n"
         except Exception as e:
             error_logger.error(f"Error extracting text from DOCX {file_path}: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    def iter_text(file_path):
+        """Yield the text of a file in pieces, based on extension"""
+        _, ext = os.path.splitext(file_path)
+        ext = ext.lower()
+        
+        if ext == '.pdf':
+            return FileProcessor.iter_text_from_pdf(file_path)
+        elif ext in ['.docx', '.doc']:
+            return FileProcessor.iter_text_from_docx(file_path)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+    
+    @staticmethod
+    def extract_text_from_pdf(file_path):
+        """Extract text from PDF file"""
+        text = "".join(FileProcessor.iter_text_from_pdf(file_path))
+        ingest_logger.info(f"Extracted {len(text)} characters from PDF: {file_path}")
+        return text
+    
+    @staticmethod
+    def extract_text_from_docx(file_path):
+        """Extract text from DOCX file"""
+        text = "".join(FileProcessor.iter_text_from_docx(file_path))
+        ingest_logger.info(f"Extracted {len(text)} characters from DOCX: {file_path}")
+        return text
+    
     @staticmethod
     def extract_text(file_path):
         """Extract text from file based on extension"""
@@ -56,60 +89,208 @@ class FileProcessor:
             raise ValueError(f"Unsupported file type: {ext}")
     
     @staticmethod
-    def chunk_text(text, chunk_size=None, chunk_overlap=None):
-        """Split text into overlapping chunks"""
+    def chunk_end(text, start, end, offset=0):
+        """
+        Move a chunk end back to a sentence or word boundary
+        
+        Returns the position just after the last sentence ending in
+        (start, end] within 100 characters, else the last whitespace in
+        (start, end] within 50 characters, else end. Each search is a single
+        bounded regex scan in C rather than a per-character Python loop.
+        
+        Args:
+            text: Text holding positions start..end, beginning at position offset
+            start: Start of the chunk
+            end: Tentative end of the chunk (text[end] must exist)
+            offset: Absolute position of text[0]
+        """
+        low = max(start, end - 100) + 1 - offset
+        high = end + 1 - offset
+        match = LAST_SENTENCE_END.match(text, low, high)
+        if match:
+            return match.end() + offset
+        
+        match = LAST_WHITESPACE.match(text, max(start, end - 50) + 1 - offset, high)
+        if match:
+            return match.end() - 1 + offset
+        return end
+    
+    @staticmethod
+    def iter_chunk_spans(pieces, chunk_size=None, chunk_overlap=None):
+        """
+        Split a stream of text pieces into overlapping chunks, with their positions
+        
+        Produces exactly the chunks chunk_text would for the joined text, while
+        holding only the unconsumed tail of the text (about one chunk plus the
+        latest pieces) in memory.
+        
+        Args:
+            pieces: Iterable of text fragments (e.g. pages or paragraphs)
+            chunk_size: Characters per chunk
+            chunk_overlap: Overlap between consecutive chunks
+        
+        Yields:
+            (start, end, chunk) where start and end are the byte offsets of the
+            chunk in the UTF-8 encoding of the joined text
+        """
         if chunk_size is None:
             chunk_size = FileProcessor.CHUNK_SIZE
         if chunk_overlap is None:
             chunk_overlap = FileProcessor.CHUNK_OVERLAP
         
-        if not text or len(text) == 0:
-            return []
-        
-        chunks = []
+        buffer = ""  # Text from absolute position `offset` onwards
+        offset = 0
         start = 0
-        text_length = len(text)
+        pieces = iter(pieces)
+        exhausted = False
+        cursor = 0  # A position in the buffer whose byte offset is known
+        cursor_byte = 0
         
-        while start < text_length:
+        def byte_offset(position):
+            # Byte offset of a position in the buffer, counted from the cursor
+            nonlocal cursor, cursor_byte
+            if position >= cursor:
+                cursor_byte += utf8_length(buffer[cursor - offset:position - offset])
+            else:
+                cursor_byte -= utf8_length(buffer[position - offset:cursor - offset])
+            cursor = position
+            return cursor_byte
+        
+        while True:
+            # A chunk can be placed once the text is known one character past
+            # its furthest possible end (start + chunk_size + 1), or has ended
+            needed = start - offset + chunk_size + 2 - len(buffer)
+            if needed > 0 and not exhausted:
+                # Rebuilding from `start` also drops text no later chunk can reach
+                byte_offset(start)
+                pending = [buffer[start - offset:]]
+                while needed > 0:
+                    piece = next(pieces, None)
+                    if piece is None:
+                        exhausted = True
+                        break
+                    pending.append(piece)
+                    needed -= len(piece)
+                buffer = "".join(pending)
+                offset = start
+            
+            text_length = offset + len(buffer)
+            if start >= text_length:
+                break
+            
             end = start + chunk_size
             
             # If this is not the last chunk, try to break at a sentence or word boundary
             if end < text_length:
-                # Look for sentence boundary (., !, ?)
-                for i in range(end, max(start, end - 100), -1):
-                    if text[i] in '.!?\n':
-                        end = i + 1
-                        break
-                else:
-                    # If no sentence boundary, look for word boundary
-                    for i in range(end, max(start, end - 50), -1):
-                        if text[i].isspace():
-                            end = i
-                            break
+                end = FileProcessor.chunk_end(buffer, start, end, offset)
             
-            chunk = text[start:end].strip()
+            span = buffer[start - offset:end - offset]
+            chunk = span.strip()
             if chunk:
-                chunks.append(chunk)
+                chunk_start = byte_offset(start + len(span) - len(span.lstrip()))
+                yield chunk_start, chunk_start + utf8_length(chunk), chunk
             
             # Move start position with overlap
-            start = end - chunk_overlap if end < text_length else text_length
+            if end >= text_length:
+                break
+            start = end - chunk_overlap
+    
+    @staticmethod
+    def iter_chunks(pieces, chunk_size=None, chunk_overlap=None):
+        """Split a stream of text pieces into overlapping chunks (see iter_chunk_spans)"""
+        for _, _, chunk in FileProcessor.iter_chunk_spans(pieces, chunk_size, chunk_overlap):
+            yield chunk
+    
+    @staticmethod
+    def chunk_text(text, chunk_size=None, chunk_overlap=None):
+        """Split text into overlapping chunks"""
+        if not text or len(text) == 0:
+            return []
+        
+        chunks = list(FileProcessor.iter_chunks([text], chunk_size, chunk_overlap))
         
-        app_logger.info(f"Created {len(chunks)} chunks from text of length {text_length}")
+        ingest_logger.info(f"Created {len(chunks)} chunks from text of length {len(text)}")
         return chunks
     
     @staticmethod
-    def process_file(file_path):
-        """Extract text and create chunks from a file"""
+    def store_text(db_path, content_hash, file_path):
+        """Extract the text of a file into the text store; returns its size in bytes"""
+        file_type = os.path.splitext(file_path)[1].lower().lstrip('.')
+        started = time.perf_counter()
+        size = text_store.write(db_path, content_hash, FileProcessor.iter_text(file_path))
+        file_processing_duration.observe(time.perf_counter() - started, stage='extract', type=file_type)
+        return size
+    
+    @staticmethod
+    def iter_file_chunks(db_path, content_hash, file_path, chunk_size=None, chunk_overlap=None):
+        """
+        Yield the chunks of a file's content, extracting its text unless already stored
+        
+        A content's text is parsed once into the text store; chunking streams it
+        back from there, so stored content can be chunked again with other
+        settings without parsing the file. The time spent chunking is recorded
+        in file_processing_duration once the text is consumed.
+        
+        Yields:
+            (start, end, chunk) as from iter_chunk_spans
+        """
+        file_type = os.path.splitext(file_path)[1].lower().lstrip('.')
+        if not text_store.exists(db_path, content_hash):
+            FileProcessor.store_text(db_path, content_hash, file_path)
+        
+        spans = FileProcessor.iter_chunk_spans(
+            text_store.iter_pieces(db_path, content_hash), chunk_size, chunk_overlap
+        )
+        total = 0.0
+        while True:
+            started = time.perf_counter()
+            span = next(spans, None)
+            total += time.perf_counter() - started
+            if span is None:
+                break
+            yield span
+        
+        file_processing_duration.observe(total, stage='chunk', type=file_type)
+    
+    @staticmethod
+    def process_file(db_path, content_hash, file_path, chunk_size=None, chunk_overlap=None):
+        """
+        Extract the text of a file and chunk it
+        
+        Returns:
+            (start, end) byte offsets of each chunk in the stored text
+        """
         try:
-            # Extract text
-            text = FileProcessor.extract_text(file_path)
+            chunks = FileProcessor.iter_file_chunks(db_path, content_hash, file_path, chunk_size, chunk_overlap)
+            spans = [(start, end) for start, end, _ in chunks]
             
-            # Create chunks
-            chunks = FileProcessor.chunk_text(text)
-            
-            app_logger.info(f"Processed file {file_path}: {len(chunks)} chunks created")
-            return chunks
+            ingest_logger.info(f"Processed file {file_path}: {len(spans)} chunks created")
+            return spans
         except Exception as e:
             error_logger.error(f"Error processing file {file_path}: {e}", exc_info=True)
             raise
-
+    
+    @staticmethod
+    def process_files(db_path, files):
+        """
+        Extract the text of several files and chunk it in parallel
+        
+        Files are spread over the worker processes of the shared process pool so
+        extraction of a multi-file upload uses every core. A single file is
+        processed in the calling process.
+        
+        Args:
+            db_path: Path to the database whose text store receives the text
+            files: (content_hash, file_path) pairs
+        
+        Returns:
+            List of (spans, error) pairs in the order of files, where error is
+            the exception raised for that file or None
+        """
+        if len(files) == 1:
+            try:
+                return [(FileProcessor.process_file(db_path, *files[0]), None)]
+            except Exception as e:
+                return [(None, e)]
+        
+        return process_pool.map(FileProcessor.process_file, [(db_path,) + tuple(item) for item in files])
@@ -1,29 +1,12 @@
 import os
+import json
 import requests
-from logging_config import app_logger, error_logger
+from app.services.async_llm_client import get_async_llm_client
+from app.services.llm_client import get_llm_client
+from app.services.metrics import llm_tokens, prompt_cache_lookups
+from logging_config import llm_logger, error_logger
 
-class GeminiService:
-    """Service for interacting with Gemini LLM API"""
-    
-    def __init__(self, api_key=None):
-        self.api_key = api_key or os.getenv('LLM_API_KEY')
-        self.endpoint = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent'
-    
-    def get_chat_response(self, user_message, context_chunks=None, history=None):
-        """
-        Get AI response for a chat message with document context
-        
-        Args:
-            user_message: The user's question
-            context_chunks: List of document chunks for context
-            history: Previous conversation history
-        
-        Returns:
-            AI response text
-        """
-        
-        # Build system prompt with document context
-        system_prompt = """You are an AI assistant that helps users understand and analyze their documents.
+SYSTEM_PROMPT = """You are an AI assistant that helps users understand and analyze their documents.
 
 Your task is to:
 1. Answer questions based on the provided document content.
@@ -38,44 +21,281 @@ Important Rules:
 - If you're unsure, acknowledge the uncertainty.
 - Keep responses focused and relevant to the user's question.
 """
+
+class GeminiService:
+    """Service for interacting with Gemini LLM API"""
+    
+    ERROR_RESPONSE = "[AI Error]: Unable to generate response. Please try again."
+    
+    # Statuses the API answers with when a cachedContent is expired, deleted or unknown
+    CACHE_MISS_STATUSES = {400, 403, 404}
+    
+    def __init__(self, api_key=None, api_base=None, model=None, client=None, async_client=None, prompt_cache=None):
+        self.api_key = api_key or os.getenv('LLM_API_KEY')
+        self.client = client or get_llm_client()
+        self.async_client = async_client or get_async_llm_client()
+        self.api_base = (api_base or os.getenv('LLM_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')).rstrip('/')
+        self.model = model or os.getenv('LLM_MODEL', 'gemini-2.5-flash')
+        self.endpoint = f'{self.api_base}/models/{self.model}:generateContent'
+        self.stream_endpoint = f'{self.api_base}/models/{self.model}:streamGenerateContent?alt=sse'
+        self.cache_endpoint = f'{self.api_base}/cachedContents'
+        self.prompt_cache = prompt_cache
+    
+    @staticmethod
+    def system_prompt(context_chunks=None):
+        """The system prompt with the document context appended"""
+        system_prompt = SYSTEM_PROMPT
         
         # Add document context to system prompt if available
         if context_chunks and len(context_chunks) > 0:
-            context_text = "\n\n--- Document Content ---\n\n"
-            for chunk in context_chunks:
-                context_text += f"{chunk.get('content', '')}\n\n"
-            context_text += "--- End of Document Content ---\n"
-            system_prompt += context_text
+            context_text = ''.join(f"{chunk.get('content', '')}\n\n" for chunk in context_chunks)
+            system_prompt += (
+                "\n\n--- Document Content ---\n\n"
+                f"{context_text}"
+                "--- End of Document Content ---\n"
+            )
+        return system_prompt
+    
+    def build_payload(self, user_message, context_chunks=None, history=None, conversation_summary=None,
+                      cached_content=None):
+        """
+        Build the generateContent request body for a chat message
         
-        headers = {
-            'Content-Type': 'application/json',
-            'x-goog-api-key': self.api_key
-        }
+        With cached_content, the name of a cached content holding
+        system_prompt(context_chunks), the prefix is not sent again.
+        """
+        summary = None
+        if conversation_summary:
+            # Earlier turns compacted out of the history are carried by their summary
+            summary = (
+                "--- Summary of the earlier conversation ---\n\n"
+                f"{conversation_summary}\n"
+                "--- End of Summary ---\n"
+            )
         
         # Build the contents list
         contents = []
+        if summary and cached_content:
+            # The system instruction is frozen in the cache, so the summary leads the turns
+            contents.append({"role": "user", "parts": [{"text": summary}]})
         if history:
             contents.extend(history)
         
         # Add the current user message
         contents.append({"role": "user", "parts": [{"text": user_message}]})
         
-        payload = {
+        if cached_content:
+            return {"cachedContent": cached_content, "contents": contents}
+        
+        system_prompt = self.system_prompt(context_chunks)
+        if summary:
+            system_prompt += f"\n\n{summary}"
+        return {
             "system_instruction": {
                 "parts": [{"text": system_prompt}]
             },
             "contents": contents
         }
+    
+    def get_chat_response(self, user_message, context_chunks=None, history=None, conversation_summary=None,
+                          cached_content=None):
+        """
+        Get AI response for a chat message with document context
         
+        Args:
+            user_message: The user's question
+            context_chunks: List of document chunks for context (already packed to budget)
+            history: Previous conversation history (already packed to budget)
+            conversation_summary: Running summary of the turns before history, if any
+            cached_content: Name of a cached content holding the prompt prefix for
+                context_chunks, if any (the prefix is sent inline if it is gone)
+        
+        Returns:
+            AI response text
+        """
         try:
-            app_logger.info(f"Sending request to Gemini API")
-            response = requests.post(self.endpoint, json=payload, headers=headers)
-            response.raise_for_status()
+            llm_logger.info(f"Sending request to Gemini API")
+            response, estimated = self._post_chat(
+                self.endpoint, user_message, context_chunks, history, conversation_summary, cached_content
+            )
             data = response.json()
+            self._record_usage(data, estimated)
             ai_text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-            app_logger.info(f"Gemini API response generated successfully")
+            llm_logger.info(f"Gemini API response generated successfully")
             return ai_text
         except Exception as e:
             error_logger.error(f"Gemini API Error: {e}", exc_info=True)
-            return f"[AI Error]: Unable to generate response. Please try again."
-
+            return GeminiService.ERROR_RESPONSE
+    
+    def generate(self, prompt, system_prompt):
+        """
+        Get a single completion for a one-turn prompt
+        
+        Unlike get_chat_response, API errors are raised rather than turned into
+        ERROR_RESPONSE, so callers can tell a failure from an answer.
+        """
+        response, estimated = self._request('POST', self.endpoint, self.prompt_payload(prompt, system_prompt))
+        data = response.json()
+        self._record_usage(data, estimated)
+        return self._response_text(data)
+    
+    def generate_many(self, payloads, timeout=None):
+        """
+        Send many generateContent request bodies concurrently
+        
+        Calls share the process-wide concurrency and rate limits of the async
+        LLM client. Use prompt_payload or build_payload to build the bodies.
+        
+        Args:
+            payloads: Request bodies
+            timeout: Deadline in seconds for each call, or None
+        
+        Returns:
+            List of (text, error) pairs in the order of payloads
+        """
+        llm_logger.info(f"Sending {len(payloads)} concurrent requests to Gemini API")
+        calls = [(self.endpoint, payload, self._headers()) for payload in payloads]
+        results = []
+        for data, error in self.async_client.post_many(calls, timeout):
+            if error is None:
+                self._record_usage(data)
+                try:
+                    results.append((self._response_text(data), None))
+                    continue
+                except ValueError as e:
+                    error = e
+            results.append((None, error))
+        return results
+    
+    @staticmethod
+    def prompt_payload(prompt, system_prompt):
+        """Build the generateContent request body for a one-turn prompt"""
+        return {
+            "system_instruction": {"parts": [{"text": system_prompt}]},
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}]
+        }
+    
+    @staticmethod
+    def _response_text(data):
+        parts = data.get('candidates', [{}])[0].get('content', {}).get('parts', [])
+        text = ''.join(part.get('text', '') for part in parts)
+        if not text:
+            raise ValueError("Gemini API returned an empty response")
+        return text
+    
+    def stream_chat_response(self, user_message, context_chunks=None, history=None, conversation_summary=None,
+                             cached_content=None):
+        """
+        Stream the AI response for a chat message as it is generated
+        
+        Takes the same arguments as get_chat_response and yields text fragments
+        in order. Raises on API errors so the caller can report them mid-stream.
+        """
+        try:
+            llm_logger.info(f"Sending streaming request to Gemini API")
+            usage = None
+            response, estimated = self._post_chat(
+                self.stream_endpoint, user_message, context_chunks, history, conversation_summary, cached_content,
+                stream=True
+            )
+            with response:
+                for line in response.iter_lines():
+                    # Server-sent events: payloads arrive on "data:" lines
+                    if not line or not line.startswith(b'data:'):
+                        continue
+                    data = json.loads(line[len(b'data:'):].decode('utf-8'))
+                    # Usage is reported on the last event (or cumulatively on each)
+                    usage = data.get('usageMetadata', usage)
+                    parts = data.get('candidates', [{}])[0].get('content', {}).get('parts', [])
+                    text = ''.join(part.get('text', '') for part in parts)
+                    if text:
+                        yield text
+            self._record_usage({'usageMetadata': usage}, estimated)
+            llm_logger.info(f"Gemini API streaming response completed")
+        except Exception as e:
+            error_logger.error(f"Gemini API streaming error: {e}", exc_info=True)
+            raise
+    
+    def _post_chat(self, url, user_message, context_chunks, history, conversation_summary, cached_content,
+                   stream=False):
+        """
+        POST a chat request, sending the prompt prefix inline if its cached content is gone
+        
+        Returns:
+            (response, estimated tokens), as _request
+        """
+        # One deadline covers the retry with the prefix inline too
+        deadline = self.client.deadline()
+        payload = self.build_payload(user_message, context_chunks, history, conversation_summary, cached_content)
+        try:
+            return self._request('POST', url, payload, stream=stream, deadline=deadline)
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if not cached_content or status not in self.CACHE_MISS_STATUSES:
+                raise
+        
+        llm_logger.warning(f"Cached content {cached_content} unavailable ({status}), sending the prompt prefix inline")
+        prompt_cache_lookups.inc(outcome='expired')
+        if self.prompt_cache is not None:
+            self.prompt_cache.forget(cached_content)
+        payload = self.build_payload(user_message, context_chunks, history, conversation_summary)
+        return self._request('POST', url, payload, stream=stream, deadline=deadline)
+    
+    def _request(self, method, url, payload=None, stream=False, deadline=None):
+        """
+        Send a request with LLMClient, within the rate limits shared with the async client
+        
+        Returns:
+            (response, estimated tokens); pass the estimate to _record_usage
+            with the response's usage
+        """
+        if deadline is None:
+            # Waiting for the rate limits counts toward the call's deadline
+            deadline = self.client.deadline()
+        estimated = self.async_client.acquire(payload, deadline)
+        response = self.client.request(
+            method, url, json=payload, headers=self._headers(), stream=stream, deadline=deadline
+        )
+        return response, estimated
+    
+    def create_cached_content(self, context_chunks, ttl):
+        """
+        Cache the system prompt for context_chunks on the API side
+        
+        Returns:
+            The cached content's name, to pass as cached_content
+        """
+        body = {
+            "model": f"models/{self.model}",
+            "system_instruction": {"parts": [{"text": self.system_prompt(context_chunks)}]},
+            "ttl": f"{int(ttl)}s"
+        }
+        response, _ = self._request('POST', self.cache_endpoint, body)
+        name = response.json()['name']
+        llm_logger.info(f"Created cached content {name} with a {int(ttl)}s TTL")
+        return name
+    
+    def refresh_cached_content(self, name, ttl):
+        """Push back the expiry of a cached content to ttl seconds from now"""
+        self._request('PATCH', f'{self.api_base}/{name}?updateMask=ttl', {"ttl": f"{int(ttl)}s"})
+    
+    def delete_cached_content(self, name):
+        """Delete a cached content before its TTL runs out"""
+        self._request('DELETE', f'{self.api_base}/{name}')
+        llm_logger.info(f"Deleted cached content {name}")
+    
+    def _record_usage(self, data, estimated=None):
+        """Record the token counts of a response's usageMetadata, correcting the call's estimate if given"""
+        usage = data.get('usageMetadata') or {}
+        if estimated is not None:
+            self.async_client.record_usage(estimated, usage.get('totalTokenCount'))
+        for field, kind in (('promptTokenCount', 'prompt'), ('candidatesTokenCount', 'response'),
+                            ('thoughtsTokenCount', 'thoughts'), ('cachedContentTokenCount', 'cached')):
+            if usage.get(field) is not None:
+                llm_tokens.observe(usage[field], model=self.model, type=kind)
+    
+    def _headers(self):
+        return {
+            'Content-Type': 'application/json',
+            'x-goog-api-key': self.api_key
+        }
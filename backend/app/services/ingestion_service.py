@@ -0,0 +1,263 @@
+import contextvars
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.models.content_blob import ContentBlob
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.services import text_store
+from app.services.database_service import transaction
+from app.services.file_processor import FileProcessor
+from app.services.process_pool import process_pool
+from logging_config import ingest_logger, error_logger
+
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 500))  # Chunks written per INSERT batch
+INGEST_CLAIM_TIMEOUT = int(os.getenv('INGEST_CLAIM_TIMEOUT', 600))  # Seconds before another process may take over a file
+
+class IngestionClaimLostError(Exception):
+    """Raised when another app process took over a file while it was being processed"""
+
+def ingest_file(db_path, file_id, file_path, owner=None, batch_size=INGEST_BATCH_SIZE):
+    """
+    Extract, chunk and store a file
+    
+    Extraction and chunking run outside any transaction; only the chunk
+    offsets (never the chunk text) are kept in memory until they are written.
+    The chunks and the file's 'ready' status are then committed in one short
+    write transaction. Content another file already stored is not parsed again.
+    
+    With owner, nothing is committed unless owner still holds the file's claim.
+    
+    Returns:
+        Number of chunks stored
+    
+    Raises:
+        IngestionClaimLostError if the claim has passed to another process
+    """
+    content_hash = File.get_by_id(db_path, file_id)['content_hash']
+    blob = ContentBlob.get(db_path, content_hash)
+    if blob and blob['chunk_count'] is not None:
+        if not File.set_status(db_path, file_id, 'ready', chunk_count=blob['chunk_count'], owner=owner):
+            raise IngestionClaimLostError(f"File {file_id} was claimed by another process")
+        return blob['chunk_count']
+    
+    spans = FileProcessor.process_file(db_path, content_hash, file_path)
+    with transaction(db_path, write=True):
+        chunk_count = store_chunks(db_path, file_id, content_hash, spans, batch_size)
+        if not File.set_status(db_path, file_id, 'ready', chunk_count=chunk_count, owner=owner):
+            # Rolls the chunks back too; the new owner stores its own
+            raise IngestionClaimLostError(f"File {file_id} was claimed by another process")
+    
+    return chunk_count
+
+def store_chunks(db_path, file_id, content_hash, spans, batch_size=INGEST_BATCH_SIZE):
+    """
+    Replace a content's chunks with the given spans, in one write transaction
+    
+    The spans come from FileProcessor.process_file, which must run first and
+    outside the transaction: parsing a large PDF would otherwise hold the write
+    lock. Offsets are inserted in batches of batch_size.
+    
+    Returns:
+        Number of chunks stored
+    """
+    with transaction(db_path, write=True):
+        FileChunk.delete_by_content(db_path, content_hash)
+        for start_index in range(0, len(spans), batch_size):
+            FileChunk.create_batch(db_path, file_id, spans[start_index:start_index + batch_size], start_index=start_index)
+        ContentBlob.mark_stored(db_path, content_hash, len(spans))
+    
+    return len(spans)
+
+def discard_texts(db_path, content_hashes):
+    """
+    Delete the stored texts of content no file refers to any more (run once the delete is committed)
+    
+    The check and the removal hold the write lock, so no upload of the same
+    content can commit its file (and then find the text about to be removed)
+    in between.
+    """
+    with transaction(db_path, write=True):
+        for content_hash in ContentBlob.get_missing(db_path, content_hashes):
+            try:
+                text_store.remove(db_path, content_hash)
+            except OSError as e:
+                error_logger.error(f"Error removing stored text of content {content_hash}: {e}", exc_info=True)
+
+class IngestionQueue:
+    """Background worker pool that extracts, chunks and stores uploaded files"""
+    
+    # Progress reported at the start of each stage
+    STAGES = {
+        'queued': 0.0,
+        'processing': 0.1,
+        'ready': 1.0,
+        'failed': 1.0,
+    }
+    
+    def __init__(self, max_workers=2, claim_timeout=INGEST_CLAIM_TIMEOUT):
+        self.max_workers = max_workers
+        self.claim_timeout = claim_timeout
+        self._owner = None
+        self._owner_pid = None
+        self._executor = None
+        self._jobs = {}  # file_id -> job progress dict
+        self._lock = threading.Lock()
+    
+    @property
+    def owner(self):
+        """Name this process claims files under (a forked child gets its own)"""
+        with self._lock:
+            if self._owner_pid != os.getpid():
+                self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                self._owner_pid = os.getpid()
+            return self._owner
+    
+    def claim(self, db_path, file_id):
+        """Claim a 'processing' file for this process, unless another one holds a live claim"""
+        return File.claim(db_path, file_id, self.owner, time.time() - self.claim_timeout)
+    
+    def submit(self, db_path, file_id, file_path, job_id=None, on_complete=None):
+        """
+        Queue a stored file for processing
+        
+        The file is claimed for this process first (see claim); a file another
+        process holds is left to it.
+        
+        Args:
+            db_path: Path to the SQLite database
+            file_id: ID of the Files row (created with status 'processing')
+            file_path: Where the upload was saved
+            job_id: Job ID to report (generated if not given)
+            on_complete: Callables run after the file is ready or has failed
+        
+        Returns:
+            The job ID, or None if another process holds the file
+        """
+        if not self.claim(db_path, file_id):
+            ingest_logger.info(f"File {file_id} is being processed by another process")
+            return None
+        
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            self._jobs[file_id] = {'job_id': job_id, 'stage': 'queued', 'progress': 0.0}
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ingest')
+            # The job logs under the request ID of the upload that queued it
+            context = contextvars.copy_context()
+            self._executor.submit(context.run, self._run, db_path, file_id, file_path, on_complete or [])
+        
+        ingest_logger.info(f"Queued ingestion job {job_id} for file {file_id}")
+        return job_id
+    
+    def recover(self, db_path, on_complete=None):
+        """
+        Queue again the files a crash or restart left in 'processing'
+        
+        Jobs only live in memory, so without this those files would stay
+        'processing' (and block chat on their discussion) forever. Only files
+        nobody has claimed for claim_timeout seconds are taken, so files other
+        live processes are working on are left alone. Those whose upload is
+        still on disk are processed again; the others are marked failed.
+        
+        Args:
+            db_path: Path to the SQLite database
+            on_complete: Called with the discussion ID after each file is ready
+                or has failed
+        
+        Returns:
+            (requeued, failed) counts
+        """
+        requeued = failed = 0
+        for file in File.get_claimable(db_path, time.time() - self.claim_timeout):
+            if self.progress(file['id']) is not None:
+                continue
+            if os.path.exists(file['file_path']):
+                callbacks = [partial(on_complete, file['discussion_id'])] if on_complete else []
+                if self.submit(db_path, file['id'], file['file_path'], on_complete=callbacks):
+                    requeued += 1
+            elif self.claim(db_path, file['id']):
+                File.set_status(db_path, file['id'], 'failed', owner=self.owner,
+                                error_message="Processing was interrupted and the upload is gone; upload it again")
+                failed += 1
+        
+        if requeued or failed:
+            ingest_logger.warning(f"Recovered interrupted ingestion: {requeued} files queued again, {failed} failed")
+        return requeued, failed
+    
+    def start_recovery(self, db_path, on_complete=None):
+        """
+        Recover stranded files now, and again once claim_timeout has passed
+        
+        Files a process was working on when it died are only taken over after
+        their claim times out, so a process restarted straight after a crash
+        picks them up on the second pass.
+        """
+        self.recover(db_path, on_complete)
+        timer = threading.Timer(self.claim_timeout + 1, self._recover_quietly, args=(db_path, on_complete))
+        timer.daemon = True
+        timer.start()
+    
+    def _recover_quietly(self, db_path, on_complete):
+        try:
+            self.recover(db_path, on_complete)
+        except Exception as e:
+            error_logger.error(f"Error recovering stranded ingestion jobs: {e}", exc_info=True)
+    
+    def progress(self, file_id):
+        """Progress of a queued or running job, or None if the file has no job"""
+        with self._lock:
+            job = self._jobs.get(file_id)
+            return dict(job) if job else None
+    
+    def _set_stage(self, file_id, stage):
+        with self._lock:
+            job = self._jobs.get(file_id)
+            if job:
+                job['stage'] = stage
+                job['progress'] = self.STAGES[stage]
+    
+    def _run(self, db_path, file_id, file_path, on_complete):
+        try:
+            # Extraction is CPU-bound, so it runs in a worker process off the GIL;
+            # the worker extracts and chunks, then writes all the chunks in one transaction
+            self._set_stage(file_id, 'processing')
+            chunk_count = process_pool.run(ingest_file, db_path, file_id, file_path, self.owner)
+            
+            self._set_stage(file_id, 'ready')
+            ingest_logger.info(f"Ingested file {file_id}: {chunk_count} chunks")
+        except IngestionClaimLostError as e:
+            # The process that took the file over records its outcome
+            ingest_logger.warning(f"Gave up ingesting file {file_id}: {e}")
+        except Exception as e:
+            error_logger.error(f"Error ingesting file {file_id}: {e}", exc_info=True)
+            self._set_stage(file_id, 'failed')
+            try:
+                failed = File.set_status(db_path, file_id, 'failed', owner=self.owner,
+                                         error_message=f"Failed to process file: {str(e)}")
+                if failed and os.path.exists(file_path):
+                    os.remove(file_path)
+            except Exception as cleanup_error:
+                error_logger.error(f"Error recording failure of file {file_id}: {cleanup_error}", exc_info=True)
+        finally:
+            # The Files row now holds the final state
+            with self._lock:
+                self._jobs.pop(file_id, None)
+            for callback in on_complete:
+                try:
+                    callback()
+                except Exception as e:
+                    error_logger.error(f"Error in ingestion callback for file {file_id}: {e}", exc_info=True)
+    
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and optionally wait for running ones"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+ingestion_queue = IngestionQueue(int(os.getenv('INGESTION_WORKERS', 2)))
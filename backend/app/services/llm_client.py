@@ -0,0 +1,222 @@
+import os
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from app.services.metrics import llm_duration, llm_retries
+from logging_config import llm_logger, error_logger
+
+# Model and method of a Gemini-style endpoint URL, used as metric labels
+ENDPOINT_PATTERN = re.compile(r'/models/([^/:?]+):(\w+)')
+CACHE_ENDPOINT_PATTERN = re.compile(r'/cachedContents\b')
+
+class CircuitBreakerOpenError(Exception):
+    """Raised when the circuit breaker is rejecting calls to the LLM API"""
+
+class LLMCallCancelledError(Exception):
+    """Raised when a call is abandoned by its caller before it could complete"""
+
+class LLMDeadlineExceededError(Exception):
+    """Raised when too little time is left before a call's deadline to attempt it"""
+
+class CircuitBreaker:
+    """Stop calling an upstream that keeps failing, then probe it again after a cool-down"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def allow_request(self):
+        """Whether a call may go through now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let a single probe through; its outcome closes or re-opens the circuit
+                self.state = self.HALF_OPEN
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    error_logger.error(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class LLMClient:
+    """Pooled HTTP client for LLM APIs with timeouts, retries and a circuit breaker"""
+    
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, connect_timeout=5.0, read_timeout=120.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=20.0, pool_size=20, breaker=None,
+                 total_timeout=150.0, min_attempt_time=1.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.total_timeout = total_timeout
+        self.min_attempt_time = min_attempt_time
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        
+        # Keep-alive connections are shared by every thread using the client
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def post(self, url, json=None, headers=None, stream=False, deadline=None, cancelled=None):
+        """POST to the LLM API; see request"""
+        return self.request('POST', url, json, headers, stream, deadline, cancelled)
+    
+    def deadline(self):
+        """A deadline total_timeout seconds from now, or None without a total timeout"""
+        if not self.total_timeout:
+            return None
+        return time.monotonic() + self.total_timeout
+    
+    def request(self, method, url, json=None, headers=None, stream=False, deadline=None, cancelled=None):
+        """
+        Send a request with retries on connection errors, timeouts, 429 and 5xx
+        
+        deadline, a time.monotonic() value (by default total_timeout from now),
+        bounds the attempts, their backoff and each attempt's read timeout
+        together; no attempt starts with less than min_attempt_time left.
+        Setting the cancelled threading.Event stops retries too. When streaming,
+        the deadline covers getting the response, not reading its body.
+        Returns the successful response (the caller closes it when streaming).
+        Raises requests.HTTPError for non-retryable or exhausted error statuses,
+        the last connection error when retries run out, CircuitBreakerOpenError,
+        LLMDeadlineExceededError or LLMCallCancelledError.
+        """
+        if deadline is None:
+            deadline = self.deadline()
+        match = ENDPOINT_PATTERN.search(url)
+        if match:
+            model, endpoint = match.groups()
+        elif CACHE_ENDPOINT_PATTERN.search(url):
+            model, endpoint = 'unknown', f'cachedContents.{method.lower()}'
+        else:
+            model, endpoint = 'unknown', 'unknown'
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return self._request(method, url, json, headers, stream, deadline, cancelled, model)
+        except Exception as e:
+            outcome = e.__class__.__name__
+            raise
+        finally:
+            llm_duration.observe(time.perf_counter() - started, model=model, method=endpoint, outcome=outcome)
+    
+    def _request(self, method, url, json, headers, stream, deadline, cancelled, model):
+        for attempt in range(self.max_retries + 1):
+            if cancelled is not None and cancelled.is_set():
+                raise LLMCallCancelledError("LLM call was cancelled")
+            # Checked before the breaker, so a doomed call does not use up the half-open probe
+            if deadline is not None and deadline - time.monotonic() < self.min_attempt_time:
+                raise LLMDeadlineExceededError("Too little time left before the LLM call's deadline")
+            if not self.breaker.allow_request():
+                raise CircuitBreakerOpenError("LLM API circuit breaker is open")
+            
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, json=json, headers=headers, timeout=self._timeout(deadline), stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                delay = self._backoff(attempt)
+                if last_attempt or not self._can_retry(delay, deadline, cancelled):
+                    raise
+                llm_retries.inc(model=model, reason=e.__class__.__name__)
+                llm_logger.warning(f"LLM request failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                self._sleep(delay, cancelled)
+                continue
+            except Exception:
+                # Not retried, but every attempt records an outcome, or a half-open probe would never end
+                self.breaker.record_failure()
+                raise
+            
+            if response.status_code in self.RETRY_STATUSES:
+                self.breaker.record_failure()
+                delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                response.close()
+                if last_attempt or not self._can_retry(delay, deadline, cancelled):
+                    response.raise_for_status()
+                llm_retries.inc(model=model, reason=response.status_code)
+                llm_logger.warning(f"LLM request returned {response.status_code}, retrying in {delay:.2f}s")
+                self._sleep(delay, cancelled)
+                continue
+            
+            # Anything else (including 4xx client errors) means the upstream is healthy
+            self.breaker.record_success()
+            if response.status_code >= 400:
+                # Release a streamed error response's connection; the status is all the caller gets
+                response.close()
+                response.raise_for_status()
+            return response
+    
+    def _timeout(self, deadline):
+        """(connect, read) timeouts, with the read timeout cut to the time left before deadline"""
+        if deadline is None:
+            return self.timeout
+        return (self.timeout[0], max(0.1, min(self.timeout[1], deadline - time.monotonic())))
+    
+    def _can_retry(self, delay, deadline, cancelled):
+        """Whether another attempt, after sleeping delay seconds, still has time to run"""
+        if cancelled is not None and cancelled.is_set():
+            return False
+        return deadline is None or time.monotonic() + delay + self.min_attempt_time <= deadline
+    
+    @staticmethod
+    def _sleep(delay, cancelled):
+        if cancelled is not None:
+            cancelled.wait(delay)
+        else:
+            time.sleep(delay)
+    
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, honouring a numeric Retry-After header"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Get the process-wide LLM client, configured from the environment"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient(
+                    connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', 5)),
+                    read_timeout=float(os.getenv('LLM_READ_TIMEOUT', 120)),
+                    max_retries=int(os.getenv('LLM_MAX_RETRIES', 3)),
+                    total_timeout=float(os.getenv('LLM_TOTAL_TIMEOUT', 150)),
+                    breaker=CircuitBreaker(
+                        failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', 5)),
+                        reset_timeout=float(os.getenv('LLM_BREAKER_RESET', 30))
+                    )
+                )
+    return _client
@@ -0,0 +1,211 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cached SQLite read up to a long LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 1048576)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    """Monotonic count per label set"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+    
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+    
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+class Histogram:
+    """Bucketed distribution (with sum and count) per label set"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the enclosed block takes (also when it raises)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+    
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+    
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text exposition format
+    
+    Every process keeps its own values. Work done in process pool workers is
+    drained there and merged here with the task's result; with several server
+    processes, each one reports only its own requests.
+    """
+    
+    def __init__(self):
+        self._metrics = {}
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def render(self):
+        """All metrics as Prometheus text"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+    
+    def drain(self):
+        """Take (and reset) every value recorded so far, e.g. to ship it to another process"""
+        return {name: metric.drain() for name, metric in self._metrics.items()}
+    
+    def merge(self, drained):
+        """Add values taken with drain() to this registry"""
+        for name, values in drained.items():
+            if values and name in self._metrics:
+                self._metrics[name].merge(values)
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds',
+    'Time to handle an API request (until the first byte of streamed responses)',
+    ('method', 'route', 'status')
+)
+db_duration = registry.histogram(
+    'db_operation_duration_seconds',
+    'Time spent in database model methods, lock waits included',
+    ('model', 'method')
+)
+file_processing_duration = registry.histogram(
+    'file_processing_duration_seconds',
+    'Time spent extracting text from a file and chunking it',
+    ('stage', 'type')
+)
+llm_duration = registry.histogram(
+    'llm_request_duration_seconds',
+    'Time of an LLM API call, retries included (until the response headers when streamed)',
+    ('model', 'method', 'outcome')
+)
+llm_retries = registry.counter(
+    'llm_retries_total',
+    'LLM API attempts that were retried',
+    ('model', 'reason')
+)
+llm_tokens = registry.histogram(
+    'llm_tokens',
+    'Prompt and response tokens per LLM call, as reported in usageMetadata',
+    ('model', 'type'),
+    buckets=TOKEN_BUCKETS
+)
+prompt_cache_lookups = registry.counter(
+    'prompt_cache_lookups_total',
+    'Chat calls by how their prompt prefix was sent (cached, created, refreshed, expired, inline)',
+    ('outcome',)
+)
+
+def timed_model(cls):
+    """Class decorator timing every public static method of a model into db_duration"""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod) and not name.startswith('_'):
+            setattr(cls, name, staticmethod(_timed_method(cls.__name__, name, attr.__func__)))
+    return cls
+
+def _timed_method(model, method, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with db_duration.time(model=model, method=method):
+            return fn(*args, **kwargs)
+    return wrapper
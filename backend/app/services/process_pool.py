@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from app.services.metrics import registry
+from logging_config import app_logger, error_logger, request_id_var
+
+class ProcessPool:
+    """
+    Bounded pool of worker processes for CPU-bound work such as text extraction
+    
+    Workers are started with 'spawn' so they never inherit the locks, threads or
+    SQLite connections of the web process. The pool is created on first use,
+    recreated after a fork (e.g. in a preforking server's workers) and replaced
+    if a worker dies. Tasks log under the caller's request ID, and metrics a task
+    records in its worker are merged into this process's registry along with
+    its result.
+    """
+    
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+                app_logger.info(f"Started process pool with {self.max_workers} workers")
+            return self._executor
+    
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+    
+    def run(self, fn, *args):
+        """Run fn(*args) in a worker process and return its result"""
+        executor = self._get_executor()
+        try:
+            return _unwrap(executor.submit(_run_task, fn, args, request_id_var.get()).result())
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+    
+    def map(self, fn, items):
+        """
+        Run fn(*args) for each args tuple in items across the pool
+        
+        Returns:
+            List of (result, error) pairs in the order of items, where error is
+            the exception raised for that item or None
+        """
+        executor = self._get_executor()
+        request_id = request_id_var.get()
+        futures = [executor.submit(_run_task, fn, args, request_id) for args in items]
+        
+        results = []
+        broken = False
+        for future in futures:
+            try:
+                results.append((_unwrap(future.result()), None))
+            except BrokenProcessPool as e:
+                broken = True
+                results.append((None, e))
+            except Exception as e:
+                results.append((None, e))
+        
+        if broken:
+            error_logger.error("A process pool worker died; the pool will be restarted")
+            self._reset(executor)
+        return results
+    
+    def imap_unordered(self, fn, items, window=None):
+        """
+        Run fn(*args) for each args tuple in items across the pool, as results come in
+        
+        At most `window` tasks (default: twice the workers) are submitted at a
+        time, so items can be a long lazy iterable without queueing all of it.
+        
+        Yields:
+            (args, result, error) in completion order, where error is the
+            exception raised for that item or None
+        
+        Raises:
+            BrokenProcessPool if a worker died; the pool is restarted on next use
+        """
+        executor = self._get_executor()
+        request_id = request_id_var.get()
+        window = window or 2 * self.max_workers
+        items = iter(items)
+        running = {}
+        
+        while True:
+            for args in islice(items, window - len(running)):
+                running[executor.submit(_run_task, fn, args, request_id)] = args
+            if not running:
+                return
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                args = running.pop(future)
+                try:
+                    result, error = _unwrap(future.result()), None
+                except BrokenProcessPool:
+                    error_logger.error("A process pool worker died; the pool will be restarted")
+                    self._reset(executor)
+                    raise
+                except Exception as e:
+                    result, error = None, e
+                yield args, result, error
+    
+    def shutdown(self, wait=True):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+def _run_task(fn, args, request_id=None):
+    """Run fn(*args) in a worker; returns (result, error, metrics recorded meanwhile)"""
+    # Worker logs carry the ID of the request that handed the task over
+    request_id_var.set(request_id)
+    try:
+        return fn(*args), None, registry.drain()
+    except Exception as e:
+        return None, e, registry.drain()
+
+def _unwrap(outcome):
+    result, error, metrics = outcome
+    registry.merge(metrics)
+    if error is not None:
+        raise error
+    return result
+
+process_pool = ProcessPool(int(os.getenv('PROCESSING_WORKERS', 0)) or None)
@@ -0,0 +1,250 @@
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from logging_config import app_logger, error_logger
+
+MODES = ('sample', 'cprofile')
+
+# Profile ids are generated here; anything else asked for by name is rejected
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+class StackSampler:
+    """
+    Statistical profiler for one thread
+    
+    A background thread records the target thread's stack every interval
+    seconds. Samples are counted per stack and written in the collapsed format
+    ("outer;inner;leaf count" per line) that flamegraph.pl, speedscope and
+    inferno read. Time the target spends waiting (on SQLite, the LLM API, a
+    lock) shows up like any other time.
+    """
+    
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+    
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class RequestProfiler:
+    """
+    Opt-in profiling of a fraction of requests, or of requests that ask for it
+    
+    With enabled=False no request hooks are installed at all. Otherwise a
+    request is profiled when it carries an X-Profile header (its value, 'sample'
+    or 'cprofile', picks the mode; anything else uses the default) or, failing
+    that, with probability sample_rate. X-Profile is only honoured together
+    with an X-Profile-Token header matching the configured token; without a
+    token only sampling applies.
+    
+    'sample' mode writes collapsed stacks (.collapsed) for flamegraphs;
+    'cprofile' mode writes deterministic cProfile statistics (.pstats). Each
+    profile gets a .json sidecar describing the request, and only the newest
+    max_profiles are kept. Profiling ends when the request context is torn
+    down, so streamed responses are covered to their last byte.
+    """
+    
+    def __init__(self, directory, enabled=False, sample_rate=0.0, mode='sample',
+                 interval=0.005, max_profiles=200, token=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.token = token
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """Create a profiler with the settings from the Flask config"""
+        return cls(
+            config['PROFILE_DIR'],
+            enabled=config['PROFILING_ENABLED'],
+            sample_rate=config['PROFILE_SAMPLE_RATE'],
+            mode=config['PROFILE_MODE'],
+            interval=config['PROFILE_INTERVAL_MS'] / 1000,
+            max_profiles=config['PROFILE_MAX_FILES'],
+            token=config['PROFILE_TOKEN'] or None
+        )
+    
+    def init_app(self, app):
+        """Install the request hooks (only when profiling is enabled)"""
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        
+        from flask import g, request
+        
+        @app.before_request
+        def start_profile():
+            mode = self.requested_mode(request.headers)
+            if mode:
+                g.profile = self.start(mode)
+        
+        @app.teardown_request
+        def finish_profile(exc):
+            profile = g.pop('profile', None)
+            if profile:
+                self.finish(profile, request, exc)
+        
+        os.makedirs(self.directory, exist_ok=True)
+        if self.token is None:
+            app_logger.warning("PROFILE_TOKEN is not set: X-Profile and the admin profile routes are refused")
+        app_logger.info(
+            f"Request profiling enabled ({self.mode}, sample rate {self.sample_rate}) writing to {self.directory}"
+        )
+    
+    def authorized(self, headers):
+        """Whether a request may ask for a profile or read the stored ones (never without a token)"""
+        supplied = headers.get('X-Profile-Token')
+        if self.token is None or supplied is None:
+            return False
+        return hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8'))
+    
+    def requested_mode(self, headers):
+        """Mode to profile this request in, or None to leave it alone"""
+        requested = headers.get('X-Profile')
+        if requested is not None and self.authorized(headers):
+            return requested if requested in MODES else self.mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+        return None
+    
+    def start(self, mode):
+        """Start profiling the current thread; returns the state finish() needs, or None"""
+        try:
+            if mode == 'cprofile':
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                profiler = StackSampler(threading.get_ident(), self.interval)
+                profiler.start()
+        except ValueError as e:
+            # Only one deterministic profiler can be active at a time on newer Pythons
+            app_logger.warning(f"Request not profiled: {e}")
+            return None
+        return {'mode': mode, 'profiler': profiler, 'started': time.perf_counter(), 'started_at': datetime.now()}
+    
+    def finish(self, profile, request, exc=None):
+        """Stop profiling and store the profile with a description of the request"""
+        profiler = profile['profiler']
+        if profile['mode'] == 'cprofile':
+            profiler.disable()
+        else:
+            profiler.stop()
+        duration = time.perf_counter() - profile['started']
+        
+        try:
+            profile_id = f"{profile['started_at']:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+            if profile['mode'] == 'cprofile':
+                filename = f"{profile_id}.pstats"
+                profiler.dump_stats(os.path.join(self.directory, filename))
+            else:
+                filename = f"{profile_id}.collapsed"
+                profiler.dump(os.path.join(self.directory, filename))
+            
+            meta = {
+                'id': profile_id,
+                'file': filename,
+                'mode': profile['mode'],
+                'method': request.method,
+                'path': request.path,
+                'route': request.url_rule.rule if request.url_rule else None,
+                'duration_ms': round(duration * 1000, 1),
+                'error': repr(exc) if exc else None,
+                'created_at': profile['started_at'].isoformat(),
+            }
+            if profile['mode'] == 'sample':
+                meta['samples'] = sum(profiler.stacks.values())
+            with open(os.path.join(self.directory, f"{profile_id}.json"), 'w') as f:
+                json.dump(meta, f)
+            
+            app_logger.info(f"Profiled {request.method} {request.path} in {meta['duration_ms']}ms: {filename}")
+            self._prune()
+        except Exception as e:
+            error_logger.error(f"Error storing request profile: {e}", exc_info=True)
+    
+    def list_profiles(self):
+        """Descriptions of the stored profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda meta: meta['created_at'], reverse=True)
+    
+    def get_profile(self, profile_id):
+        """(directory, filename) of a stored profile, or None"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        for extension in ('.collapsed', '.pstats'):
+            if os.path.exists(os.path.join(self.directory, profile_id + extension)):
+                return self.directory, profile_id + extension
+        return None
+    
+    def _prune(self):
+        """Delete all but the newest max_profiles, going by the sidecars' modification times"""
+        with self._lock:
+            sidecars = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    profile_id, extension = os.path.splitext(entry.name)
+                    if extension != '.json' or not PROFILE_ID_PATTERN.match(profile_id):
+                        continue
+                    try:
+                        sidecars.append((entry.stat().st_mtime_ns, profile_id))
+                    except FileNotFoundError:
+                        continue
+            if len(sidecars) <= self.max_profiles:
+                return
+            
+            sidecars.sort(reverse=True)
+            for _, profile_id in sidecars[self.max_profiles:]:
+                for extension in ('.collapsed', '.pstats', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + extension))
+                    except FileNotFoundError:
+                        pass
@@ -0,0 +1,183 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.models.file_chunk import FileChunk
+from app.services.context_packer import ContextPacker, estimate_tokens
+from app.services.metrics import prompt_cache_lookups
+from logging_config import app_logger
+
+class PromptCache:
+    """
+    Gemini cached contents holding the prompt prefix of each discussion
+    
+    When every chunk of a discussion fits the context budget, the system prompt
+    plus the whole corpus is the same for every question, so it is uploaded once
+    as a cached content and each chat call only sends its name. Entries are keyed
+    on the discussion's corpus version: adding or processing a file makes the
+    next call build a new prefix and delete the old one. TTLs are pushed back
+    once half of them has passed. Discussions too large (or too small) to cache,
+    or whose cache could not be created, use retrieval as before.
+    """
+    
+    def __init__(self, enabled=False, ttl=3600, min_tokens=1024, max_tokens=24000, retry_after=300, max_entries=64):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.retry_after = retry_after
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (db_path, discussion_id) -> entry dict
+        self._building = set()
+        self._deleter = None  # Single worker deleting replaced cached contents
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """Create a prompt cache with the settings from the Flask config"""
+        return cls(
+            enabled=config['PROMPT_CACHE_ENABLED'],
+            ttl=config['PROMPT_CACHE_TTL'],
+            min_tokens=config['PROMPT_CACHE_MIN_TOKENS'],
+            max_tokens=config['CONTEXT_TOKEN_BUDGET'],
+            retry_after=config['PROMPT_CACHE_RETRY_AFTER']
+        )
+    
+    def get(self, gemini_service, db_path, discussion_id, corpus_version):
+        """
+        Get the cached prompt prefix of a discussion, creating it if needed
+        
+        Returns:
+            Dict with 'name' (the cached content to pass to the Gemini service)
+            and 'chunks' (the context it holds), or None to send the context inline
+        """
+        if not self.enabled:
+            return None
+        
+        key = (db_path, discussion_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            current = entry is not None and entry['version'] == corpus_version and entry['model'] == gemini_service.model
+            if current and (entry['name'] is not None or entry['retry_at'] > now):
+                self._entries.move_to_end(key)
+            elif key in self._building:
+                # Another request is creating the prefix; don't wait for it
+                current, entry = True, dict(entry or {}, name=None)
+            else:
+                self._building.add(key)
+                current = False
+        
+        if current:
+            if entry['name'] is None:
+                prompt_cache_lookups.inc(outcome='inline')
+                return None
+            if entry['expires_at'] - now < self.ttl / 2:
+                return self._refresh(gemini_service, entry)
+            prompt_cache_lookups.inc(outcome='cached')
+            return entry
+        
+        try:
+            if entry is not None and entry['name'] is not None:
+                self._delete_later(entry)
+            return self._build(gemini_service, key, corpus_version)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+    
+    def forget(self, name):
+        """Drop the entry of a cached content the API no longer knows"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry['name'] == name:
+                    del self._entries[key]
+    
+    def invalidate(self, db_path, discussion_id):
+        """Drop the prefix of a discussion after its files change, deleting its cached content"""
+        with self._lock:
+            entry = self._entries.pop((db_path, discussion_id), None)
+        if entry is not None and entry['name'] is not None:
+            self._delete_later(entry)
+    
+    def _build(self, gemini_service, key, corpus_version):
+        db_path, discussion_id = key
+        entry = {
+            'version': corpus_version,
+            'model': gemini_service.model,
+            'name': None,
+            'chunks': None,
+            'expires_at': 0,
+            'retry_at': float('inf'),  # Until the corpus changes
+            'service': gemini_service
+        }
+        
+        chunks = FileChunk.get_by_discussion(db_path, discussion_id)
+        packed = ContextPacker(context_token_budget=self.max_tokens).pack_chunks(chunks)
+        tokens = estimate_tokens(gemini_service.system_prompt(packed))
+        if len(packed) < len(chunks) or tokens < self.min_tokens:
+            app_logger.info(
+                f"Prompt prefix of discussion {discussion_id} not cached: "
+                f"{tokens} tokens, {len(packed)}/{len(chunks)} chunks fit"
+            )
+        else:
+            try:
+                entry['name'] = gemini_service.create_cached_content(packed, self.ttl)
+                entry['chunks'] = packed
+                entry['expires_at'] = time.time() + self.ttl
+            except Exception as e:
+                # Caching may be unsupported for the model or plan; try again later
+                app_logger.warning(f"Could not cache prompt prefix of discussion {discussion_id}, sending it inline: {e}")
+                entry['retry_at'] = time.time() + self.retry_after
+        
+        self._store(key, entry)
+        prompt_cache_lookups.inc(outcome='created' if entry['name'] else 'inline')
+        return entry if entry['name'] else None
+    
+    def _refresh(self, gemini_service, entry):
+        try:
+            gemini_service.refresh_cached_content(entry['name'], self.ttl)
+        except Exception as e:
+            # Most likely expired already; the next call builds a new one
+            app_logger.warning(f"Could not refresh cached content {entry['name']}: {e}")
+            self.forget(entry['name'])
+            prompt_cache_lookups.inc(outcome='inline')
+            return None
+        
+        with self._lock:
+            entry['expires_at'] = time.time() + self.ttl
+        prompt_cache_lookups.inc(outcome='refreshed')
+        return entry
+    
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for old in evicted:
+            if old['name'] is not None:
+                self._delete_later(old)
+    
+    def _delete_later(self, entry):
+        """Delete a cached content in the background; it expires on its own if this fails"""
+        def delete():
+            try:
+                entry['service'].delete_cached_content(entry['name'])
+            except Exception as e:
+                app_logger.warning(f"Could not delete cached content {entry['name']}: {e}")
+        
+        with self._lock:
+            if self._deleter is None:
+                self._deleter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prompt-cache-delete')
+            self._deleter.submit(contextvars.copy_context().run, delete)
+    
+    def stats(self):
+        """Number of cached prefixes"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': sum(1 for entry in self._entries.values() if entry['name'] is not None),
+                'ttl_seconds': self.ttl
+            }
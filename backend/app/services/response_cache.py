@@ -0,0 +1,146 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from app.services.database_service import transaction
+from logging_config import app_logger, error_logger
+
+class ResponseCache:
+    """
+    Cache of chat answers keyed on corpus version, packed context, question and history
+    
+    Entries live in a size-bounded in-memory LRU with a TTL. When a database path
+    is given, answers are also written to the ResponseCache table so they survive
+    restarts and are shared between worker processes.
+    """
+    
+    PRUNE_EVERY = 100  # Persistent writes between sweeps of expired rows
+    
+    def __init__(self, max_entries=1024, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (response, discussion_id, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._writes = 0
+    
+    @staticmethod
+    def make_key(corpus_version, context_chunks, user_message, history, summary=None):
+        """Content hash identifying one question against one exact prompt"""
+        normalized_message = re.sub(r'\s+', ' ', user_message).strip().lower()
+        material = {
+            'corpus': corpus_version,
+            'context': [chunk.get('content', '') for chunk in context_chunks],
+            'message': normalized_message,
+            'history': history or []
+        }
+        # Only keyed when present, so answers cached without one keep their keys
+        if summary:
+            material['summary'] = summary
+        material = json.dumps(material, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Get a cached answer, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+        
+        entry = self._get_persistent(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.persistent_hits += 1
+            self._store(key, entry)
+        return entry[0]
+    
+    def set(self, key, response, discussion_id):
+        """Cache an answer for a discussion"""
+        entry = (response, discussion_id, time.time() + self.ttl)
+        with self._lock:
+            self._store(key, entry)
+        self._set_persistent(key, entry)
+    
+    def invalidate_discussion(self, discussion_id):
+        """Drop every cached answer for a discussion"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] == discussion_id]
+            for key in stale:
+                del self._entries[key]
+        
+        if self.db_path:
+            try:
+                with transaction(self.db_path, write=True) as conn:
+                    conn.execute('DELETE FROM ResponseCache WHERE discussion_id = ?', (discussion_id,))
+            except Exception as e:
+                error_logger.error(f"Error invalidating response cache for discussion {discussion_id}: {e}", exc_info=True)
+        
+        app_logger.info(f"Response cache invalidated for discussion {discussion_id}")
+    
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'persistent': bool(self.db_path)
+            }
+    
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def _get_persistent(self, key, now):
+        if not self.db_path:
+            return None
+        try:
+            with transaction(self.db_path) as conn:
+                row = conn.execute(
+                    'SELECT response, discussion_id, expires_at FROM ResponseCache WHERE cache_key = ?',
+                    (key,)
+                ).fetchone()
+                # Expired rows are left for the next write to prune
+                if row is None or row['expires_at'] <= now:
+                    return None
+                return (row['response'], row['discussion_id'], row['expires_at'])
+        except Exception as e:
+            error_logger.error(f"Error reading persistent response cache: {e}", exc_info=True)
+            return None
+    
+    def _set_persistent(self, key, entry):
+        if not self.db_path:
+            return
+        try:
+            with transaction(self.db_path, write=True) as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO ResponseCache (cache_key, discussion_id, response, expires_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (key, entry[1], entry[0], entry[2]))
+                
+                # Lookups skip expired rows; they are removed here
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    conn.execute('DELETE FROM ResponseCache WHERE expires_at <= ?', (time.time(),))
+        except Exception as e:
+            error_logger.error(f"Error writing persistent response cache: {e}", exc_info=True)
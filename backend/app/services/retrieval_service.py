@@ -0,0 +1,57 @@
+from app.models.file_chunk import FileChunk
+from app.services import vector_index
+from logging_config import app_logger
+
+class RetrievalService:
+    """Service for selecting the chunks of a discussion relevant to a question"""
+    
+    ENGINES = ('fts', 'tfidf', 'hybrid')
+    RRF_K = 60  # Reciprocal rank fusion damping constant
+    
+    @staticmethod
+    def retrieve(db_path, discussion_id, query, k=8, engine='fts'):
+        """
+        Get up to k chunks ranked by relevance to the query
+        
+        Args:
+            db_path: Path to the SQLite database
+            discussion_id: Discussion to search
+            query: The user's question
+            k: Maximum number of chunks to return
+            engine: 'fts' (BM25), 'tfidf' (cosine) or 'hybrid' (both, fused)
+        
+        Returns:
+            List of chunk dicts, best match first
+        """
+        if engine not in RetrievalService.ENGINES:
+            raise ValueError(f"Unknown retrieval engine: {engine}")
+        
+        if engine == 'fts':
+            chunks = FileChunk.search(db_path, discussion_id, query, k)
+        elif engine == 'tfidf':
+            chunks = vector_index.search_chunks(db_path, discussion_id, query, k)
+        else:
+            chunks = RetrievalService.fuse([
+                FileChunk.search(db_path, discussion_id, query, k),
+                vector_index.search_chunks(db_path, discussion_id, query, k)
+            ], k)
+        
+        if not chunks:
+            # Nothing matched; fall back to the start of the documents
+            chunks = FileChunk.get_by_discussion(db_path, discussion_id, limit=k)
+        
+        app_logger.info(f"Retrieved {len(chunks)} chunks for discussion {discussion_id} using {engine}")
+        return chunks
+    
+    @staticmethod
+    def fuse(rankings, k):
+        """Merge ranked chunk lists with reciprocal rank fusion"""
+        scores = {}
+        chunks = {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking):
+                scores[chunk['id']] = scores.get(chunk['id'], 0.0) + 1.0 / (RetrievalService.RRF_K + rank + 1)
+                chunks.setdefault(chunk['id'], chunk)
+        
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [dict(chunks[chunk_id], score=scores[chunk_id]) for chunk_id in best]
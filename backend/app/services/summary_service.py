@@ -0,0 +1,200 @@
+import hashlib
+import json
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.models.partial_summary import PartialSummary
+from app.services.context_packer import estimate_tokens, shared_length
+from app.services.database_service import in_transaction
+from logging_config import app_logger, error_logger
+
+# Bump when the prompts change so stored partial summaries are not reused
+PROMPT_VERSION = 1
+
+MAP_PROMPT = """You summarize part of a document.
+
+Write a concise summary (at most 200 words) of the text you are given, keeping
+names, figures, dates and conclusions. Use only the given text.
+"""
+
+REDUCE_PROMPT = """You combine partial summaries into one.
+
+You are given summaries of consecutive parts of a document, or of several
+documents. Merge them into a single concise summary (at most 300 words) that
+keeps the main topics, key facts and conclusions and drops repetition. Use only
+the given summaries.
+"""
+
+TOPIC_INSTRUCTION = "\nFocus on what the text says about this topic: {topic}\n"
+
+class SummaryService:
+    """
+    Map-reduce summarization of all files in a discussion
+    
+    Each file's chunks are grouped into map inputs of about map_token_budget
+    tokens and summarized in parallel. Each file's partial summaries are then
+    merged fan_in at a time until one remains, and the file summaries are merged
+    the same way into the discussion summary. All calls of a tree level are sent
+    together through the async LLM client. Every map and reduce result is
+    stored under a hash of its exact input, so a new file only costs its own
+    branch plus the reduce steps above it.
+    """
+    
+    def __init__(self, gemini_service, map_token_budget=6000, fan_in=8, call_timeout=None):
+        self.gemini_service = gemini_service
+        self.map_token_budget = map_token_budget
+        self.fan_in = max(2, fan_in)
+        self.call_timeout = call_timeout
+    
+    @classmethod
+    def from_config(cls, gemini_service, config):
+        """Create a summarizer with the settings from the Flask config"""
+        return cls(
+            gemini_service,
+            map_token_budget=config['SUMMARY_MAP_TOKENS'],
+            fan_in=config['SUMMARY_REDUCE_FAN_IN'],
+            call_timeout=config['SUMMARY_CALL_TIMEOUT'] or None
+        )
+    
+    def summarize(self, db_path, discussion_id, topic=None):
+        """
+        Summarize every ready file of a discussion
+        
+        Args:
+            db_path: Path to the database
+            discussion_id: Discussion to summarize
+            topic: Optional topic the summary should focus on
+        
+        Returns:
+            Dict with 'summary', per-file 'files' summaries and 'stats'
+            (LLM calls made and partial summaries reused)
+        """
+        stats = {'map_tasks': 0, 'reduce_tasks': 0, 'llm_calls': 0, 'reused': 0}
+        
+        # Identical content uploaded twice is summarized once
+        files = []
+        seen_hashes = set()
+        for file in sorted(File.get_by_discussion(db_path, discussion_id), key=lambda f: f['id']):
+            if file['status'] != 'ready' or file['content_hash'] in seen_hashes:
+                continue
+            seen_hashes.add(file['content_hash'])
+            files.append(file)
+        
+        # Map: every file's chunk groups, all in one concurrent batch
+        map_inputs = [
+            [self._task('map', topic, text) for text in self.group_chunks(FileChunk.get_by_file(db_path, file['id']))]
+            for file in files
+        ]
+        stats['map_tasks'] = sum(len(inputs) for inputs in map_inputs)
+        branches = self._run_level(db_path, map_inputs, stats)
+        
+        # Reduce each file's partial summaries, one tree level at a time across all files
+        while any(len(branch) > 1 for branch in branches):
+            level_inputs = [
+                [self._task('reduce', topic, self._join(group)) for group in self._groups(branch)]
+                if len(branch) > 1 else []
+                for branch in branches
+            ]
+            reduced = self._run_level(db_path, level_inputs, stats)
+            branches = [new or old for new, old in zip(reduced, branches)]
+        
+        file_summaries = [
+            {'file_id': file['id'], 'filename': file['filename'], 'summary': branch[0]}
+            for file, branch in zip(files, branches) if branch
+        ]
+        
+        # Reduce across files
+        nodes = [f"{item['filename']}:\n{item['summary']}" for item in file_summaries]
+        while len(nodes) > 1:
+            tasks = [self._task('reduce', topic, self._join(group)) for group in self._groups(nodes)]
+            nodes = self._run_level(db_path, [tasks], stats)[0]
+        summary = file_summaries[0]['summary'] if len(file_summaries) == 1 else (nodes[0] if nodes else '')
+        
+        app_logger.info(
+            f"Summarized discussion {discussion_id}: {len(file_summaries)} files, "
+            f"{stats['llm_calls']} LLM calls, {stats['reused']} partial summaries reused"
+        )
+        return {'summary': summary, 'files': file_summaries, 'stats': stats}
+    
+    def group_chunks(self, chunks):
+        """Join consecutive chunks (overlap removed) into texts of about map_token_budget tokens"""
+        groups = []
+        parts = []
+        used = 0
+        previous = None
+        for chunk in chunks:
+            content = chunk['content']
+            if previous is not None:
+                content = content[shared_length(previous, chunk):]
+            previous = chunk
+            
+            cost = estimate_tokens(content)
+            if parts and used + cost > self.map_token_budget:
+                groups.append(''.join(parts))
+                parts, used = [], 0
+            parts.append(content)
+            used += cost
+        if parts:
+            groups.append(''.join(parts))
+        return groups
+    
+    def _task(self, kind, topic, text):
+        """(cache_key, kind, topic, text) for one LLM call"""
+        material = json.dumps(
+            [PROMPT_VERSION, self.gemini_service.model, kind, topic or '', text],
+            ensure_ascii=False
+        )
+        return (hashlib.sha256(material.encode('utf-8')).hexdigest(), kind, topic, text)
+    
+    def _groups(self, nodes):
+        """Split nodes into reduce groups of fan_in (a lone last node joins the group before it)"""
+        groups = [nodes[i:i + self.fan_in] for i in range(0, len(nodes), self.fan_in)]
+        if len(groups) > 1 and len(groups[-1]) == 1:
+            last = groups.pop()
+            groups[-1] = groups[-1] + last
+        return groups
+    
+    @staticmethod
+    def _join(summaries):
+        return '\n\n'.join(f"Part {number}:\n{summary}" for number, summary in enumerate(summaries, 1))
+    
+    def _payload(self, kind, topic, text):
+        system_prompt = MAP_PROMPT if kind == 'map' else REDUCE_PROMPT
+        if topic:
+            system_prompt += TOPIC_INSTRUCTION.format(topic=topic)
+        return self.gemini_service.prompt_payload(text, system_prompt)
+    
+    def _run_level(self, db_path, task_lists, stats):
+        """
+        Resolve lists of tasks to summaries, from storage or from parallel LLM calls
+        
+        Summaries that were generated are stored even if another call fails,
+        so a retry resumes where this one stopped. They are committed in their
+        own short transaction before the next level's LLM calls start, so no
+        write lock is held while the model works.
+        """
+        if in_transaction(db_path):
+            raise RuntimeError("Summary LLM calls must not run inside a database transaction")
+        
+        tasks = {task[0]: task for task_list in task_lists for task in task_list}
+        results = PartialSummary.get_many(db_path, tasks.keys())
+        stats['reduce_tasks'] += sum(1 for task in tasks.values() if task[1] == 'reduce')
+        stats['reused'] += len(results)
+        
+        missing = [task for key, task in tasks.items() if key not in results]
+        if missing:
+            responses = self.gemini_service.generate_many(
+                [self._payload(*task[1:]) for task in missing],
+                timeout=self.call_timeout
+            )
+            generated = {task[0]: text for task, (text, error) in zip(missing, responses) if error is None}
+            failure = next((error for _, error in responses if error is not None), None)
+            
+            stats['llm_calls'] += len(missing)
+            if generated:
+                PartialSummary.save_many(db_path, generated)
+            if failure:
+                error_logger.error(f"Summary generation failed: {failure!r}")
+                raise failure
+            results.update(generated)
+        
+        return [[results[task[0]] for task in task_list] for task_list in task_lists]
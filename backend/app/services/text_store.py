@@ -0,0 +1,121 @@
+import mmap
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from app.services import chunk_codec
+from logging_config import ingest_logger
+
+# Extracted text is kept once per content hash as a flat UTF-8 file under this
+# directory (by default 'text' beside the database); chunks are byte ranges of it
+TEXT_STORE_DIR = os.getenv('TEXT_STORE_DIR')
+OPEN_TEXT_LIMIT = int(os.getenv('TEXT_STORE_OPEN_FILES', 64))  # Memory maps kept open per process
+
+READ_BLOCK_SIZE = 64 * 1024  # Characters per piece when streaming a stored text
+
+_maps = OrderedDict()  # file path -> mmap (None for an empty file)
+_lock = threading.Lock()
+
+def text_dir(db_path):
+    """Directory holding the stored texts of a database"""
+    return TEXT_STORE_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'text')
+
+def text_path(db_path, content_hash):
+    """Path of the stored text of a content hash (sharded on its first two characters)"""
+    name = content_hash.replace(':', '_')
+    return os.path.join(text_dir(db_path), name[:2], f"{name}.txt")
+
+def exists(db_path, content_hash):
+    """Whether the text of a content hash has been stored"""
+    return os.path.exists(text_path(db_path, content_hash))
+
+def write(db_path, content_hash, pieces):
+    """
+    Store the text of a content hash from a stream of text pieces
+    
+    The text is written to a temporary file and moved into place once complete,
+    so readers never see a partial text. Identical content always produces
+    identical bytes, so concurrent writers of one hash are harmless.
+    
+    Returns:
+        Size of the stored text in bytes
+    """
+    path = text_path(db_path, content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        # newline='' keeps the text byte for byte, so chunk offsets stay valid
+        with open(partial_path, 'w', encoding='utf-8', newline='') as out:
+            for piece in pieces:
+                out.write(piece)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    
+    size = os.path.getsize(path)
+    ingest_logger.info(f"Stored {size} bytes of text for content {content_hash[:12]}")
+    return size
+
+def iter_pieces(db_path, content_hash, block_size=READ_BLOCK_SIZE):
+    """Yield the stored text of a content hash in pieces of block_size characters"""
+    with open(text_path(db_path, content_hash), 'r', encoding='utf-8', newline='') as stored:
+        while True:
+            piece = stored.read(block_size)
+            if not piece:
+                return
+            yield piece
+
+def read(db_path, content_hash, start, end):
+    """
+    Text between two byte offsets of a stored text
+    
+    The file is memory-mapped once per process, and only the range's pages are
+    read: it is decoded from the map through a memoryview into a new str.
+    """
+    mapped = _get_map(text_path(db_path, content_hash))
+    if mapped is None:
+        return ''
+    with memoryview(mapped)[start:end] as view:
+        return str(view, 'utf-8')
+
+def chunk_text(db_path, content, content_hash, start, end, conn=None):
+    """Text of a chunk row: its own (possibly compressed) content, else its range of the stored text"""
+    if content is not None:
+        return chunk_codec.decode(content, db_path, conn)
+    try:
+        return read(db_path, content_hash, start, end)
+    except FileNotFoundError:
+        # Chunks of a lost text must stay deletable (their index entries go with
+        # them); rebuilding the full-text index indexes them as empty
+        ingest_logger.warning(f"Stored text of content {content_hash[:12]} is missing")
+        return ''
+
+def remove(db_path, content_hash):
+    """Delete the stored text of a content hash no file refers to any more"""
+    path = text_path(db_path, content_hash)
+    with _lock:
+        # Readers holding the map keep it alive until they are done
+        _maps.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
+        ingest_logger.info(f"Removed stored text of content {content_hash[:12]}")
+
+def _get_map(path):
+    with _lock:
+        if path in _maps:
+            _maps.move_to_end(path)
+            return _maps[path]
+    
+    with open(path, 'rb') as stored:
+        # Empty files cannot be mapped
+        size = os.fstat(stored.fileno()).st_size
+        mapped = mmap.mmap(stored.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    
+    with _lock:
+        _maps[path] = mapped
+        _maps.move_to_end(path)
+        while len(_maps) > OPEN_TEXT_LIMIT:
+            # Dropped rather than closed: a reader may still be slicing it
+            _maps.popitem(last=False)
+    return mapped
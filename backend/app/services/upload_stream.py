@@ -0,0 +1,114 @@
+import hashlib
+import os
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from app.utils.validators import file_size_error
+from logging_config import app_logger
+
+class StreamedUpload:
+    """One uploaded file: where it was written, its size and hash, or why it was rejected"""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.file_path = None
+        self.size = 0
+        self.content_hash = None
+        self.error = None
+
+class UploadStream:
+    """
+    Multipart request body parsed as it arrives
+    
+    The file parts of one form field are written straight to the paths chosen
+    for them, hashed and measured on the same pass, so an upload of any size
+    takes one block of memory and no temporary file. A part that grows past
+    max_size is abandoned at once: its partial file is deleted and the rest of
+    its bytes are read and dropped. Other form fields are ignored.
+    """
+    
+    BLOCK_SIZE = 1024 * 1024  # Bytes read from the request per step
+    HEADER_ALLOWANCE = 64 * 1024  # Part headers the parser may buffer on top of a block
+    
+    def __init__(self, stream, content_type, field, max_size, block_size=BLOCK_SIZE):
+        mimetype, options = parse_options_header(content_type or '')
+        if mimetype != 'multipart/form-data' or not options.get('boundary'):
+            raise ValueError("Expected a multipart/form-data body")
+        
+        self.stream = stream
+        self.boundary = options['boundary'].encode('latin-1')
+        self.field = field
+        self.max_size = max_size
+        self.block_size = block_size
+    
+    def receive(self, destination):
+        """
+        Receive the file parts of the field, in order
+        
+        Args:
+            destination: Called with each part's filename before its data is
+                read; returns the path to write it to, or raises ValueError
+                (whose message becomes the upload's error) to skip the part
+        
+        Yields:
+            A StreamedUpload per file part, once its last byte has arrived
+        
+        Raises:
+            ValueError if the body is malformed or ends early
+        """
+        # The decoder's limit caps its buffer, which holds at most a block and a header
+        decoder = MultipartDecoder(self.boundary, self.block_size + self.HEADER_ALLOWANCE)
+        upload = None
+        out = None
+        digest = None
+        try:
+            while True:
+                block = self.stream.read(self.block_size)
+                # An empty read is the end of the body; the decoder wants None for it
+                decoder.receive_data(block or None)
+                event = decoder.next_event()
+                while not isinstance(event, (NeedData, Epilogue)):
+                    if isinstance(event, File) and event.name == self.field:
+                        upload = StreamedUpload(event.filename)
+                        try:
+                            upload.file_path = destination(event.filename)
+                            out = open(upload.file_path, 'wb')
+                            digest = hashlib.sha256()
+                        except ValueError as e:
+                            upload.error = str(e)
+                    elif not isinstance(event, Data):
+                        # Another field: its data is dropped
+                        upload = None
+                    elif upload is not None:
+                        if out is not None:
+                            upload.size += len(event.data)
+                            if upload.size > self.max_size:
+                                self._discard(out, upload.file_path)
+                                out = None
+                                upload.error = file_size_error(self.max_size)
+                                app_logger.warning(f"Upload {upload.filename} aborted past {self.max_size} bytes")
+                            else:
+                                digest.update(event.data)
+                                out.write(event.data)
+                        if not event.more_data:
+                            if out is not None:
+                                out.close()
+                                out = None
+                                upload.content_hash = digest.hexdigest()
+                            yield upload
+                            upload = None
+                    event = decoder.next_event()
+                
+                if isinstance(event, Epilogue):
+                    return
+                if not block:
+                    raise ValueError("Upload ended before the end of the multipart body")
+        finally:
+            # Interrupted mid-part (client gone, malformed body, caller stopped)
+            if out is not None:
+                self._discard(out, upload.file_path)
+    
+    @staticmethod
+    def _discard(out, file_path):
+        out.close()
+        if os.path.exists(file_path):
+            os.remove(file_path)
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from app.models.file_chunk import FileChunk
+from logging_config import app_logger, error_logger
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Terms are hashed into this many feature buckets, so no vocabulary is stored
+FEATURE_BUCKETS = 2 ** 20
+
+def hash_features(text):
+    """Map the tokens of a text to hashed feature ids"""
+    return [
+        zlib.crc32(token.encode('utf-8')) & (FEATURE_BUCKETS - 1)
+        for token in TOKEN_PATTERN.findall(text.lower())
+    ]
+
+class TfidfIndex:
+    """Sparse hashed-feature TF-IDF matrix over the chunks of one discussion"""
+    
+    def __init__(self, chunk_ids, features, columns, weights, row_offsets, idf):
+        self.chunk_ids = chunk_ids      # chunk id for each matrix row
+        self.features = features        # sorted hashed feature id for each column
+        self.columns = columns          # CSR column index of each non-zero
+        self.weights = weights          # CSR value of each non-zero (rows L2-normalized)
+        self.row_offsets = row_offsets  # CSR row pointer
+        self.idf = idf                  # inverse document frequency per column
+        self._rows = np.repeat(
+            np.arange(len(chunk_ids), dtype=np.int32),
+            np.diff(row_offsets)
+        )
+    
+    @classmethod
+    def build(cls, chunks):
+        """Build the index from chunk dicts with 'id' and 'content'"""
+        rows = []
+        hashed = []
+        for row, chunk in enumerate(chunks):
+            ids = hash_features(chunk['content'])
+            hashed.extend(ids)
+            rows.extend([row] * len(ids))
+        
+        n_rows = len(chunks)
+        chunk_ids = np.array([chunk['id'] for chunk in chunks], dtype=np.int64)
+        
+        # Count term occurrences per (row, feature); keys sort in CSR order
+        keys = np.asarray(rows, dtype=np.int64) * FEATURE_BUCKETS + np.asarray(hashed, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        entry_rows = keys // FEATURE_BUCKETS
+        features, columns = np.unique(keys % FEATURE_BUCKETS, return_inverse=True)
+        
+        doc_freq = np.bincount(columns, minlength=len(features))
+        idf = np.log((1.0 + n_rows) / (1.0 + doc_freq)) + 1.0
+        
+        weights = (1.0 + np.log(counts)) * idf[columns]
+        norms = np.sqrt(np.bincount(entry_rows, weights=weights ** 2, minlength=n_rows))
+        weights /= np.where(norms > 0, norms, 1.0)[entry_rows]
+        
+        row_offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_rows, minlength=n_rows), out=row_offsets[1:])
+        
+        return cls(chunk_ids, features, columns.astype(np.int32), weights, row_offsets, idf)
+    
+    def __len__(self):
+        return len(self.chunk_ids)
+    
+    def query_vector(self, query):
+        """Build the normalized TF-IDF weights of a query over the index columns"""
+        query_ids, counts = np.unique(
+            np.asarray(hash_features(query), dtype=np.int64),
+            return_counts=True
+        )
+        vector = np.zeros(len(self.features))
+        if len(query_ids) == 0 or len(self.features) == 0:
+            return vector
+        
+        positions = np.searchsorted(self.features, query_ids)
+        positions = np.minimum(positions, len(self.features) - 1)
+        known = self.features[positions] == query_ids
+        positions = positions[known]
+        vector[positions] = (1.0 + np.log(counts[known])) * self.idf[positions]
+        
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def search(self, query, k):
+        """Return (chunk_id, cosine score) pairs for the k best matching chunks"""
+        vector = self.query_vector(query)
+        if len(self) == 0 or not vector.any():
+            return []
+        
+        # One sparse matrix-vector product over every non-zero in the index
+        scores = np.bincount(
+            self._rows,
+            weights=self.weights * vector[self.columns],
+            minlength=len(self)
+        )
+        
+        k = min(k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(self.chunk_ids[row]), float(scores[row]))
+            for row in top
+            if scores[row] > 0
+        ]
+
+class VectorIndexCache:
+    """LRU cache of per-discussion TF-IDF indexes"""
+    
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+    
+    def get(self, db_path, discussion_id):
+        """Get the index for a discussion, building it if it is not cached"""
+        key = (db_path, discussion_id)
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+            generation = self._generations.get(key, 0)
+        
+        chunks = FileChunk.get_by_discussion(db_path, discussion_id)
+        index = TfidfIndex.build(chunks)
+        app_logger.info(f"Built TF-IDF index for discussion {discussion_id}: {len(index)} chunks")
+        
+        with self._lock:
+            # Skip caching if the discussion changed while the index was built
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = index
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return index
+    
+    def invalidate(self, db_path, discussion_id):
+        """Drop the cached index for a discussion after its chunks change"""
+        key = (db_path, discussion_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+    
+    def clear(self):
+        """Drop every cached index"""
+        with self._lock:
+            for key in self._entries:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+
+vector_index_cache = VectorIndexCache(int(os.getenv('VECTOR_INDEX_CACHE_SIZE', 16)))
+
+def search_chunks(db_path, discussion_id, query, k=8):
+    """Get the k chunks in a discussion with the highest TF-IDF cosine similarity"""
+    try:
+        index = vector_index_cache.get(db_path, discussion_id)
+        matches = index.search(query, k)
+        if not matches:
+            return []
+        
+        scores = dict(matches)
+        chunks = FileChunk.get_by_ids(db_path, discussion_id, [chunk_id for chunk_id, _ in matches])
+        for chunk in chunks:
+            chunk['score'] = scores[chunk['id']]
+        return chunks
+    except Exception as e:
+        error_logger.error(f"Error in TF-IDF search for discussion {discussion_id}: {e}", exc_info=True)
+        raise
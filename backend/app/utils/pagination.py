@@ -0,0 +1,55 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(row, sort_key):
+    """Opaque cursor pointing just past `row` in (sort_key, id) descending order"""
+    payload = json.dumps([row[sort_key], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Get the (sort value, id) pair back from a cursor; anything but a [str, int] pair is rejected"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        # Both are bound as SQL parameters, so lists, objects and the like must not get through
+        if not isinstance(sort_value, str) or not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError
+        return sort_value, row_id
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+def parse_page_args(args):
+    """
+    Read keyset pagination parameters from a request's query string
+    
+    Returns:
+        (limit, after) where after is a decoded cursor or None, or None when
+        the request asked for no pagination (neither limit nor cursor given)
+    
+    Raises:
+        ValueError: If limit or cursor is malformed
+    """
+    if 'limit' not in args and 'cursor' not in args:
+        return None
+    
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    
+    cursor = args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+def page_response(items, limit, sort_key):
+    """Page envelope; a page is fetched with limit + 1 rows to know if another follows"""
+    has_more = len(items) > limit
+    items = items[:limit]
+    return {
+        'items': items,
+        'next_cursor': encode_cursor(items[-1], sort_key) if has_more else None,
+    }
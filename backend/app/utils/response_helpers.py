@@ -1,3 +1,4 @@
+import json
 from flask import jsonify
 
 def success_response(data=None, message=None, status_code=200):
@@ -23,3 +24,11 @@ def error_response(message, status_code=400, errors=None):
     
     return jsonify(response), status_code
 
+
+def sse_event(data, event=None):
+    """Format one server-sent event carrying a JSON payload"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
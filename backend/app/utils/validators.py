@@ -1,4 +1,3 @@
-import os
 from werkzeug.utils import secure_filename
 
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc'}
@@ -8,28 +7,21 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def validate_file_upload(file, max_size):
-    """Validate uploaded file"""
-    if not file:
-        return False, "No file provided"
-    
-    if file.filename == '':
+def validate_file_upload(filename):
+    """Validate the name of an uploaded file (its size is checked as it is received)"""
+    if not filename:
         return False, "No file selected"
     
-    if not allowed_file(file.filename):
+    if not allowed_file(filename):
         return False, f"File type not allowed. Please upload PDF or DOCX files only."
     
-    # Check file size (if possible)
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    
-    if file_size > max_size:
-        max_mb = max_size / (1024 * 1024)
-        return False, f"File size exceeds maximum allowed size of {max_mb}MB"
-    
     return True, None
 
+def file_size_error(max_size):
+    """Error message for a file larger than max_size bytes"""
+    max_mb = max_size / (1024 * 1024)
+    return f"File size exceeds maximum allowed size of {max_mb}MB"
+
 def sanitize_filename(filename):
     """Sanitize filename for safe storage"""
     return secure_filename(filename)
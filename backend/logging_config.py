@@ -1,49 +1,200 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
+# Logs go to backend/logs whatever the working directory, unless LOG_DIR says otherwise
+LOG_DIR = os.getenv('LOG_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+os.makedirs(LOG_DIR, exist_ok=True)
 
-# App logger for general application logs
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Share of INFO/DEBUG records kept per logger, e.g. "app.db=0.1,app.llm=0.5"
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')
+
+# Correlation ID of the request (or job) being handled, added to every record
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+class ContextFilter(logging.Filter):
+    """Attach the current request ID to each record, in the thread that logs it"""
+    
+    def filter(self, record):
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of the INFO and DEBUG records of chosen loggers
+    
+    Rates apply to a logger and its children (the most specific name wins).
+    Warnings and errors are always kept. Kept records carry their sample_rate
+    so counts can be scaled back up.
+    """
+    
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+    
+    @classmethod
+    def parse(cls, spec):
+        """Build a filter from "logger=rate,..." """
+        rates = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, rate = item.partition('=')
+            rates[name.strip()] = float(rate)
+        return cls(rates)
+    
+    def rate(self, name):
+        while True:
+            if name in self.rates:
+                return self.rates[name]
+            if '.' not in name:
+                return 1.0
+            name = name.rsplit('.', 1)[0]
+    
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1.0:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hand records to the listener thread without ever blocking the caller
+    
+    Formatting (tracebacks included) is left to the listener, since the queue
+    never leaves the process. When the queue is full records are dropped, and
+    the number dropped is reported with the next record that gets through.
+    """
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+    
+    def prepare(self, record):
+        return record
+    
+    def enqueue(self, record):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        try:
+            if dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': 'app', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Dropped {dropped} log records (logging queue full)",
+                    'request_id': '-'
+                }))
+                dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Still owed: the records of an unsent report, and this one
+            with self._dropped_lock:
+                self.dropped += dropped + 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if hasattr(record, 'sample_rate'):
+            entry['sample_rate'] = record.sample_rate
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LoggerFilter(logging.Filter):
+    """Pass records of one logger tree only (routes app and error records to their files)"""
+    
+    def __init__(self, prefix):
+        super().__init__()
+        self.prefix = prefix
+    
+    def filter(self, record):
+        return record.name == self.prefix or record.name.startswith(self.prefix + '.')
+
+# App logger for general application logs; the children can be sampled separately
 app_logger = logging.getLogger('app')
-app_logger.setLevel(logging.INFO)
+app_logger.setLevel(LOG_LEVEL)
+db_logger = logging.getLogger('app.db')          # Model calls
+llm_logger = logging.getLogger('app.llm')        # Gemini API calls
+ingest_logger = logging.getLogger('app.ingest')  # Text extraction, chunking and storage
 
 # Error logger for errors and exceptions
 error_logger = logging.getLogger('error')
 error_logger.setLevel(logging.ERROR)
 
 # Formatter
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+if LOG_FORMAT == 'json':
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
 
-# App logger handlers
+# File and console output happen in the listener thread
 app_file_handler = RotatingFileHandler(
-    'logs/app.log',
+    os.path.join(LOG_DIR, 'app.log'),
     maxBytes=10485760,  # 10MB
     backupCount=5
 )
-app_file_handler.setFormatter(formatter)
-app_logger.addHandler(app_file_handler)
-
-# Console handler for app logger
-app_console_handler = logging.StreamHandler()
-app_console_handler.setFormatter(formatter)
-app_logger.addHandler(app_console_handler)
+app_file_handler.addFilter(LoggerFilter('app'))
 
-# Error logger handlers
 error_file_handler = RotatingFileHandler(
-    'logs/error.log',
+    os.path.join(LOG_DIR, 'error.log'),
     maxBytes=10485760,  # 10MB
     backupCount=5
 )
-error_file_handler.setFormatter(formatter)
-error_logger.addHandler(error_file_handler)
+error_file_handler.addFilter(LoggerFilter('error'))
+
+console_handler = logging.StreamHandler()
+
+for handler in (app_file_handler, error_file_handler, console_handler):
+    handler.setFormatter(formatter)
+
+# Request threads only filter records and put them on the queue
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter.parse(LOG_SAMPLING))
+queue_handler.addFilter(ContextFilter())
+app_logger.addHandler(queue_handler)
+error_logger.addHandler(queue_handler)
+
+log_listener = QueueListener(log_queue, app_file_handler, error_file_handler, console_handler)
+log_listener.start()
+
+def _restart_listener():
+    # A forked child (e.g. a preforking server's worker) inherits the queue but
+    # not the listener thread; give it a fresh pair
+    global log_queue, log_listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler.queue = log_queue
+    queue_handler._dropped_lock = threading.Lock()
+    log_listener = QueueListener(log_queue, app_file_handler, error_file_handler, console_handler)
+    log_listener.start()
 
-# Console handler for error logger
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(formatter)
-error_logger.addHandler(error_console_handler)
+def _stop_listener():
+    # Write out whatever is still queued
+    log_listener.stop()
 
+os.register_at_fork(after_in_child=_restart_listener)
+atexit.register(_stop_listener)
@@ -0,0 +1,66 @@
+import pytest
+from app.services.database_service import get_pool, init_db
+from tools.fake_gemini import FakeGeminiServer
+from tools.summary_check import make_docx, upload
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh, fully migrated database"""
+    path = str(tmp_path / 'db' / 'app.db')
+    init_db(path)
+    yield path
+    get_pool(path).close_all()
+
+@pytest.fixture
+def fake_llm():
+    """The local stand-in for the Gemini API"""
+    server = FakeGeminiServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch, fake_llm):
+    """Build the Flask app on a throwaway database, talking to the fake Gemini API"""
+    db_path = str(tmp_path / 'db' / 'app.db')
+    
+    def make(**env):
+        settings = {
+            'DATABASE_PATH': db_path,
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'LLM_API_BASE': fake_llm.base_url,
+            'LLM_API_KEY': 'test-key',
+            'ASYNC_INGESTION': 'false',
+        }
+        settings.update(env)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        
+        from app import create_app
+        return create_app()
+    
+    yield make
+    get_pool(db_path).close_all()
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_document(tmp_path):
+    """Write a DOCX of random paragraphs and return its path"""
+    def make(name='notes.docx', paragraphs=20, seed=1):
+        path = str(tmp_path / name)
+        make_docx(path, paragraphs, seed)
+        return path
+    return make
+
+@pytest.fixture
+def discussion_id(client, make_document):
+    """A discussion holding one processed document"""
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    upload(client, discussion_id, make_document())
+    return discussion_id
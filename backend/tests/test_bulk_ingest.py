@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import sys
+import pytest
+from app.services.database_service import get_pool
+from tools import bulk_ingest
+from tools.summary_check import make_docx
+
+@pytest.fixture
+def source(tmp_path):
+    """A directory tree of five documents with distinct content"""
+    root = tmp_path / 'source'
+    (root / 'sub').mkdir(parents=True)
+    for index, name in enumerate(['a.docx', 'b.docx', 'sub/c.docx', 'sub/d.docx', 'e.docx']):
+        make_docx(str(root / name), 5, seed=index)
+    return root
+
+@pytest.fixture(autouse=True)
+def close_connections(tmp_path):
+    yield
+    get_pool(str(tmp_path / 'db' / 'app.db')).close_all()
+
+def run(tmp_path, source, monkeypatch, *extra):
+    monkeypatch.setattr(sys, 'argv', [
+        'bulk_ingest', str(source), '--db', str(tmp_path / 'db' / 'app.db'),
+        '--uploads', str(tmp_path / 'uploads'), '--workers', '1', '--commit-every', '2', *extra
+    ])
+    return bulk_ingest.main()
+
+def interrupt_checkpoint(monkeypatch, after_call, record=True):
+    """Raise KeyboardInterrupt from the after_call-th checkpoint write, once its batch has committed"""
+    append_checkpoint = bulk_ingest.append_checkpoint
+    calls = []
+    
+    def interrupted(checkpoint, entries):
+        calls.append(entries)
+        if len(calls) == after_call:
+            if record:
+                append_checkpoint(checkpoint, entries)
+            monkeypatch.setattr(bulk_ingest, 'append_checkpoint', append_checkpoint)
+            raise KeyboardInterrupt
+        append_checkpoint(checkpoint, entries)
+    
+    monkeypatch.setattr(bulk_ingest, 'append_checkpoint', interrupted)
+
+def files(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'db' / 'app.db'))
+    rows = conn.execute('SELECT filename, content_hash, status FROM Files ORDER BY filename').fetchall()
+    conn.close()
+    return rows
+
+def checkpoint_entries(tmp_path, discussion_id=1):
+    with open(tmp_path / 'db' / f'bulk_ingest_{discussion_id}.jsonl') as checkpoint:
+        lines = checkpoint.read().splitlines()
+    return [json.loads(line) for line in lines[1:]]
+
+def test_resume_skips_recorded_files(tmp_path, source, monkeypatch, capsys):
+    interrupt_checkpoint(monkeypatch, after_call=1)
+    assert run(tmp_path, source, monkeypatch, '--name', 'Bulk') == 130
+    recorded = {entry['path'] for entry in checkpoint_entries(tmp_path)}
+    assert len(recorded) == 2 and len(files(tmp_path)) == 2
+    
+    assert run(tmp_path, source, monkeypatch, '--discussion', '1') == 0
+    output = capsys.readouterr().out
+    assert "5 documents, 2 already done, 3 to ingest" in output
+    assert "Ingested 3 files" in output
+    assert len(files(tmp_path)) == 5
+    assert [entry['status'] for entry in checkpoint_entries(tmp_path)] == ['ready'] * 5
+    
+    # Nothing left to do; a changed file is ingested again
+    assert run(tmp_path, source, monkeypatch, '--discussion', '1') == 0
+    assert "5 documents, 5 already done, 0 to ingest" in capsys.readouterr().out
+    make_docx(str(source / 'sub' / 'c.docx'), 6, seed=9)
+    assert run(tmp_path, source, monkeypatch, '--discussion', '1') == 0
+    assert "5 documents, 4 already done, 1 to ingest" in capsys.readouterr().out
+    assert [row[0] for row in files(tmp_path)].count('c.docx') == 2
+
+def test_committed_but_unrecorded_files_are_not_added_twice(tmp_path, source, monkeypatch, capsys):
+    # Interrupted after the first batch committed, before the checkpoint recorded it
+    interrupt_checkpoint(monkeypatch, after_call=1, record=False)
+    assert run(tmp_path, source, monkeypatch, '--name', 'Bulk') == 130
+    committed = files(tmp_path)
+    assert len(committed) == 2 and checkpoint_entries(tmp_path) == []
+    
+    assert run(tmp_path, source, monkeypatch, '--discussion', '1') == 0
+    output = capsys.readouterr().out
+    assert "5 documents, 0 already done, 5 to ingest" in output
+    assert "2 already present" in output
+    assert len(files(tmp_path)) == 5 and set(committed) <= set(files(tmp_path))
+    statuses = sorted(entry['status'] for entry in checkpoint_entries(tmp_path))
+    assert statuses == ['present', 'present', 'ready', 'ready', 'ready']
+    
+    # The upload folder holds one copy per file
+    assert len(os.listdir(tmp_path / 'uploads' / 'discussion_1')) == 5
+
+def test_checkpoint_of_another_source_is_refused(tmp_path, source, monkeypatch, capsys):
+    assert run(tmp_path, source, monkeypatch, '--name', 'Bulk') == 0
+    other = tmp_path / 'other'
+    other.mkdir()
+    assert run(tmp_path, other, monkeypatch, '--discussion', '1') == 1
+    assert "belongs to another source directory" in capsys.readouterr().out
@@ -0,0 +1,61 @@
+import time
+from app.models.conversation_turn import ConversationTurn
+from app.services.gemini_service import GeminiService
+from tests.test_conversations import sse_events, start_conversation
+
+def stream(client, discussion_id, **body):
+    return client.post(f'/api/discussions/{discussion_id}/chat/stream', json=dict({'message': 'What is this about?'}, **body))
+
+def test_stream_sends_start_text_and_done(client, discussion_id):
+    response = stream(client, discussion_id)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    
+    events = sse_events(response.data)
+    assert events[0][0] == 'start' and events[0][1]['cached'] is False
+    texts = [data['text'] for event, data in events[1:-1]]
+    assert all(event == 'message' for event, _ in events[1:-1]) and len(texts) > 1
+    assert ''.join(texts).startswith('This is a fake answer to: What is this about?')
+    assert events[-1] == ('done', {'chunks_used': events[0][1]['chunks_used'], 'conversation_id': None})
+    
+    # Asked again, the answer comes from the cache in one piece
+    events = sse_events(stream(client, discussion_id).data)
+    assert events[0][1]['cached'] is True
+    assert events[1][1]['text'] == ''.join(texts)
+
+def test_first_fragment_arrives_before_the_answer_is_complete(client, discussion_id, fake_llm):
+    fake_llm.tokens_per_second = 20
+    response = client.post(f'/api/discussions/{discussion_id}/chat/stream',
+                           json={'message': 'What is this about?'}, buffered=False)
+    
+    started = time.monotonic()
+    arrivals = []
+    for block in response.response:
+        block = block.decode('utf-8') if isinstance(block, bytes) else block
+        arrivals.append((time.monotonic() - started, block))
+    response.close()
+    
+    first_text = next(at for at, block in arrivals if block.startswith('data: {"text"'))
+    done = next(at for at, block in arrivals if block.startswith('event: done'))
+    assert done - first_text > 0.5
+
+def test_stream_failure_sends_an_error_event(client, discussion_id, fake_llm):
+    fake_llm.error_rate = 1.0
+    fake_llm.error_statuses = (400,)
+    
+    events = sse_events(stream(client, discussion_id).data)
+    assert [event for event, _ in events] == ['start', 'error']
+    assert events[1][1] == {'message': "Failed to generate AI response. Please try again."}
+
+def test_empty_stream_is_neither_cached_nor_recorded(app, client, discussion_id, monkeypatch):
+    conversation_id = start_conversation(client, discussion_id)
+    monkeypatch.setattr(GeminiService, 'stream_chat_response', lambda self, *args, **kwargs: iter(()))
+    
+    events = sse_events(stream(client, discussion_id, conversation_id=conversation_id).data)
+    assert [event for event, _ in events] == ['start', 'error']
+    assert ConversationTurn.count(app.config['DATABASE_PATH'], conversation_id) == 0
+    
+    monkeypatch.undo()
+    events = sse_events(stream(client, discussion_id, conversation_id=conversation_id).data)
+    assert events[0][1]['cached'] is False
+    assert events[-1][0] == 'done'
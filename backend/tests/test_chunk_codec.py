@@ -0,0 +1,71 @@
+import sqlite3
+import pytest
+from app.models.discussion import Discussion
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.services import chunk_codec
+from app.services.database_service import transaction
+
+TEXTS = [
+    "Quarterly revenue grew in every region, led by strong subscription renewals.",
+    "Supply chain risks remain in the northern operations; two vendors missed deadlines.",
+    "The board approved the hiring plan for the platform team — résumés are due in March.",
+]
+
+def add_file(db_path, discussion_id, name):
+    return File.create(db_path, discussion_id, name, f'/uploads/{name}', 100, content_hash=f'hash-{name}')
+
+@pytest.mark.parametrize('use_dictionary', [False, True])
+def test_compressed_round_trip(db_path, use_dictionary):
+    dictionary = chunk_codec.train_dictionary(TEXTS * 20) if use_dictionary else None
+    if use_dictionary:
+        with transaction(db_path, write=True) as conn:
+            dictionary_id = chunk_codec.store_dictionary(conn, dictionary)
+    else:
+        dictionary_id = None
+    
+    for text in TEXTS:
+        value = chunk_codec.encode(text, dictionary, dictionary_id)
+        assert isinstance(value, bytes) and value[0] == (2 if use_dictionary else 1)
+        assert chunk_codec.decode(value, db_path) == text
+    assert chunk_codec.decode(TEXTS[0], db_path) == TEXTS[0]
+    assert chunk_codec.decode(None, db_path) is None
+
+def test_text_and_compressed_rows_side_by_side(db_path, monkeypatch):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    plain = add_file(db_path, discussion_id, 'plain.txt')
+    packed = add_file(db_path, discussion_id, 'packed.txt')
+    
+    FileChunk.create(db_path, plain, 0, TEXTS[0])
+    monkeypatch.setattr(chunk_codec, 'CHUNK_COMPRESSION', 'zlib')
+    FileChunk.create(db_path, packed, 0, TEXTS[1])
+    
+    conn = sqlite3.connect(db_path)
+    types = dict(conn.execute('SELECT content_hash, typeof(content) FROM ContentChunks').fetchall())
+    conn.close()
+    assert types == {'hash-plain.txt': 'text', 'hash-packed.txt': 'blob'}
+    
+    assert [chunk['content'] for chunk in FileChunk.get_by_file(db_path, plain)] == [TEXTS[0]]
+    assert [chunk['content'] for chunk in FileChunk.get_by_file(db_path, packed)] == [TEXTS[1]]
+    
+    # Both are indexed by their text, and leave the index with their rows
+    assert [chunk['content'] for chunk in FileChunk.search(db_path, discussion_id, 'revenue')] == [TEXTS[0]]
+    assert [chunk['content'] for chunk in FileChunk.search(db_path, discussion_id, 'vendors')] == [TEXTS[1]]
+    File.delete(db_path, packed)
+    assert FileChunk.search(db_path, discussion_id, 'vendors') == []
+
+def test_dictionary_from_the_same_transaction_is_used_for_indexing(db_path):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    file_id = add_file(db_path, discussion_id, 'notes.txt')
+    dictionary = chunk_codec.train_dictionary(TEXTS * 20)
+    
+    # As tools/compress_chunks would: the index triggers decode with a dictionary not yet committed
+    with transaction(db_path, write=True) as conn:
+        dictionary_id = chunk_codec.store_dictionary(conn, dictionary)
+        conn.execute(
+            'INSERT INTO ContentChunks (content_hash, chunk_index, content) VALUES (?, 0, ?)',
+            ('hash-notes.txt', chunk_codec.encode(TEXTS[2], dictionary, dictionary_id))
+        )
+    
+    assert [chunk['content'] for chunk in FileChunk.search(db_path, discussion_id, 'hiring')] == [TEXTS[2]]
+    assert [chunk['content'] for chunk in FileChunk.get_by_file(db_path, file_id)] == [TEXTS[2]]
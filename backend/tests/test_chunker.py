@@ -0,0 +1,52 @@
+import random
+import re
+import sys
+import pytest
+from app.services.file_processor import FileProcessor
+from tools.chunker_bench import legacy_chunk_text, make_corpus, random_text, split_randomly
+
+PATHOLOGICAL = {
+    'letters': 'a' * 5000,
+    'spaces': ' ' * 5000,
+    'periods': '.' * 5000,
+    'no-punctuation': make_corpus('no-punctuation', 20000),
+    'no-whitespace': make_corpus('no-whitespace', 20000),
+    'unicode': make_corpus('unicode', 50000),
+    'sentence-at-limit': 'x' * 999 + '.' + 'y' * 3000,
+    'newline-past-limit': 'x' * 1000 + '\n' + 'y' * 3000,
+    'space-past-limit': 'x' * 1001 + ' ' + 'y' * 3000,
+    'empty': '',
+}
+
+def check_against_legacy(rng, text, chunk_size, chunk_overlap):
+    expected = legacy_chunk_text(text, chunk_size, chunk_overlap)
+    assert FileProcessor.chunk_text(text, chunk_size, chunk_overlap) == expected
+    
+    # Streamed in arbitrary pieces, with each chunk at its byte range of the text
+    spans = list(FileProcessor.iter_chunk_spans(split_randomly(rng, text), chunk_size, chunk_overlap))
+    assert [chunk for _, _, chunk in spans] == expected
+    encoded = text.encode('utf-8')
+    for start, end, chunk in spans:
+        assert encoded[start:end].decode('utf-8') == chunk
+
+@pytest.mark.parametrize('name', sorted(PATHOLOGICAL))
+@pytest.mark.parametrize('chunk_size, chunk_overlap', [(150, 50), (1000, 200), (4000, 0)])
+def test_pathological_inputs_match_legacy(name, chunk_size, chunk_overlap):
+    check_against_legacy(random.Random(name), PATHOLOGICAL[name], chunk_size, chunk_overlap)
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_inputs_match_legacy(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = random_text(rng)
+        # The overlap must stay below the shortest possible chunk (chunk_size - 99)
+        chunk_size = rng.choice([150, 300, 1000, 4000])
+        chunk_overlap = rng.choice([0, 50, min(200, chunk_size - 100)])
+        check_against_legacy(rng, text, chunk_size, chunk_overlap)
+
+def test_whitespace_regex_agrees_with_isspace():
+    # The word-boundary search relies on \s matching exactly what str.isspace() accepts
+    space = re.compile(r'\s')
+    disagreeing = [code_point for code_point in range(sys.maxunicode + 1)
+                   if bool(space.match(chr(code_point))) != chr(code_point).isspace()]
+    assert disagreeing == []
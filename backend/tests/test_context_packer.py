@@ -0,0 +1,102 @@
+import random
+from app.services.context_packer import ContextPacker, estimate_tokens
+from app.services.file_processor import FileProcessor
+
+def chunk(file_id, chunk_index, content):
+    return {'id': file_id * 100 + chunk_index, 'file_id': file_id, 'chunk_index': chunk_index, 'content': content}
+
+def turn(role, text):
+    return {'role': role, 'parts': [{'text': text}]}
+
+def stored_chunks(file_id, text, chunk_size=300, chunk_overlap=80):
+    """Chunks of a text as the text store holds them, with their byte ranges"""
+    return [
+        dict(chunk(file_id, index, content), start_offset=start, end_offset=end)
+        for index, (start, end, content) in enumerate(
+            FileProcessor.iter_chunk_spans([text], chunk_size, chunk_overlap))
+    ]
+
+def random_text(seed, words=2000):
+    rng = random.Random(seed)
+    vocabulary = ['alpha', 'beta', 'gamma', 'delta.', 'café', 'naïve', 'river', 'stone\n']
+    return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+def test_chunks_are_selected_by_rank_within_the_budget():
+    ranked = [chunk(1, 5, 'a' * 400), chunk(1, 9, 'b' * 2000), chunk(2, 0, 'c' * 400), chunk(1, 1, 'd' * 400)]
+    packer = ContextPacker(context_token_budget=250)
+    
+    # The 500-token chunk does not fit, but lower-ranked ones still may
+    packed = packer.pack_chunks(ranked)
+    assert [(c['file_id'], c['chunk_index']) for c in packed] == [(1, 5), (2, 0)]
+    assert sum(estimate_tokens(c['content']) for c in packed) <= 250
+    
+    assert packer.pack_chunks([]) == []
+    assert ContextPacker(context_token_budget=99).pack_chunks(ranked) == []
+
+def test_chunks_are_emitted_in_document_order():
+    ranked = [chunk(2, 0, 'two zero'), chunk(1, 7, 'one seven'), chunk(1, 2, 'one two'), chunk(1, 7, 'one seven')]
+    packed = ContextPacker().pack(ranked)['chunks']
+    
+    # A chunk ranked twice is only sent once
+    assert [(c['file_id'], c['chunk_index']) for c in packed] == [(1, 2), (1, 7), (2, 0)]
+    assert [c['content'] for c in packed] == ['one two', 'one seven', 'two zero']
+
+def test_overlap_between_neighbouring_chunks_is_sent_once():
+    text = random_text(1)
+    chunks = stored_chunks(1, text)
+    assert len(chunks) > 10
+    
+    packed = ContextPacker(context_token_budget=10 ** 6).pack_chunks(list(reversed(chunks)))
+    assert ''.join(c['content'] for c in packed) == text.strip()
+    
+    # Chunks stored with their own text: the overlap is searched for
+    for c in chunks:
+        del c['start_offset'], c['end_offset']
+    packed = ContextPacker(context_token_budget=10 ** 6).pack_chunks(list(reversed(chunks)))
+    assert ''.join(c['content'] for c in packed) == text.strip()
+
+def test_only_directly_following_chunks_lose_their_overlap():
+    chunks = stored_chunks(1, random_text(2))
+    picked = [chunks[4], chunks[2], chunks[3], chunks[7]]
+    packed = ContextPacker().pack_chunks(picked)
+    
+    assert [c['chunk_index'] for c in packed] == [2, 3, 4, 7]
+    assert packed[0]['content'] == chunks[2]['content']
+    assert packed[3]['content'] == chunks[7]['content']
+    for c in packed[1:3]:
+        original = chunks[c['chunk_index']]['content']
+        assert len(c['content']) < len(original) and original.endswith(c['content'])
+    
+    # Another file's chunk with the next index is not a neighbour
+    other = stored_chunks(2, random_text(3))[3]
+    assert ContextPacker().pack_chunks([chunks[2], other])[1]['content'] == other['content']
+
+def test_overlap_is_not_charged_to_the_budget():
+    chunks = stored_chunks(1, random_text(4))[:2]
+    full_cost = sum(estimate_tokens(c['content']) for c in chunks)
+    packed = ContextPacker(context_token_budget=full_cost - 5).pack_chunks(chunks)
+    assert [c['chunk_index'] for c in packed] == [0, 1]
+
+def test_history_keeps_the_most_recent_turns():
+    history = [turn('user' if i % 2 == 0 else 'model', f'{i}' * 400) for i in range(6)]
+    
+    # 100 tokens a turn: the last two fit whole, the third from last is cut to its tail
+    kept = ContextPacker(history_token_budget=250).pack_history(history)
+    assert kept[1:] == history[4:]
+    assert kept[0]['role'] == 'model'
+    assert kept[0]['parts'][0]['text'] == '...' + '3' * 200
+    
+    assert ContextPacker(history_token_budget=200).pack_history(history) == history[4:]
+    assert ContextPacker(history_token_budget=10 ** 6).pack_history(history) == history
+    assert ContextPacker(history_token_budget=0).pack_history(history) == []
+    assert ContextPacker().pack_history([]) == []
+
+def test_pack_applies_both_budgets():
+    packer = ContextPacker(context_token_budget=150, history_token_budget=150)
+    packed = packer.pack([chunk(1, 0, 'a' * 400), chunk(1, 5, 'b' * 400)],
+                         [turn('user', 'q' * 400), turn('model', 'r' * 400)])
+    
+    assert [c['chunk_index'] for c in packed['chunks']] == [0]
+    assert packed['history'][-1] == turn('model', 'r' * 400)
+    assert packed['history'][0]['parts'][0]['text'] == '...' + 'q' * 200
+    assert packer.pack([], None) == {'chunks': [], 'history': []}
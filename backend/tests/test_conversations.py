@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import threading
+import time
+from app.models.conversation import Conversation
+from app.models.conversation_turn import ConversationTurn
+from app.models.discussion import Discussion
+from app.services.conversation_service import ConversationService
+
+class StubGemini:
+    """Answers compaction prompts with a fixed summary"""
+    
+    def __init__(self):
+        self.prompts = []
+    
+    def generate(self, prompt, system_instruction):
+        self.prompts.append(prompt)
+        return f"summary {len(self.prompts)}"
+
+def sse_events(body):
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+    return events
+
+def start_conversation(client, discussion_id):
+    return client.post(f'/api/discussions/{discussion_id}/conversations', json={}).get_json()['data']['id']
+
+def test_turn_recorded_despite_concurrent_write(app, client, discussion_id, fake_llm):
+    conversation_id = start_conversation(client, discussion_id)
+    db_path = app.config['DATABASE_PATH']
+    fake_llm.latency = 0.5
+    
+    # Another connection commits while the answer is being generated
+    rename = threading.Timer(0.2, Discussion.update, args=(db_path, discussion_id, 'Renamed'))
+    rename.start()
+    response = client.post(f'/api/discussions/{discussion_id}/chat',
+                           json={'message': 'What is this about?', 'conversation_id': conversation_id})
+    rename.join()
+    
+    assert response.status_code == 200
+    assert response.get_json()['data']['recorded'] is True
+    turns = ConversationTurn.get_by_conversation(db_path, conversation_id)
+    assert [turn['role'] for turn in turns] == ['user', 'model']
+    assert Discussion.get_by_id(db_path, discussion_id)['name'] == 'Renamed'
+
+def test_failed_recording_keeps_the_answer(client, discussion_id, monkeypatch):
+    conversation_id = start_conversation(client, discussion_id)
+    
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(ConversationService, 'record', locked)
+    
+    response = client.post(f'/api/discussions/{discussion_id}/chat',
+                           json={'message': 'Question', 'conversation_id': conversation_id})
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert data['message'] and data['recorded'] is False
+    
+    response = client.post(f'/api/discussions/{discussion_id}/chat/stream',
+                           json={'message': 'Another question', 'conversation_id': conversation_id})
+    events = sse_events(response.data)
+    assert events[0][0] == 'start'
+    assert any(event == 'message' and data['text'] for event, data in events)
+    assert events[-1][0] == 'error'
+
+def test_stream_records_turns(app, client, discussion_id):
+    conversation_id = start_conversation(client, discussion_id)
+    response = client.post(f'/api/discussions/{discussion_id}/chat/stream',
+                           json={'message': 'Question', 'conversation_id': conversation_id})
+    
+    events = sse_events(response.data)
+    assert events[-1] == ('done', {'chunks_used': events[0][1]['chunks_used'], 'conversation_id': conversation_id})
+    assert ConversationTurn.count(app.config['DATABASE_PATH'], conversation_id) == 2
+
+def test_conversation_id_must_be_an_integer(client, discussion_id, fake_llm):
+    conversation_id = start_conversation(client, discussion_id)
+    
+    for endpoint in ('chat', 'chat/stream'):
+        for bad in (str(conversation_id), True, False, 1.0, [conversation_id], {'id': conversation_id}):
+            response = client.post(f'/api/discussions/{discussion_id}/{endpoint}',
+                                   json={'message': 'Question', 'conversation_id': bad})
+            assert response.status_code == 400, (endpoint, bad)
+        
+        response = client.post(f'/api/discussions/{discussion_id}/{endpoint}',
+                               json={'message': 'Question', 'conversation_id': 10 ** 6})
+        assert response.status_code == 404
+    assert fake_llm.requests == []
+    
+    response = client.post(f'/api/discussions/{discussion_id}/chat',
+                           json={'message': 'Question', 'conversation_id': conversation_id})
+    assert response.get_json()['data']['conversation_id'] == conversation_id
+
+def test_compaction_folds_all_but_the_window(db_path):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    conversation_id = Conversation.create(db_path, discussion_id)
+    gemini = StubGemini()
+    service = ConversationService(gemini, window_turns=2, compact_turns=2)
+    
+    for i in range(3):
+        ConversationTurn.add(db_path, conversation_id, [('user', f'q{i}'), ('model', f'a{i}')])
+    
+    assert service.compact(db_path, conversation_id) == 4
+    conversation = Conversation.get_by_id(db_path, conversation_id)
+    assert conversation['summary'] == 'summary 1'
+    summary, history = service.context(db_path, conversation)
+    assert summary == 'summary 1'
+    assert [turn['parts'][0]['text'] for turn in history] == ['q2', 'a2']
+    
+    # The next compaction starts from the stored summary and only sees newer turns
+    ConversationTurn.add(db_path, conversation_id, [('user', 'q3'), ('model', 'a3')])
+    assert service.compact(db_path, conversation_id) == 2
+    assert 'summary 1' in gemini.prompts[1] and 'q0' not in gemini.prompts[1]
+
+def test_stale_compaction_is_not_stored(db_path):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    conversation_id = Conversation.create(db_path, discussion_id)
+    ConversationTurn.add(db_path, conversation_id, [('user', 'q'), ('model', 'a')])
+    turns = ConversationTurn.get_by_conversation(db_path, conversation_id)
+    
+    assert Conversation.set_summary(db_path, conversation_id, 'first', turns[0]['id'], expected_through=0)
+    assert not Conversation.set_summary(db_path, conversation_id, 'late', turns[1]['id'], expected_through=0)
+    assert Conversation.get_by_id(db_path, conversation_id)['summary'] == 'first'
+
+def test_recording_schedules_compaction(app, client, discussion_id):
+    app.config['CONVERSATION_WINDOW_TURNS'] = 2
+    app.config['CONVERSATION_COMPACT_TURNS'] = 2
+    conversation_id = start_conversation(client, discussion_id)
+    db_path = app.config['DATABASE_PATH']
+    
+    for i in range(2):
+        response = client.post(f'/api/discussions/{discussion_id}/chat',
+                               json={'message': f'Question {i}', 'conversation_id': conversation_id})
+        assert response.status_code == 200
+    
+    deadline = time.time() + 5
+    while Conversation.get_by_id(db_path, conversation_id)['summarized_through'] == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    conversation = Conversation.get_by_id(db_path, conversation_id)
+    assert conversation['summary']
+    assert ConversationTurn.count(db_path, conversation_id, conversation['summarized_through']) == 2
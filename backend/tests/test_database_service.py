@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+import pytest
+from app.models.discussion import Discussion
+from app.services.database_service import call_after_commit, get_db_connection, transaction
+
+def test_model_calls_commit_on_their_own(db_path):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    
+    # Visible to another connection at once, with no request or outer block to end
+    conn = get_db_connection(db_path)
+    assert conn.execute('SELECT name FROM Discussions WHERE id = ?', (discussion_id,)).fetchone()[0] == 'Topic'
+    conn.close()
+
+def test_nested_call_failure_only_undoes_itself(db_path):
+    with transaction(db_path, write=True):
+        kept = Discussion.create(db_path, 'Kept')
+        with pytest.raises(sqlite3.IntegrityError):
+            with transaction(db_path, write=True) as conn:
+                conn.execute("INSERT INTO Discussions (name) VALUES ('Undone')")
+                conn.execute('INSERT INTO Discussions (name) VALUES (NULL)')
+    
+    names = [d['name'] for d in Discussion.get_all(db_path)]
+    assert names == ['Kept']
+    assert Discussion.get_by_id(db_path, kept)
+
+def test_failed_unit_rolls_back_everything(db_path):
+    with pytest.raises(RuntimeError):
+        with transaction(db_path, write=True):
+            Discussion.create(db_path, 'Gone')
+            raise RuntimeError('boom')
+    
+    assert Discussion.get_all(db_path) == []
+
+def test_write_inside_read_transaction_is_refused(db_path):
+    with pytest.raises(RuntimeError, match='write=True'):
+        with transaction(db_path):
+            Discussion.create(db_path, 'Upgrade')
+
+def test_read_then_write_after_concurrent_commit(db_path):
+    """A reader's snapshot ends with its call, so a later write sees no SQLITE_BUSY_SNAPSHOT"""
+    discussion_id = Discussion.create(db_path, 'Topic')
+    assert Discussion.get_by_id(db_path, discussion_id)
+    
+    other = threading.Thread(target=Discussion.update, args=(db_path, discussion_id, 'Renamed'))
+    other.start()
+    other.join()
+    
+    assert Discussion.update(db_path, discussion_id, description='Still writable')
+    assert Discussion.get_by_id(db_path, discussion_id)['name'] == 'Renamed'
+
+def test_writers_wait_for_the_write_lock(db_path):
+    """BEGIN IMMEDIATE waits out busy_timeout instead of failing"""
+    held = threading.Event()
+    
+    def hold_lock():
+        with transaction(db_path, write=True):
+            Discussion.create(db_path, 'First')
+            held.set()
+            time.sleep(0.3)
+    
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait()
+    
+    started = time.perf_counter()
+    Discussion.create(db_path, 'Second')
+    assert time.perf_counter() - started >= 0.2
+    holder.join()
+    
+    assert sorted(d['name'] for d in Discussion.get_all(db_path)) == ['First', 'Second']
+
+def test_after_commit_callbacks(db_path):
+    calls = []
+    
+    call_after_commit(lambda: calls.append('outside'))
+    assert calls == ['outside']
+    
+    with transaction(db_path, write=True):
+        Discussion.create(db_path, 'Topic')
+        call_after_commit(lambda: calls.append('committed'))
+        assert calls == ['outside']
+    assert calls == ['outside', 'committed']
+    
+    with pytest.raises(RuntimeError):
+        with transaction(db_path, write=True):
+            call_after_commit(lambda: calls.append('rolled back'))
+            raise RuntimeError('boom')
+    assert calls == ['outside', 'committed']
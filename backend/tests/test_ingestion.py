@@ -0,0 +1,305 @@
+import hashlib
+import os
+import random
+import sqlite3
+import time
+import docx
+import PyPDF2
+import pytest
+from app.models.content_blob import ContentBlob
+from app.models.discussion import Discussion
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.services import text_store
+from app.services.file_processor import FileProcessor
+from app.services.ingestion_service import (IngestionClaimLostError, IngestionQueue, discard_texts, ingest_file,
+                                            store_chunks)
+from app.services.vector_index import vector_index_cache
+from tools.chunker_bench import legacy_chunk_text
+
+def add_file(db_path, discussion_id, path, status='processing'):
+    with open(path, 'rb') as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    file_id = File.create(db_path, discussion_id, os.path.basename(path), path, os.path.getsize(path),
+                          status=status, content_hash=content_hash)
+    return file_id, content_hash
+
+def upload(client, discussion_id, path):
+    with open(path, 'rb') as f:
+        response = client.post(f'/api/discussions/{discussion_id}/files',
+                               data={'files': [(f, os.path.basename(path))]}, content_type='multipart/form-data')
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['data']['uploaded'][0]
+
+def test_extraction_holds_no_write_lock(db_path, make_document, monkeypatch):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    file_id, content_hash = add_file(db_path, discussion_id, make_document())
+    store_text = FileProcessor.store_text
+    
+    def checked_store_text(*args):
+        conn = sqlite3.connect(db_path, timeout=0)
+        conn.execute('BEGIN IMMEDIATE')
+        conn.rollback()
+        conn.close()
+        return store_text(*args)
+    monkeypatch.setattr(FileProcessor, 'store_text', staticmethod(checked_store_text))
+    
+    chunk_count = ingest_file(db_path, file_id, File.get_by_id(db_path, file_id)['file_path'], batch_size=3)
+    
+    file = File.get_by_id(db_path, file_id)
+    assert file['status'] == 'ready' and file['chunk_count'] == chunk_count > 3
+    assert ContentBlob.get(db_path, content_hash)['chunk_count'] == chunk_count
+    
+    # The stored chunks are exactly the chunker's output on the stored text
+    text = ''.join(text_store.iter_pieces(db_path, content_hash))
+    assert [chunk['content'] for chunk in FileChunk.get_by_file(db_path, file_id)] == FileProcessor.chunk_text(text)
+
+def make_pdf(path, page_lines, seed=1):
+    """Write a PDF with the given number of text lines on each page"""
+    rng = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'river', 'stone', 'light']
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for lines in page_lines:
+        text = ' '.join(f"({' '.join(rng.choices(words, k=12))}.) Tj T*" for _ in range(lines))
+        stream = f'BT /F1 10 Tf 12 TL 50 750 Td {text} ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+    
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(data)
+    data += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    data += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    data += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def legacy_extract_text(path):
+    """Extract a file's text the way it was done before extraction was streamed"""
+    text = ""
+    if path.endswith('.pdf'):
+        with open(path, 'rb') as file:
+            for page in PyPDF2.PdfReader(file).pages:
+                page_text = page.extract_text()
+                if page_text:
+                    text += page_text + "\n"
+    else:
+        for paragraph in docx.Document(path).paragraphs:
+            text += paragraph.text + "\n"
+    return text
+
+def test_streamed_extraction_matches_the_original_output(db_path, make_document, tmp_path):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    paths = [
+        make_pdf(str(tmp_path / 'pages.pdf'), [40, 0, 25, 60, 1]),  # Includes a page with no text
+        make_document('paragraphs.docx', paragraphs=60),
+    ]
+    for path in paths:
+        file_id, content_hash = add_file(db_path, discussion_id, path)
+        ingest_file(db_path, file_id, path, batch_size=7)
+        
+        text = legacy_extract_text(path)
+        assert len(text) > 5 * FileProcessor.CHUNK_SIZE
+        assert FileProcessor.extract_text(path) == text
+        assert ''.join(text_store.iter_pieces(db_path, content_hash)) == text
+        chunks = FileChunk.get_by_file(db_path, file_id)
+        assert [chunk['content'] for chunk in chunks] == legacy_chunk_text(
+            text, FileProcessor.CHUNK_SIZE, FileProcessor.CHUNK_OVERLAP)
+
+def test_store_chunks_replaces_the_chunks(db_path, make_document):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    path = make_document()
+    file_id, content_hash = add_file(db_path, discussion_id, path)
+    ingest_file(db_path, file_id, path)
+    
+    # Chunked again from the text store, with other settings
+    os.remove(path)
+    spans = FileProcessor.process_file(db_path, content_hash, path, chunk_size=500, chunk_overlap=50)
+    assert store_chunks(db_path, file_id, content_hash, spans, batch_size=4) == len(spans)
+    
+    text = ''.join(text_store.iter_pieces(db_path, content_hash))
+    chunks = FileChunk.get_by_file(db_path, file_id)
+    assert [chunk['content'] for chunk in chunks] == FileProcessor.chunk_text(text, 500, 50)
+    assert [chunk['chunk_index'] for chunk in chunks] == list(range(len(spans)))
+    assert FileChunk.search(db_path, discussion_id, chunks[-1]['content'][:40])
+
+def test_identical_content_is_stored_once(app, client, make_document):
+    db_path = app.config['DATABASE_PATH']
+    first = client.post('/api/discussions', json={'name': 'First'}).get_json()['data']['id']
+    second = client.post('/api/discussions', json={'name': 'Second'}).get_json()['data']['id']
+    path = make_document()
+    
+    original = upload(client, first, path)
+    copy = upload(client, second, path)
+    assert copy['deduplicated'] is True
+    assert copy['chunks'] == original['chunks']
+    
+    content_hash = File.get_by_id(db_path, original['id'])['content_hash']
+    assert ContentBlob.get(db_path, content_hash)['ref_count'] == 2
+    assert [c['content'] for c in FileChunk.get_by_file(db_path, copy['id'])] == \
+        [c['content'] for c in FileChunk.get_by_file(db_path, original['id'])]
+    
+    # The last reference out deletes the content, its chunks, index entries and text
+    client.delete(f'/api/discussions/{first}')
+    assert ContentBlob.get(db_path, content_hash)['ref_count'] == 1
+    assert text_store.exists(db_path, content_hash)
+    
+    words = FileChunk.get_by_file(db_path, copy['id'])[0]['content'][:40]
+    client.delete(f'/api/discussions/{second}')
+    assert ContentBlob.get(db_path, content_hash) is None
+    assert not text_store.exists(db_path, content_hash)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM ContentChunks WHERE content_hash = ?', (content_hash,)).fetchone()[0] == 0
+    conn.close()
+    assert FileChunk.search(db_path, second, words) == []
+
+def test_recover_requeues_interrupted_files(db_path, make_document):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    kept, _ = add_file(db_path, discussion_id, make_document('kept.docx'))
+    gone_path = make_document('gone.docx', seed=2)
+    gone, _ = add_file(db_path, discussion_id, gone_path)
+    os.remove(gone_path)
+    ready, _ = add_file(db_path, discussion_id, make_document('ready.docx', seed=3), status='ready')
+    
+    completed = []
+    queue = IngestionQueue(max_workers=1)
+    assert queue.recover(db_path, on_complete=completed.append) == (1, 1)
+    queue.shutdown(wait=True)
+    
+    assert File.get_by_id(db_path, kept)['status'] == 'ready'
+    assert File.get_by_id(db_path, kept)['chunk_count'] > 0
+    assert File.get_by_id(db_path, gone)['status'] == 'failed'
+    assert File.get_by_id(db_path, ready)['chunk_count'] is None
+    assert completed == [discussion_id]
+
+def test_recover_leaves_files_claimed_by_live_processes(db_path, make_document):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    file_id, _ = add_file(db_path, discussion_id, make_document())
+    worker = IngestionQueue(max_workers=1)
+    assert worker.claim(db_path, file_id)
+    
+    # Another app process starting up
+    other = IngestionQueue(max_workers=1)
+    assert other.owner != worker.owner
+    assert other.recover(db_path) == (0, 0)
+    assert not other.claim(db_path, file_id)
+    assert File.get_by_id(db_path, file_id)['status'] == 'processing'
+
+def test_stale_claim_is_taken_over(db_path, make_document):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    path = make_document()
+    file_id, _ = add_file(db_path, discussion_id, path)
+    crashed = IngestionQueue(max_workers=1)
+    assert crashed.claim(db_path, file_id)
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE Files SET claimed_at = claimed_at - 3600 WHERE id = ?', (file_id,))
+    conn.commit()
+    conn.close()
+    
+    other = IngestionQueue(max_workers=1)
+    assert other.recover(db_path) == (1, 0)
+    other.shutdown(wait=True)
+    assert File.get_by_id(db_path, file_id)['status'] == 'ready'
+    chunks = FileChunk.get_by_file(db_path, file_id)
+    
+    # The first process finishing late commits nothing
+    with pytest.raises(IngestionClaimLostError):
+        ingest_file(db_path, file_id, path, crashed.owner)
+    assert FileChunk.get_by_file(db_path, file_id) == chunks
+
+def test_app_start_recovers_stranded_files(app, client, make_document):
+    from app import create_app
+    db_path = app.config['DATABASE_PATH']
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    file_id, _ = add_file(db_path, discussion_id, make_document())
+    
+    # As after a crash mid-job: the row says 'processing' but no job exists
+    client = create_app().test_client()
+    deadline = time.time() + 30
+    while File.get_by_id(db_path, file_id)['status'] == 'processing' and time.time() < deadline:
+        time.sleep(0.1)
+    
+    assert File.get_by_id(db_path, file_id)['status'] == 'ready'
+    response = client.post(f'/api/discussions/{discussion_id}/chat', json={'message': 'What is this about?'})
+    assert response.status_code == 200
+
+def test_discussion_with_lost_text_can_be_deleted(app, client, make_document):
+    db_path = app.config['DATABASE_PATH']
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    file_id = upload(client, discussion_id, make_document())['id']
+    content_hash = File.get_by_id(db_path, file_id)['content_hash']
+    os.remove(text_store.text_path(db_path, content_hash))
+    text_store.remove(db_path, content_hash)  # Drops the process's map of it too
+    
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 200
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM ContentChunks').fetchone()[0] == 0
+    conn.close()
+
+def test_discussion_is_deleted_in_one_write_transaction(app, client, make_document, monkeypatch):
+    from app.routes import discussions
+    db_path = app.config['DATABASE_PATH']
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    content_hash = File.get_by_id(db_path, upload(client, discussion_id, make_document())['id'])['content_hash']
+    get_content_hashes = File.get_content_hashes
+    discarded = []
+    
+    def write_locked_content_hashes(db_path, discussion_id):
+        # No other connection can start writing (e.g. add a file) meanwhile
+        conn = sqlite3.connect(db_path, timeout=0)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('BEGIN IMMEDIATE')
+        conn.close()
+        return get_content_hashes(db_path, discussion_id)
+    
+    def failing_delete(db_path, discussion_id):
+        raise sqlite3.OperationalError('disk I/O error')
+    
+    monkeypatch.setattr(File, 'get_content_hashes', staticmethod(write_locked_content_hashes))
+    monkeypatch.setattr(discussions, 'discard_texts', lambda db_path, hashes: discarded.append(hashes))
+    monkeypatch.setattr(Discussion, 'delete', staticmethod(failing_delete))
+    index = vector_index_cache.get(db_path, discussion_id)
+    
+    # A failed delete leaves the texts and caches alone
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 500
+    assert discarded == []
+    assert vector_index_cache.get(db_path, discussion_id) is index
+    
+    monkeypatch.undo()
+    monkeypatch.setattr(File, 'get_content_hashes', staticmethod(write_locked_content_hashes))
+    monkeypatch.setattr(discussions, 'discard_texts', lambda db_path, hashes: discarded.append(hashes))
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 200
+    assert discarded == [[content_hash]]
+    assert Discussion.get_by_id(db_path, discussion_id) is None
+    assert vector_index_cache.get(db_path, discussion_id) is not index
+
+def test_texts_are_discarded_under_the_write_lock(db_path, make_document, monkeypatch):
+    discussion_id = Discussion.create(db_path, 'Topic')
+    path = make_document()
+    file_id, content_hash = add_file(db_path, discussion_id, path)
+    ingest_file(db_path, file_id, path)
+    File.delete(db_path, file_id)
+    remove = text_store.remove
+    
+    def checked_remove(*args):
+        # A new file row for the content cannot commit while the text is removed
+        conn = sqlite3.connect(db_path, timeout=0)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            raise AssertionError("write lock was free")
+        except sqlite3.OperationalError:
+            pass
+        conn.close()
+        return remove(*args)
+    monkeypatch.setattr(text_store, 'remove', checked_remove)
+    
+    discard_texts(db_path, [content_hash])
+    assert not text_store.exists(db_path, content_hash)
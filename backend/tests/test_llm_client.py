@@ -0,0 +1,78 @@
+import time
+import pytest
+import requests
+from app.services.llm_client import CircuitBreaker, LLMClient, LLMDeadlineExceededError
+
+def endpoint(fake_llm):
+    return f'{fake_llm.base_url}/models/test-model:generateContent'
+
+def payload():
+    return {'contents': [{'role': 'user', 'parts': [{'text': 'Hello'}]}]}
+
+def test_total_timeout_bounds_retries_and_backoff(fake_llm):
+    fake_llm.latency = 1.0
+    client = LLMClient(read_timeout=0.3, max_retries=50, backoff_base=0.2, backoff_max=0.2,
+                       total_timeout=2.0, min_attempt_time=0.2)
+    
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.post(endpoint(fake_llm), json=payload())
+    
+    assert time.monotonic() - started < 2.5
+    assert len(fake_llm.requests) < 10
+
+def test_retries_stop_when_the_next_attempt_cannot_finish(fake_llm):
+    fake_llm.error_rate = 1.0
+    fake_llm.error_statuses = (429,)
+    fake_llm.retry_after = 5
+    client = LLMClient(max_retries=3, total_timeout=3.0)
+    
+    started = time.monotonic()
+    with pytest.raises(requests.HTTPError):
+        client.post(endpoint(fake_llm), json=payload())
+    
+    # The Retry-After sleep would overrun the deadline, so no retry is made
+    assert time.monotonic() - started < 1.0
+    assert len(fake_llm.requests) == 1
+
+def test_call_past_its_deadline_is_rejected_without_a_request(fake_llm):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    client = LLMClient(breaker=breaker, min_attempt_time=1.0)
+    
+    with pytest.raises(LLMDeadlineExceededError):
+        client.post(endpoint(fake_llm), json=payload(), deadline=time.monotonic() + 0.5)
+    
+    assert fake_llm.requests == []
+    # The half-open probe is left for a call that can use it
+    assert breaker.state == CircuitBreaker.OPEN
+    assert client.post(endpoint(fake_llm), json=payload()).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_probe_failing_unexpectedly_reopens_the_breaker(fake_llm, monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    client = LLMClient(breaker=breaker)
+    
+    def broken(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+    
+    monkeypatch.setattr(client.session, 'request', broken)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.post(endpoint(fake_llm), json=payload())
+    assert breaker.state == CircuitBreaker.OPEN
+    
+    # The next probe goes through once the cool-down (here none) has passed
+    monkeypatch.undo()
+    assert client.post(endpoint(fake_llm), json=payload()).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_streamed_error_response_is_closed(fake_llm):
+    fake_llm.error_rate = 1.0
+    fake_llm.error_statuses = (400,)
+    client = LLMClient()
+    
+    with pytest.raises(requests.HTTPError) as excinfo:
+        client.post(f'{fake_llm.base_url}/models/test-model:streamGenerateContent?alt=sse', json=payload(), stream=True)
+    assert excinfo.value.response.status_code == 400
+    assert excinfo.value.response.raw.closed
@@ -0,0 +1,135 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import pytest
+import logging_config
+from logging_config import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, app_logger, ingest_logger
+
+def make_record(name='app', level=logging.INFO, msg='Hello %s', args=('world',), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+class Capture(logging.Handler):
+    """Collects the records reaching a logger, after the queue handler's filters ran"""
+    
+    def __init__(self):
+        super().__init__()
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def captured():
+    handler = Capture()
+    app_logger.addHandler(handler)
+    yield handler.records
+    app_logger.removeHandler(handler)
+
+def test_json_formatter_writes_one_object_per_record():
+    line = JsonFormatter().format(make_record(request_id='abc', sample_rate=0.25))
+    entry = json.loads(line)
+    
+    assert '\n' not in line
+    assert entry['message'] == 'Hello world'
+    assert (entry['level'], entry['logger'], entry['request_id'], entry['sample_rate']) == ('INFO', 'app', 'abc', 0.25)
+    assert {'time', 'process', 'thread'} <= entry.keys()
+    assert 'exception' not in entry
+    
+    try:
+        raise ValueError("bad \"value\"\nhere")
+    except ValueError:
+        record = make_record(level=logging.ERROR, msg='Failed: café', args=(), exc_info=sys.exc_info())
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == 'Failed: café'
+    assert entry['request_id'] == '-' and 'sample_rate' not in entry
+    assert 'ValueError: bad "value"\nhere' in entry['exception']
+
+def test_request_id_reaches_the_logs_of_the_request_and_its_jobs(make_app, make_document, captured):
+    client = make_app(ASYNC_INGESTION='true').test_client()
+    
+    response = client.post('/api/discussions', json={'name': 'Topic'}, headers={'X-Request-ID': 'req-42'})
+    assert response.headers['X-Request-ID'] == 'req-42'
+    discussion_id = response.get_json()['data']['id']
+    created = [record for record in captured if record.getMessage() == f"Discussion created with ID: {discussion_id}"]
+    assert [record.request_id for record in created] == ['req-42']
+    
+    # An unusable ID is replaced
+    response = client.get('/api/health', headers={'X-Request-ID': 'bad id; x' * 10})
+    assert len(response.headers['X-Request-ID']) == 32 and ' ' not in response.headers['X-Request-ID']
+    
+    # The background ingestion job logs under the ID of the upload request
+    with open(make_document(), 'rb') as f:
+        response = client.post(f'/api/discussions/{discussion_id}/files', headers={'X-Request-ID': 'upload-7'},
+                               data={'files': [(f, 'notes.docx')]}, content_type='multipart/form-data')
+    assert response.status_code == 202
+    file_id = response.get_json()['data']['uploaded'][0]['id']
+    deadline = time.time() + 30
+    while time.time() < deadline and not any(r.getMessage().startswith(f"Ingested file {file_id}:") for r in captured):
+        time.sleep(0.05)
+    ingested = [r for r in captured if r.getMessage().startswith(f"Ingested file {file_id}:")]
+    assert [record.request_id for record in ingested] == ['upload-7']
+    
+    # Outside a request there is none
+    ingest_logger.info("Idle")
+    assert captured[-1].request_id == '-'
+
+def test_sampling_never_drops_warnings(monkeypatch):
+    sampling = SamplingFilter.parse('app.db=0, app.llm=0.5,app=1')
+    
+    for name in ('app.db', 'app.db.pool', 'app.llm', 'app'):
+        for level in (logging.WARNING, logging.ERROR, logging.CRITICAL):
+            record = make_record(name, level)
+            assert sampling.filter(record)
+            assert not hasattr(record, 'sample_rate')
+    
+    assert not any(sampling.filter(make_record('app.db', level)) for level in (logging.DEBUG, logging.INFO))
+    assert not sampling.filter(make_record('app.db.pool'))
+    assert sampling.filter(make_record('app')) and sampling.filter(make_record('other'))
+    
+    monkeypatch.setattr(logging_config.random, 'random', lambda: 0.4)
+    kept = make_record('app.llm')
+    assert sampling.filter(kept) and kept.sample_rate == 0.5
+    monkeypatch.setattr(logging_config.random, 'random', lambda: 0.6)
+    assert not sampling.filter(make_record('app.llm'))
+    
+    assert SamplingFilter.parse('').filter(make_record('app.db'))
+
+def test_dropped_records_are_counted_and_reported():
+    log_queue = queue.Queue(1)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.enqueue(make_record(msg='first', args=()))
+    for _ in range(3):
+        handler.enqueue(make_record())
+    assert handler.dropped == 3
+    
+    assert log_queue.get_nowait().getMessage() == 'first'
+    # Only the report fits; the record after it is owed as well
+    handler.enqueue(make_record(msg='second', args=()))
+    report = log_queue.get_nowait()
+    assert (report.levelname, report.getMessage()) == ('WARNING', "Dropped 3 log records (logging queue full)")
+    assert handler.dropped == 1
+    
+    handler.enqueue(make_record(msg='third', args=()))
+    assert log_queue.get_nowait().getMessage() == "Dropped 1 log records (logging queue full)"
+    assert handler.dropped == 1
+
+def test_drop_count_is_exact_under_concurrency():
+    log_queue = queue.Queue(1)
+    log_queue.put_nowait(make_record())
+    handler = NonBlockingQueueHandler(log_queue)
+    
+    def log_many():
+        for _ in range(2000):
+            handler.enqueue(make_record())
+    
+    threads = [threading.Thread(target=log_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert handler.dropped == 8 * 2000
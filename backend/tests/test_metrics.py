@@ -0,0 +1,107 @@
+import pytest
+from app.services.file_processor import FileProcessor
+from app.services.metrics import MetricsRegistry, file_processing_duration
+from app.services.process_pool import process_pool
+
+def sample(metric, line_start):
+    """Value of the sample whose line starts with line_start, or 0"""
+    for line in metric.samples():
+        if line.startswith(line_start + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+def test_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests handled', ('route', 'status'))
+    registry.counter('idle_total', 'Never incremented')
+    requests.inc(route='/a', status=200)
+    requests.inc(2, route='/a', status=200)
+    requests.inc(0.5, route='say "hi"\\\n', status=500)
+    
+    assert registry.render() == (
+        '# HELP requests_total Requests handled\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{route="/a",status="200"} 3\n'
+        'requests_total{route="say \\"hi\\"\\\\\\n",status="500"} 0.5\n'
+        '# HELP idle_total Never incremented\n'
+        '# TYPE idle_total counter\n'
+    )
+    with pytest.raises(ValueError):
+        registry.counter('requests_total', 'Again')
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(1.0, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 0.5, 2.0):
+        latency.observe(value, route='/a')
+    
+    assert list(latency.samples()) == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="0.5"} 4',
+        'latency_seconds_bucket{route="/a",le="1.0"} 4',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 5',
+        'latency_seconds_sum{route="/a"} 2.95',
+        'latency_seconds_count{route="/a"} 5',
+    ]
+    
+    # Timed blocks are observed even when they raise
+    with pytest.raises(RuntimeError):
+        with latency.time(route='/b'):
+            raise RuntimeError("failed")
+    assert sample(latency, 'latency_seconds_count{route="/b"}') == 1
+
+def test_drained_values_merge_into_another_registry():
+    def make_registry():
+        registry = MetricsRegistry()
+        return registry, registry.counter('calls_total', 'Calls', ('kind',)), \
+            registry.histogram('size', 'Size', buckets=(10, 100))
+    
+    worker, worker_calls, worker_size = make_registry()
+    parent, parent_calls, parent_size = make_registry()
+    parent_calls.inc(kind='a')
+    parent_size.observe(5)
+    worker_calls.inc(2, kind='a')
+    worker_calls.inc(kind='b')
+    worker_size.observe(50)
+    worker_size.observe(500)
+    
+    drained = worker.drain()
+    assert all(line.startswith('#') for line in worker.render().splitlines())
+    parent.merge(dict(drained, unknown_total={('x',): 1}))
+    
+    assert list(parent_calls.samples()) == ['calls_total{kind="a"} 3', 'calls_total{kind="b"} 1']
+    assert list(parent_size.samples()) == [
+        'size_bucket{le="10"} 1', 'size_bucket{le="100"} 2', 'size_bucket{le="+Inf"} 3',
+        'size_sum 555.0', 'size_count 3',
+    ]
+    assert 'unknown_total' not in parent.render()
+
+def test_pool_worker_metrics_reach_the_parent(db_path, make_document):
+    path = make_document()
+    extract = 'file_processing_duration_seconds_count{stage="extract",type="docx"}'
+    chunk = 'file_processing_duration_seconds_count{stage="chunk",type="docx"}'
+    before = sample(file_processing_duration, extract), sample(file_processing_duration, chunk)
+    
+    spans = process_pool.run(FileProcessor.process_file, db_path, 'f' * 64, path)
+    
+    assert spans
+    assert sample(file_processing_duration, extract) == before[0] + 1
+    assert sample(file_processing_duration, chunk) == before[1] + 1
+
+def test_metrics_and_cache_stats_require_the_token(make_app):
+    client = make_app(PROFILE_TOKEN='s3cret').test_client()
+    headers = {'X-Profile-Token': 's3cret'}
+    client.get('/api/health')
+    
+    for path in ('/api/metrics', '/api/cache/stats'):
+        assert client.get(path).status_code == 403
+        assert client.get(path, headers={'X-Profile-Token': 'wrong'}).status_code == 403
+        assert client.get(path, headers=headers).status_code == 200
+    
+    text = client.get('/api/metrics', headers=headers).get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/health",status="200"}' in text
+    assert client.get('/api/cache/stats', headers=headers).get_json()['data']['misses'] == 0
+    
+    # Without a configured token they are refused outright
+    client = make_app(PROFILE_TOKEN='').test_client()
+    assert client.get('/api/metrics', headers={'X-Profile-Token': ''}).status_code == 403
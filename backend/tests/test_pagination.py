@@ -0,0 +1,60 @@
+import base64
+import json
+import pytest
+from app.utils.pagination import decode_cursor, encode_cursor, parse_page_args
+
+def cursor_of(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+def test_cursor_round_trip():
+    row = {'id': 7, 'updated_at': '2026-01-02 03:04:05.000006'}
+    assert decode_cursor(encode_cursor(row, 'updated_at')) == ('2026-01-02 03:04:05.000006', 7)
+
+@pytest.mark.parametrize('value', [
+    [['2026-01-01'], 1],
+    [{'a': 1}, 1],
+    ['2026-01-01', '1'],
+    ['2026-01-01', True],
+    ['2026-01-01', 1.5],
+    [None, 1],
+    ['2026-01-01'],
+    ['2026-01-01', 1, 2],
+    {'sort': '2026-01-01', 'id': 1},
+    'text',
+])
+def test_malformed_cursors_are_rejected(value):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor_of(value))
+
+@pytest.mark.parametrize('cursor', ['!!!', 'e30', 'w6k', '\u00e9'])
+def test_undecodable_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+def test_page_args():
+    assert parse_page_args({}) is None
+    assert parse_page_args({'limit': '5'}) == (5, None)
+    for limit in ('0', '201', 'x'):
+        with pytest.raises(ValueError):
+            parse_page_args({'limit': limit})
+
+def test_pages_walk_every_row_once(client):
+    ids = [client.post('/api/discussions', json={'name': f'D{i}'}).get_json()['data']['id'] for i in range(7)]
+    
+    seen = []
+    cursor = None
+    while True:
+        query = '/api/discussions?limit=3&counts=true' + (f'&cursor={cursor}' if cursor else '')
+        data = client.get(query).get_json()['data']
+        seen += [item['id'] for item in data['items']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert seen == ids[::-1]
+
+@pytest.mark.parametrize('value', [[['x'], 1], [{'a': 1}, 2], ['x', [1]]])
+def test_bad_cursor_is_a_400(client, value):
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    for path in ('/api/discussions', f'/api/discussions/{discussion_id}/files'):
+        response = client.get(f'{path}?cursor={cursor_of(value)}')
+        assert response.status_code == 400, path
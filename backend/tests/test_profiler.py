@@ -0,0 +1,52 @@
+import os
+
+def profiling_app(make_app, tmp_path, token=''):
+    return make_app(PROFILING_ENABLED='true', PROFILE_DIR=str(tmp_path / 'profiles'), PROFILE_TOKEN=token)
+
+def test_admin_routes_not_registered_when_profiling_disabled(client):
+    assert client.get('/api/admin/profiles').status_code == 404
+
+def test_admin_routes_refused_without_configured_token(make_app, tmp_path):
+    client = profiling_app(make_app, tmp_path).test_client()
+    
+    assert client.get('/api/admin/profiles').status_code == 403
+    assert client.get('/api/admin/profiles', headers={'X-Profile-Token': ''}).status_code == 403
+    
+    # X-Profile is ignored as well; nothing gets profiled
+    client.get('/api/health', headers={'X-Profile': 'sample'})
+    assert list((tmp_path / 'profiles').iterdir()) == []
+
+def test_admin_routes_require_matching_token(make_app, tmp_path):
+    client = profiling_app(make_app, tmp_path, token='s3cret').test_client()
+    
+    assert client.get('/api/admin/profiles').status_code == 403
+    assert client.get('/api/admin/profiles', headers={'X-Profile-Token': 's3cre'}).status_code == 403
+    
+    client.get('/api/health', headers={'X-Profile': 'sample', 'X-Profile-Token': 's3cret'})
+    response = client.get('/api/admin/profiles', headers={'X-Profile-Token': 's3cret'})
+    assert response.status_code == 200
+    profiles = response.get_json()['data']['profiles']
+    assert [meta['path'] for meta in profiles] == ['/api/health']
+    
+    download = client.get(f"/api/admin/profiles/{profiles[0]['id']}", headers={'X-Profile-Token': 's3cret'})
+    assert download.status_code == 200
+    download.close()
+
+def test_only_the_newest_profiles_are_kept(make_app, tmp_path):
+    directory = tmp_path / 'profiles'
+    client = make_app(PROFILING_ENABLED='true', PROFILE_DIR=str(directory), PROFILE_TOKEN='s3cret',
+                      PROFILE_MAX_FILES='3').test_client()
+    headers = {'X-Profile': 'sample', 'X-Profile-Token': 's3cret'}
+    
+    # An old profile whose description is unreadable is pruned all the same
+    (directory / '20200101T000000-0badf00d.json').write_text('{not json')
+    (directory / '20200101T000000-0badf00d.collapsed').write_text('main 1\n')
+    os.utime(directory / '20200101T000000-0badf00d.json', (0, 0))
+    
+    for path in ('/api/health', '/api/discussions', '/api/health?second', '/api/discussions?page'):
+        client.get(path, headers=headers)
+    
+    names = sorted(path.name for path in directory.iterdir())
+    assert len(names) == 6 and not any(name.startswith('2020') for name in names)
+    listed = client.get('/api/admin/profiles', headers={'X-Profile-Token': 's3cret'}).get_json()['data']['profiles']
+    assert [meta['path'] for meta in listed] == ['/api/discussions', '/api/health', '/api/discussions']
@@ -0,0 +1,131 @@
+import time
+import pytest
+import requests
+from app.services.gemini_service import GeminiService
+from app.services.llm_client import LLMClient
+from tests.test_ingestion import upload
+
+@pytest.fixture
+def cache_app(make_app, fake_llm):
+    fake_llm.cache_min_tokens = 0
+    return make_app(PROMPT_CACHE_ENABLED='true', PROMPT_CACHE_MIN_TOKENS='0', PROMPT_CACHE_TTL='600')
+
+@pytest.fixture
+def cache_client(cache_app, make_document):
+    client = cache_app.test_client()
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    upload(client, discussion_id, make_document())
+    return client, discussion_id
+
+def ask(client, discussion_id, message='What is this about?'):
+    response = client.post(f'/api/discussions/{discussion_id}/chat', json={'message': message})
+    assert response.status_code == 200
+    return response.get_json()['data']['message']
+
+def calls(fake_llm, method):
+    return [request['payload'] for request in fake_llm.requests if request['method'] == method]
+
+def wait_for(condition, timeout=5.0):
+    # Replaced cached contents are deleted in the background
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+def test_prefix_is_created_once_and_reused(cache_client, fake_llm):
+    client, discussion_id = cache_client
+    ask(client, discussion_id, 'First question')
+    ask(client, discussion_id, 'Second question')
+    
+    assert len(calls(fake_llm, 'cachedContents.create')) == 1
+    name = next(iter(fake_llm.caches))
+    for payload in calls(fake_llm, 'generateContent'):
+        assert payload['cachedContent'] == name
+        assert 'system_instruction' not in payload
+
+def test_ttl_is_pushed_back_after_half_of_it(cache_app, cache_client, fake_llm):
+    client, discussion_id = cache_client
+    ask(client, discussion_id, 'First question')
+    entry = next(iter(cache_app.extensions['prompt_cache']._entries.values()))
+    entry['expires_at'] = time.time() + 100  # Less than half of the 600s TTL left
+    
+    ask(client, discussion_id, 'Second question')
+    assert calls(fake_llm, 'cachedContents.patch') == [{'name': entry['name']}]
+    assert entry['expires_at'] > time.time() + 500
+    assert fake_llm.caches[entry['name']]['expires_at'] > time.time() + 500
+
+def test_upload_replaces_the_prefix(cache_client, fake_llm, make_document):
+    client, discussion_id = cache_client
+    ask(client, discussion_id)
+    old_name = next(iter(fake_llm.caches))
+    
+    upload(client, discussion_id, make_document('more.docx', seed=2))
+    wait_for(lambda: old_name not in fake_llm.caches)
+    ask(client, discussion_id)
+    assert len(calls(fake_llm, 'cachedContents.create')) == 2
+    assert calls(fake_llm, 'generateContent')[-1]['cachedContent'] != old_name
+
+def test_discussion_delete_deletes_the_prefix(cache_client, fake_llm):
+    client, discussion_id = cache_client
+    ask(client, discussion_id)
+    
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 200
+    wait_for(lambda: not fake_llm.caches)
+    assert len(calls(fake_llm, 'cachedContents.delete')) == 1
+
+def test_expired_prefix_falls_back_inline(cache_client, fake_llm):
+    client, discussion_id = cache_client
+    ask(client, discussion_id, 'First question')
+    fake_llm.expire_caches()
+    
+    assert ask(client, discussion_id, 'Second question').startswith('This is a fake answer to: Second question')
+    rejected, retried = calls(fake_llm, 'generateContent')[-2:]
+    assert 'cachedContent' in rejected
+    assert 'cachedContent' not in retried and 'system_instruction' in retried
+    
+    # The stale entry is forgotten, so the next question builds a new prefix
+    ask(client, discussion_id, 'Third question')
+    assert len(calls(fake_llm, 'cachedContents.create')) == 2
+
+def test_unsupported_caching_sends_the_prefix_inline(make_app, fake_llm, make_document):
+    fake_llm.caching = False
+    client = make_app(PROMPT_CACHE_ENABLED='true', PROMPT_CACHE_MIN_TOKENS='0').test_client()
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    upload(client, discussion_id, make_document())
+    
+    ask(client, discussion_id, 'First question')
+    ask(client, discussion_id, 'Second question')
+    # Not retried before PROMPT_CACHE_RETRY_AFTER
+    assert len(calls(fake_llm, 'cachedContents.create')) == 1
+    assert all('system_instruction' in payload for payload in calls(fake_llm, 'generateContent'))
+
+class CacheRejectingClient(LLMClient):
+    """Answers requests naming a cached content with a fixed error status"""
+    
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+    
+    def request(self, method, url, json=None, *args, **kwargs):
+        if json and json.get('cachedContent'):
+            response = requests.Response()
+            response.status_code = self.status
+            raise requests.HTTPError(f"{self.status} Client Error", response=response)
+        return super().request(method, url, json, *args, **kwargs)
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_cache_miss_statuses_fall_back_inline(fake_llm, status):
+    service = GeminiService(api_key='test-key', api_base=fake_llm.base_url, model='test-model',
+                            client=CacheRejectingClient(status))
+    chunks = [{'content': 'The report covers revenue.'}]
+    
+    answer = service.get_chat_response('What is this about?', chunks, cached_content='cachedContents/gone')
+    assert answer.startswith('This is a fake answer')
+    assert 'The report covers revenue.' in calls(fake_llm, 'generateContent')[0]['system_instruction']['parts'][0]['text']
+
+def test_other_errors_are_not_retried_inline(fake_llm):
+    service = GeminiService(api_key='test-key', api_base=fake_llm.base_url, model='test-model',
+                            client=CacheRejectingClient(500))
+    
+    assert service.get_chat_response('Hi', cached_content='cachedContents/gone') == GeminiService.ERROR_RESPONSE
+    assert fake_llm.requests == []
@@ -0,0 +1,42 @@
+import time
+import pytest
+from app.services.async_llm_client import AsyncLLMClient
+from app.services.gemini_service import GeminiService
+from app.services.llm_client import LLMClient, LLMDeadlineExceededError
+
+def make_service(fake_llm, requests_per_minute, total_timeout=150.0):
+    async_client = AsyncLLMClient(client=LLMClient(total_timeout=total_timeout), requests_per_minute=requests_per_minute)
+    service = GeminiService(api_key='test-key', api_base=fake_llm.base_url, model='test-model',
+                            client=async_client.client, async_client=async_client)
+    return service, async_client.limiter
+
+def test_chat_calls_wait_for_the_shared_rate_limits(fake_llm):
+    service, limiter = make_service(fake_llm, requests_per_minute=60)
+    
+    calls = [
+        lambda: service.get_chat_response('Hello'),
+        lambda: ''.join(service.stream_chat_response('Hello')),
+        lambda: service.generate('Hello', 'Be brief'),
+    ]
+    for call in calls:
+        # An empty bucket refills one request per second
+        limiter._requests = 0
+        started = time.monotonic()
+        assert call().startswith('This is a fake answer')
+        assert time.monotonic() - started >= 0.9
+    
+    assert [request['method'] for request in fake_llm.requests] == [
+        'generateContent', 'streamGenerateContent', 'generateContent'
+    ]
+
+def test_rate_limit_wait_counts_toward_the_deadline(fake_llm):
+    service, limiter = make_service(fake_llm, requests_per_minute=1, total_timeout=0.5)
+    limiter._requests = 0
+    
+    started = time.monotonic()
+    assert service.get_chat_response('Hello') == GeminiService.ERROR_RESPONSE
+    with pytest.raises(LLMDeadlineExceededError):
+        ''.join(service.stream_chat_response('Hello'))
+    
+    assert time.monotonic() - started < 2.0
+    assert fake_llm.requests == []
@@ -0,0 +1,133 @@
+import sqlite3
+import time
+import pytest
+from app.models.discussion import Discussion
+from app.services.response_cache import ResponseCache
+from tests.test_ingestion import upload
+
+def key(corpus_version='v1', contents=('alpha', 'beta'), message='What is this?', history=None, summary=None):
+    return ResponseCache.make_key(corpus_version, [{'id': 1, 'content': text} for text in contents],
+                                  message, history, summary)
+
+def persistent_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT cache_key, discussion_id FROM ResponseCache ORDER BY cache_key').fetchall()
+    conn.close()
+    return rows
+
+@pytest.fixture
+def discussions(db_path):
+    """Two discussions for persistent entries to belong to"""
+    return Discussion.create(db_path, 'Topic'), Discussion.create(db_path, 'Other')
+
+def test_key_covers_everything_the_answer_depends_on():
+    base = key()
+    history = [{'role': 'user', 'parts': [{'text': 'Hi'}]}]
+    variants = [
+        key(corpus_version='v2'),
+        key(contents=('alpha', 'gamma')),
+        key(contents=('beta', 'alpha')),
+        key(contents=('alpha',)),
+        key(message='What is that?'),
+        key(history=history),
+        key(history=[{'role': 'user', 'parts': [{'text': 'Hello'}]}]),
+        key(summary='Earlier they asked about revenue'),
+    ]
+    assert len({base, *variants}) == len(variants) + 1
+    
+    # Questions differing only in case and spacing share an answer
+    assert key(message='  what IS\n this? ') == base
+    # No history or summary is the same as an empty one
+    assert key(history=[]) == base
+    assert key(summary='') == base
+    assert key(history=history) == key(history=[dict(history[0])])
+
+def test_entries_expire_after_the_ttl():
+    cache = ResponseCache(ttl=0.2)
+    cache.set('a', 'Answer', 1)
+    assert cache.get('a') == 'Answer'
+    
+    time.sleep(0.3)
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', 'A', 1)
+    cache.set('b', 'B', 1)
+    assert cache.get('a') == 'A'  # Now the most recently used
+    cache.set('c', 'C', 1)
+    
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == ('A', 'C')
+    assert cache.stats()['entries'] == 2
+
+def test_persistent_tier_is_shared_between_processes(db_path, discussions):
+    writer = ResponseCache(db_path=db_path)
+    reader = ResponseCache(db_path=db_path)
+    writer.set('a', 'Answer', discussions[0])
+    
+    assert reader.get('a') == 'Answer'
+    assert reader.get('a') == 'Answer'  # Now from memory
+    stats = reader.stats()
+    assert (stats['hits'], stats['persistent_hits'], stats['entries'], stats['persistent']) == (2, 1, 1, True)
+    
+    # Without a database path nothing is shared
+    assert ResponseCache().get('a') is None
+    assert ResponseCache().stats()['persistent'] is False
+
+def test_persistent_entries_expire_and_are_pruned(db_path, discussions):
+    writer = ResponseCache(ttl=0.2, db_path=db_path)
+    writer.PRUNE_EVERY = 2
+    writer.set('old', 'Old answer', discussions[0])
+    time.sleep(0.3)
+    
+    assert ResponseCache(db_path=db_path).get('old') is None
+    assert [row[0] for row in persistent_rows(db_path)] == ['old']
+    
+    # The next sweep removes the expired row
+    writer.ttl = 3600
+    writer.set('new', 'New answer', discussions[0])
+    assert [row[0] for row in persistent_rows(db_path)] == ['new']
+
+def test_invalidation_drops_only_that_discussion(db_path, discussions):
+    first, second = discussions
+    cache = ResponseCache(db_path=db_path)
+    cache.set('a', 'A', first)
+    cache.set('b', 'B', second)
+    cache.invalidate_discussion(first)
+    
+    assert persistent_rows(db_path) == [('b', second)]
+    assert cache.get('a') is None
+    assert ResponseCache(db_path=db_path).get('a') is None
+    assert cache.get('b') == 'B'
+
+def ask(client, discussion_id, message='What is this about?'):
+    response = client.post(f'/api/discussions/{discussion_id}/chat', json={'message': message})
+    assert response.status_code == 200
+    return response.get_json()['data']
+
+def test_upload_and_delete_invalidate_cached_answers(make_app, fake_llm, make_document):
+    app = make_app(RESPONSE_CACHE_PERSIST='true')
+    client = app.test_client()
+    cache = app.extensions['response_cache']
+    db_path = app.config['DATABASE_PATH']
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    other_id = client.post('/api/discussions', json={'name': 'Other'}).get_json()['data']['id']
+    upload(client, discussion_id, make_document())
+    upload(client, other_id, make_document('other.docx', seed=2))
+    
+    assert ask(client, discussion_id)['cached'] is False
+    assert ask(client, discussion_id)['cached'] is True
+    assert ask(client, other_id)['cached'] is False
+    assert len(fake_llm.requests) == 2
+    
+    upload(client, discussion_id, make_document('more.docx', seed=3))
+    assert [row[1] for row in persistent_rows(db_path)] == [other_id]
+    assert cache.stats()['entries'] == 1
+    assert ask(client, discussion_id)['cached'] is False
+    
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 200
+    assert [row[1] for row in persistent_rows(db_path)] == [other_id]
+    assert ask(client, other_id)['cached'] is True
@@ -0,0 +1,213 @@
+import json
+import math
+import re
+from collections import Counter
+import docx
+import pytest
+from app.models.discussion import Discussion
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.services.database_service import transaction
+from app.services.file_processor import FileProcessor
+from app.services.ingestion_service import store_chunks
+from app.services.retrieval_service import RetrievalService
+from app.services.vector_index import TfidfIndex, VectorIndexCache, vector_index_cache
+from tests.test_ingestion import add_file, upload
+
+FILLER = ('report', 'growth', 'supply', 'chain', 'regions', 'market', 'figures', 'quarter')
+
+def passage(offset, terms=()):
+    """About 150 characters of filler holding the given terms, as one sentence"""
+    words = list(terms)
+    index = offset
+    while len(' '.join(words)) < 150:
+        words.append(FILLER[index % len(FILLER)])
+        index += 3
+    return ' '.join(words) + '.'
+
+def add_passages(db_path, discussion_id, path, passages):
+    """Store a document whose chunks are exactly the given passages"""
+    document = docx.Document()
+    for text in passages:
+        document.add_paragraph(text)
+    document.save(path)
+    
+    file_id, content_hash = add_file(db_path, discussion_id, path)
+    spans = FileProcessor.process_file(db_path, content_hash, path, chunk_size=200, chunk_overlap=0)
+    with transaction(db_path, write=True):
+        store_chunks(db_path, file_id, content_hash, spans)
+        File.set_status(db_path, file_id, 'ready', chunk_count=len(spans))
+    
+    chunks = FileChunk.get_by_file(db_path, file_id)
+    assert [chunk['content'] for chunk in chunks] == list(passages)
+    return chunks
+
+@pytest.fixture
+def corpus(db_path, tmp_path):
+    """A discussion whose chunks mention 'zebra' 3, 1, 0 and 2 times"""
+    discussion_id = Discussion.create(db_path, 'Topic')
+    chunks = add_passages(db_path, discussion_id, str(tmp_path / 'zoo.docx'), [
+        passage(0, ['zebra', 'zebra', 'zebra']),
+        passage(1, ['zebra']),
+        passage(2, ['giraffe']),
+        passage(3, ['zebra', 'zebra']),
+    ])
+    return discussion_id, chunks
+
+def test_search_ranks_by_bm25(db_path, corpus):
+    discussion_id, chunks = corpus
+    
+    results = FileChunk.search(db_path, discussion_id, 'Zebra?')
+    assert [chunk['id'] for chunk in results] == [chunks[0]['id'], chunks[3]['id'], chunks[1]['id']]
+    assert results[0]['score'] > results[1]['score'] > results[2]['score'] > 0
+    assert [chunk['content'] for chunk in results] == [chunks[0]['content'], chunks[3]['content'], chunks[1]['content']]
+    
+    # Any one term is enough to match
+    assert len(FileChunk.search(db_path, discussion_id, 'giraffe zebra')) == 4
+    assert len(FileChunk.search(db_path, discussion_id, 'zebra', k=2)) == 2
+
+@pytest.mark.parametrize('query, matched', [
+    ('"zebra', 3),
+    ('zebra"', 3),
+    ('"giraffe" "', 1),
+    ('zeb*', 0),            # No prefix query
+    ('-zebra', 3),          # No negation
+    ('zebra NOT giraffe', 4),
+    ('zebra NEAR giraffe', 4),
+    ('NEAR(zebra giraffe)', 4),
+    ('giraffe AND', 1),
+    ('content:zebra', 3),   # No column filter
+    ('^zebra', 3),
+    ('"', 0),
+    ('*', 0),
+    ('', 0),
+])
+def test_search_treats_query_syntax_as_text(db_path, corpus, query, matched):
+    discussion_id, _ = corpus
+    assert len(FileChunk.search(db_path, discussion_id, query)) == matched
+
+def test_search_is_limited_to_the_discussion(db_path, corpus, tmp_path):
+    discussion_id, _ = corpus
+    other_id = Discussion.create(db_path, 'Other')
+    other_chunks = add_passages(db_path, other_id, str(tmp_path / 'other.docx'), [passage(4, ['zebra'] * 5)])
+    
+    assert [chunk['id'] for chunk in FileChunk.search(db_path, other_id, 'zebra')] == [other_chunks[0]['id']]
+    assert other_chunks[0]['id'] not in [chunk['id'] for chunk in FileChunk.search(db_path, discussion_id, 'zebra')]
+
+def test_chunks_used_reports_the_top_k(make_app, fake_llm, make_document):
+    client = make_app(RETRIEVAL_TOP_K='3').test_client()
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    assert upload(client, discussion_id, make_document(paragraphs=40))['chunks'] > 3
+    
+    for message in ('What about quarterly revenue?', 'Any zebras?'):  # The second matches nothing
+        response = client.post(f'/api/discussions/{discussion_id}/chat', json={'message': message})
+        assert response.status_code == 200
+        assert response.get_json()['data']['chunks_used'] == 3
+    
+    # The best match is the one sent to the model
+    best = FileChunk.search(client.application.config['DATABASE_PATH'], discussion_id, 'What about quarterly revenue?', k=1)
+    assert json.dumps(best[0]['content'])[1:-1] in json.dumps(fake_llm.requests[0]['payload'])
+
+def dense_tfidf_scores(texts, query):
+    """Cosine similarity of each text to the query, computed term by term"""
+    docs = [Counter(re.findall(r'\w+', text.lower())) for text in texts]
+    idf = {term: math.log((1 + len(docs)) / (1 + sum(term in doc for doc in docs))) + 1
+           for doc in docs for term in doc}
+    
+    def vector(counts):
+        weights = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items() if term in idf}
+        norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+        return {term: weight / norm for term, weight in weights.items()} if norm else {}
+    
+    query_vector = vector(Counter(re.findall(r'\w+', query.lower())))
+    return [sum(weight * query_vector.get(term, 0.0) for term, weight in vector(doc).items()) for doc in docs]
+
+def test_tfidf_index_scores_by_cosine_similarity():
+    texts = [passage(0, ['zebra'] * 3), passage(1, ['zebra']), passage(2, ['giraffe']),
+             passage(3, ['zebra', 'zebra', 'giraffe']), 'Zebra giraffe zebra.']
+    index = TfidfIndex.build([{'id': 10 + row, 'content': text} for row, text in enumerate(texts)])
+    
+    for query in ('zebra', 'giraffe zebra', 'ZEBRA giraffe giraffe report'):
+        expected = dense_tfidf_scores(texts, query)
+        ranked = sorted((row for row in range(len(texts)) if expected[row] > 0), key=lambda row: -expected[row])
+        matches = index.search(query, k=10)
+        assert [chunk_id for chunk_id, _ in matches] == [10 + row for row in ranked]
+        assert [score for _, score in matches] == pytest.approx([expected[row] for row in ranked])
+    
+    assert [chunk_id for chunk_id, _ in index.search('zebra', k=2)] == [14, 10]
+    assert index.search('okapi', k=3) == []
+    assert index.search('', k=3) == []
+    assert TfidfIndex.build([]).search('zebra', k=3) == []
+
+def test_index_cache_evicts_the_least_recently_used(db_path, monkeypatch):
+    cache = VectorIndexCache(max_entries=2)
+    built = []
+    monkeypatch.setattr(FileChunk, 'get_by_discussion', lambda db_path, discussion_id: built.append(discussion_id) or [])
+    
+    first = cache.get(db_path, 1)
+    cache.get(db_path, 2)
+    assert cache.get(db_path, 1) is first  # Now the most recently used
+    cache.get(db_path, 3)
+    
+    assert cache.get(db_path, 1) is first
+    cache.get(db_path, 2)
+    assert built == [1, 2, 3, 2]
+
+def test_index_built_during_a_change_is_not_cached(db_path, monkeypatch):
+    cache = VectorIndexCache()
+    get_by_discussion = FileChunk.get_by_discussion
+    
+    def changed_while_reading(db_path, discussion_id):
+        chunks = get_by_discussion(db_path, discussion_id)
+        cache.invalidate(db_path, discussion_id)
+        return chunks
+    
+    monkeypatch.setattr(FileChunk, 'get_by_discussion', changed_while_reading)
+    stale = cache.get(db_path, 1)
+    monkeypatch.undo()
+    assert cache.get(db_path, 1) is not stale
+    assert cache.get(db_path, 1) is cache.get(db_path, 1)
+
+def test_index_is_rebuilt_after_the_discussion_changes(app, client, make_document):
+    db_path = app.config['DATABASE_PATH']
+    discussion_id = client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+    upload(client, discussion_id, make_document())
+    before = vector_index_cache.get(db_path, discussion_id)
+    assert vector_index_cache.get(db_path, discussion_id) is before
+    
+    upload(client, discussion_id, make_document('more.docx', seed=2))
+    after = vector_index_cache.get(db_path, discussion_id)
+    assert len(after) == FileChunk.count_by_discussion(db_path, discussion_id) > len(before)
+    
+    assert client.delete(f'/api/discussions/{discussion_id}').status_code == 200
+    assert len(vector_index_cache.get(db_path, discussion_id)) == 0
+
+def test_rrf_fuses_rankings():
+    def ranking(*ids):
+        return [{'id': chunk_id, 'content': str(chunk_id)} for chunk_id in ids]
+    
+    def rrf(*ranks):
+        return sum(1.0 / (RetrievalService.RRF_K + rank + 1) for rank in ranks)
+    
+    fused = RetrievalService.fuse([ranking(1, 2, 3), ranking(3, 4, 1)], k=3)
+    # 1 and 3 appear in both lists; 1 ranks higher on the sum
+    assert [chunk['id'] for chunk in fused] == [1, 3, 2]
+    assert [chunk['score'] for chunk in fused] == pytest.approx([rrf(0, 2), rrf(2, 0), rrf(1)])
+    assert fused[0]['content'] == '1'
+    assert RetrievalService.fuse([ranking(), ranking()], k=3) == []
+
+def test_hybrid_retrieval_fuses_both_engines(db_path, corpus):
+    discussion_id, chunks = corpus
+    fts = RetrievalService.retrieve(db_path, discussion_id, 'zebra giraffe', k=4, engine='fts')
+    tfidf = RetrievalService.retrieve(db_path, discussion_id, 'zebra giraffe', k=4, engine='tfidf')
+    hybrid = RetrievalService.retrieve(db_path, discussion_id, 'zebra giraffe', k=4, engine='hybrid')
+    
+    expected = RetrievalService.fuse([fts, tfidf], k=4)
+    assert [chunk['id'] for chunk in hybrid] == [chunk['id'] for chunk in expected]
+    assert {chunk['id'] for chunk in hybrid} == {chunk['id'] for chunk in chunks}
+    
+    # Nothing matched: the start of the documents
+    fallback = RetrievalService.retrieve(db_path, discussion_id, 'okapi', k=2, engine='hybrid')
+    assert [chunk['id'] for chunk in fallback] == [chunk['id'] for chunk in chunks[:2]]
+    with pytest.raises(ValueError):
+        RetrievalService.retrieve(db_path, discussion_id, 'zebra', engine='vector')
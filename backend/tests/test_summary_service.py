@@ -0,0 +1,52 @@
+import sqlite3
+import pytest
+from app.services.database_service import transaction
+from app.services.gemini_service import GeminiService
+from app.services.summary_service import SummaryService
+
+class ObservedGemini(GeminiService):
+    """Checks, at each batch of LLM calls, what another connection can see and do"""
+    
+    def __init__(self, db_path, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.batches = []
+    
+    def generate_many(self, payloads, timeout=None):
+        conn = sqlite3.connect(self.db_path, timeout=0)
+        stored = conn.execute('SELECT COUNT(*) FROM PartialSummaries').fetchone()[0]
+        # Fails at once if anyone holds the write lock
+        conn.execute('BEGIN IMMEDIATE')
+        conn.rollback()
+        conn.close()
+        
+        self.batches.append((len(payloads), stored))
+        return super().generate_many(payloads, timeout)
+
+def test_levels_commit_before_the_next_calls(app, client, discussion_id):
+    db_path = app.config['DATABASE_PATH']
+    gemini = ObservedGemini(db_path, api_key='test-key')
+    service = SummaryService(gemini, map_token_budget=200, fan_in=2)
+    
+    result = service.summarize(db_path, discussion_id)
+    
+    assert result['summary']
+    assert len(gemini.batches) >= 3
+    # Each level sees every summary of the levels before it, already committed
+    made = 0
+    for calls, stored in gemini.batches:
+        assert stored == made
+        made += calls
+    
+    # A second run reuses every stored partial summary
+    again = SummaryService(gemini, map_token_budget=200, fan_in=2).summarize(db_path, discussion_id)
+    assert again['summary'] == result['summary']
+    assert again['stats']['llm_calls'] == 0
+
+def test_refuses_to_call_the_llm_inside_a_transaction(app, discussion_id):
+    db_path = app.config['DATABASE_PATH']
+    service = SummaryService(GeminiService(api_key='test-key'))
+    
+    with pytest.raises(RuntimeError, match='transaction'):
+        with transaction(db_path, write=True):
+            service.summarize(db_path, discussion_id)
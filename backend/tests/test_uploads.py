@@ -0,0 +1,116 @@
+import io
+import sqlite3
+import time
+from app.models.file import File
+from app.routes import files
+from app.services.file_processor import FileProcessor
+from app.services.process_pool import process_pool
+from app.services.upload_stream import UploadStream
+
+BOUNDARY = 'test-boundary'
+
+def multipart_body(files):
+    parts = []
+    for filename, data in files:
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+        )
+    return b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode('utf-8')
+
+class CheckedStream:
+    """A request body that checks, on every read, that nobody holds the write lock or wrote a file record yet"""
+    
+    def __init__(self, stream, db_path):
+        self.stream = stream
+        self.db_path = db_path
+        self.reads = 0
+    
+    def read(self, size=-1):
+        conn = sqlite3.connect(self.db_path, timeout=0)
+        conn.execute('BEGIN IMMEDIATE')
+        assert conn.execute('SELECT COUNT(*) FROM Files').fetchone()[0] == 0
+        conn.rollback()
+        conn.close()
+        self.reads += 1
+        return self.stream.read(size)
+
+def post_stream(client, discussion_id, body):
+    return client.post(
+        f'/api/discussions/{discussion_id}/files',
+        input_stream=body,
+        content_type=f'multipart/form-data; boundary={BOUNDARY}',
+        content_length=len(body.getvalue())
+    )
+
+def new_discussion(client):
+    return client.post('/api/discussions', json={'name': 'Topic'}).get_json()['data']['id']
+
+def test_no_write_lock_while_parts_stream_in(app, client, make_document, monkeypatch):
+    app.config['ASYNC_INGESTION'] = False
+    discussion_id = new_discussion(client)
+    documents = [make_document(f'doc{i}.docx', seed=i) for i in range(3)]
+    body = multipart_body([(f'doc{i}.docx', open(path, 'rb').read()) for i, path in enumerate(documents)])
+    streams = []
+    
+    class CheckedUploadStream(UploadStream):
+        def __init__(self, stream, content_type, field, max_size):
+            streams.append(CheckedStream(stream, app.config['DATABASE_PATH']))
+            super().__init__(streams[-1], content_type, field, max_size, block_size=4096)
+    monkeypatch.setattr(files, 'UploadStream', CheckedUploadStream)
+    
+    response = post_stream(client, discussion_id, io.BytesIO(body))
+    
+    assert response.status_code == 201, response.get_json()
+    assert streams[0].reads > 3
+    uploaded = response.get_json()['data']['uploaded']
+    assert len(uploaded) == 3
+    for item in uploaded:
+        file = File.get_by_id(app.config['DATABASE_PATH'], item['id'])
+        assert file['status'] == 'ready' and file['chunk_count'] == item['chunks'] > 0
+
+def test_failed_file_leaves_no_record(app, client, make_document):
+    app.config['ASYNC_INGESTION'] = False
+    discussion_id = new_discussion(client)
+    body = multipart_body([('good.docx', open(make_document(), 'rb').read()), ('bad.docx', b'not a docx')])
+    
+    response = post_stream(client, discussion_id, io.BytesIO(body))
+    
+    data = response.get_json()['data']
+    assert [item['filename'] for item in data['uploaded']] == ['good.docx']
+    assert [error['filename'] for error in data['errors']] == ['bad.docx']
+    assert [file['filename'] for file in File.get_by_discussion(app.config['DATABASE_PATH'], discussion_id)] == ['good.docx']
+
+def test_async_upload_reports_status(app, client, make_document):
+    app.config['ASYNC_INGESTION'] = True
+    discussion_id = new_discussion(client)
+    body = multipart_body([('doc.docx', open(make_document(), 'rb').read())])
+    
+    response = post_stream(client, discussion_id, io.BytesIO(body))
+    assert response.status_code == 202
+    item = response.get_json()['data']['uploaded'][0]
+    assert item['status'] == 'processing' and item['job_id']
+    
+    deadline = time.time() + 30
+    while True:
+        status = client.get(f"/api/discussions/{discussion_id}/files/{item['id']}/status").get_json()['data']
+        if status['status'] != 'processing' or time.time() > deadline:
+            break
+        time.sleep(0.1)
+    assert status['status'] == 'ready' and status['chunks'] > 0 and status['progress'] == 1.0
+
+def test_upload_of_stored_content_starts_no_processing(app, client, make_document, monkeypatch):
+    app.config['ASYNC_INGESTION'] = False
+    discussion_id = new_discussion(client)
+    documents = [(f'doc{i}.docx', open(make_document(f'doc{i}.docx', seed=i), 'rb').read()) for i in range(2)]
+    assert post_stream(client, discussion_id, io.BytesIO(multipart_body(documents))).status_code == 201
+    
+    calls = []
+    monkeypatch.setattr(FileProcessor, 'process_files', staticmethod(lambda *args: calls.append(args) or []))
+    monkeypatch.setattr(process_pool, '_get_executor', lambda: calls.append('executor'))
+    
+    response = post_stream(client, new_discussion(client), io.BytesIO(multipart_body(documents)))
+    assert response.status_code == 201
+    uploaded = response.get_json()['data']['uploaded']
+    assert [item['deduplicated'] for item in uploaded] == [True, True]
+    assert calls == []
@@ -0,0 +1,321 @@
+"""
+Ingest a directory tree of documents into a discussion, resumably
+
+Every PDF and DOCX file under the source directory is copied into the
+discussion's upload folder, hashed, and extracted and chunked on a pool of
+worker processes (--workers, by default PROCESSING_WORKERS or one per CPU
+core). The results are written by this process with the same models the
+upload endpoint uses, many files per transaction. Content already stored (by
+an earlier upload or earlier in the run) is not parsed again, and
+MAX_FILE_SIZE still applies. The per-discussion file limit of the upload
+endpoint does not.
+
+A checkpoint file records every file once its transaction has committed (or
+once it failed). Running the same command again after an interruption skips
+the recorded files; a file that changed since (size or modification time) is
+ingested again. A file committed but not yet recorded is recognised by name
+and hash and is not added twice. Text extracted before the interruption is
+kept in the text store, so its file is only chunked again, not parsed.
+
+Usage:
+    python -m tools.bulk_ingest /data/contracts --name "Contracts 2024"
+    python -m tools.bulk_ingest /data/contracts --discussion 12
+    python -m tools.bulk_ingest /data/contracts --discussion 12 --retry-failed --workers 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from app.models.content_blob import ContentBlob
+from app.models.discussion import Discussion
+from app.models.file import File
+from app.models.file_chunk import FileChunk
+from app.services.database_service import get_db_connection, init_db, transaction
+from app.services.file_processor import FileProcessor
+from app.services.process_pool import ProcessPool
+from app.utils.validators import allowed_file, file_size_error, sanitize_filename
+
+COPY_BLOCK_SIZE = 1024 * 1024
+COMMIT_INTERVAL = 10  # Seconds after which finished files are committed however few they are
+PROGRESS_INTERVAL = 5  # Seconds between progress lines
+
+def find_documents(source):
+    """(relative path, absolute path, size, mtime_ns) of every supported file under source, sorted"""
+    documents = []
+    for folder, subfolders, names in os.walk(source):
+        subfolders.sort()
+        for name in sorted(names):
+            if name.startswith('.') or not allowed_file(name):
+                continue
+            path = os.path.join(folder, name)
+            stat = os.stat(path)
+            documents.append((os.path.relpath(path, source), path, stat.st_size, stat.st_mtime_ns))
+    return documents
+
+def load_checkpoint(path, source, discussion_id, retry_failed):
+    """
+    Read a checkpoint file, creating it if needed
+    
+    Returns:
+        Dict of relative path -> (size, mtime_ns) of the files to skip
+    """
+    header = {'source': os.path.abspath(source), 'discussion_id': discussion_id}
+    if not os.path.exists(path):
+        with open(path, 'w') as checkpoint:
+            checkpoint.write(json.dumps(header) + '\n')
+        return {}
+    
+    with open(path, 'rb+') as checkpoint:
+        content = checkpoint.read()
+        if not content.endswith(b'\n'):
+            # An interrupted run may have cut its last line short; new lines go after the last whole one
+            content = content[:content.rfind(b'\n') + 1]
+            checkpoint.truncate(len(content))
+    
+    lines = content.decode('utf-8').splitlines()
+    if not lines or json.loads(lines[0]) != header:
+        raise ValueError(f"Checkpoint {path} belongs to another source directory or discussion")
+    done = {}
+    for line in lines[1:]:
+        entry = json.loads(line)
+        if entry['status'] == 'failed' and retry_failed:
+            done.pop(entry['path'], None)
+        else:
+            done[entry['path']] = (entry['size'], entry['mtime_ns'])
+    return done
+
+def append_checkpoint(checkpoint, entries):
+    """Record finished files, durably, before moving on"""
+    for entry in entries:
+        checkpoint.write(json.dumps(entry) + '\n')
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+def prepare_file(db_path, folder, source, max_size):
+    """
+    Copy a document into the upload folder, then extract and chunk it (runs in a worker)
+    
+    The copy is named after its hash, so a file copied again after an
+    interruption replaces its earlier copy rather than adding one.
+    
+    Returns:
+        Dict with the stored file's 'filename', 'file_path', 'size' and
+        'content_hash', and its chunk 'spans' (None if the content is already
+        chunked in the database)
+    """
+    size = os.path.getsize(source)
+    if size > max_size:
+        raise ValueError(file_size_error(max_size))
+    
+    filename = sanitize_filename(os.path.basename(source))
+    if not allowed_file(filename):
+        filename = f"document{os.path.splitext(source)[1].lower()}"
+    
+    partial_path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(source, 'rb') as src, open(partial_path, 'wb') as out:
+            while True:
+                block = src.read(COPY_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                out.write(block)
+        content_hash = digest.hexdigest()
+        file_path = os.path.join(folder, f"{content_hash[:12]}_{filename}")
+        os.replace(partial_path, file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    
+    spans = None
+    blob = ContentBlob.get(db_path, content_hash)
+    if blob is None or blob['chunk_count'] is None:
+        try:
+            spans = FileProcessor.process_file(db_path, content_hash, file_path)
+        except Exception:
+            os.remove(file_path)
+            raise
+    
+    return {
+        'filename': filename,
+        'file_path': file_path,
+        'size': size,
+        'content_hash': content_hash,
+        'spans': spans
+    }
+
+def store_files(db_path, discussion_id, prepared, existing):
+    """
+    Create the file records and chunks of prepared files in one transaction
+    
+    Args:
+        prepared: (document, result) pairs from prepare_file
+        existing: (filename, content_hash) of the discussion's files, updated
+    
+    Returns:
+        Checkpoint entries for the files
+    """
+    entries = []
+    with transaction(db_path, write=True):
+        for (relative, _, size, mtime_ns), result in prepared:
+            entry = {'path': relative, 'size': size, 'mtime_ns': mtime_ns}
+            content_hash = result['content_hash']
+            key = (result['filename'], content_hash)
+            blob = ContentBlob.get(db_path, content_hash)
+            
+            if key in existing:
+                # Committed by an interrupted run that did not record it
+                entry.update(status='present')
+            elif blob is not None and blob['chunk_count'] is not None:
+                file_id = File.create(
+                    db_path, discussion_id, result['filename'], result['file_path'], result['size'],
+                    content_hash=content_hash, chunk_count=blob['chunk_count']
+                )
+                entry.update(status='deduplicated', file_id=file_id, chunks=blob['chunk_count'])
+            elif result['spans'] is None:
+                # Its content was deleted since the worker found it stored
+                entry.update(status='failed', error="Content was deleted during ingestion; run again")
+            else:
+                spans = result['spans']
+                file_id = File.create(
+                    db_path, discussion_id, result['filename'], result['file_path'], result['size'],
+                    content_hash=content_hash, chunk_count=len(spans)
+                )
+                FileChunk.create_batch(db_path, file_id, spans)
+                ContentBlob.mark_stored(db_path, content_hash, len(spans))
+                entry.update(status='ready', file_id=file_id, chunks=len(spans))
+            
+            if entry['status'] != 'failed':
+                existing.add(key)
+            entries.append(entry)
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a directory of documents into a discussion")
+    parser.add_argument('source', help="Directory to ingest (searched recursively)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--discussion', type=int, help="ID of the discussion to add the files to")
+    target.add_argument('--name', help="Create a discussion with this name")
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'database/instance/app.db'))
+    parser.add_argument('--uploads', default=os.getenv('UPLOAD_FOLDER', 'uploads'))
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: beside the database)")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('PROCESSING_WORKERS', 0)) or None,
+                        help="Worker processes (default: one per CPU core)")
+    parser.add_argument('--commit-every', type=int, default=200, help="Files written per transaction")
+    parser.add_argument('--retry-failed', action='store_true', help="Try files that failed before again")
+    args = parser.parse_args()
+    
+    if not os.path.isdir(args.source):
+        print(f"No directory at {args.source}")
+        return 1
+    
+    db_path = args.db
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    init_db(db_path)
+    if args.name:
+        discussion_id = Discussion.create(db_path, args.name)
+        print(f"Created discussion {discussion_id}; add --discussion {discussion_id} instead of --name to resume")
+    else:
+        discussion_id = args.discussion
+        if not Discussion.get_by_id(db_path, discussion_id):
+            print(f"Discussion {discussion_id} not found")
+            return 1
+    
+    folder = os.path.join(args.uploads, f"discussion_{discussion_id}")
+    os.makedirs(folder, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(
+        os.path.dirname(os.path.abspath(db_path)), f"bulk_ingest_{discussion_id}.jsonl"
+    )
+    try:
+        done = load_checkpoint(checkpoint_path, args.source, discussion_id, args.retry_failed)
+    except ValueError as e:
+        print(e)
+        return 1
+    
+    documents = find_documents(args.source)
+    pending = [doc for doc in documents if done.get(doc[0]) != (doc[2], doc[3])]
+    print(f"{len(documents)} documents, {len(documents) - len(pending)} already done, {len(pending)} to ingest")
+    if not pending:
+        return 0
+    
+    conn = get_db_connection(db_path)
+    existing = {
+        (row['filename'], row['content_hash'])
+        for row in conn.execute('SELECT filename, content_hash FROM Files WHERE discussion_id = ?', (discussion_id,))
+    }
+    conn.close()
+    
+    max_size = int(os.getenv('MAX_FILE_SIZE', 52428800))
+    by_path = {doc[1]: doc for doc in pending}
+    pool = ProcessPool(args.workers)
+    counts = {'ready': 0, 'deduplicated': 0, 'present': 0, 'failed': 0}
+    files_done = bytes_done = chunks = 0
+    prepared = []
+    started = last_commit = last_progress = time.perf_counter()
+    
+    def progress(now):
+        elapsed = max(now - started, 1e-9)
+        print(
+            f"{files_done}/{len(pending)} files, {files_done / elapsed:.1f} files/s, "
+            f"{bytes_done / 1024 / 1024 / elapsed:.1f} MB/s, {counts['failed']} failed"
+        )
+    
+    with open(checkpoint_path, 'a') as checkpoint:
+        def finish(entries):
+            nonlocal chunks
+            append_checkpoint(checkpoint, entries)
+            for entry in entries:
+                counts[entry['status']] += 1
+                if entry['status'] == 'ready':
+                    chunks += entry['chunks']
+                elif entry['status'] == 'failed':
+                    print(f"Failed: {entry['path']}: {entry['error']}")
+        
+        def commit():
+            nonlocal prepared, last_commit
+            if prepared:
+                finish(store_files(db_path, discussion_id, prepared, existing))
+            prepared, last_commit = [], time.perf_counter()
+        
+        try:
+            tasks = ((db_path, folder, doc[1], max_size) for doc in pending)
+            for task, result, error in pool.imap_unordered(prepare_file, tasks):
+                document = by_path[task[2]]
+                files_done += 1
+                bytes_done += document[2]
+                if error is not None:
+                    relative, _, size, mtime_ns = document
+                    finish([{'path': relative, 'size': size, 'mtime_ns': mtime_ns,
+                             'status': 'failed', 'error': str(error)}])
+                else:
+                    prepared.append((document, result))
+                
+                now = time.perf_counter()
+                if len(prepared) >= args.commit_every or now - last_commit >= COMMIT_INTERVAL:
+                    commit()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    progress(now)
+                    last_progress = now
+            commit()
+        except (KeyboardInterrupt, BrokenProcessPool):
+            # Files already committed are in the checkpoint; the rest are redone next time
+            print(f"Interrupted with {sum(counts.values())} files recorded; run the same command again to resume")
+            return 130
+        finally:
+            pool.shutdown(wait=False)
+    
+    elapsed = time.perf_counter() - started
+    progress(time.perf_counter())
+    print(
+        f"Ingested {counts['ready']} files ({chunks} chunks), {counts['deduplicated']} deduplicated, "
+        f"{counts['present']} already present, {counts['failed']} failed in {elapsed:.1f}s"
+    )
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
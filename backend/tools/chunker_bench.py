@@ -0,0 +1,192 @@
+"""
+Benchmark and equivalence check for FileProcessor's chunker
+
+Times the linear-time chunker (FileProcessor.chunk_text / iter_chunks) against
+the original backward-scanning algorithm on synthetic corpora, and with
+--verify checks on randomized and pathological inputs that both produce
+identical chunks, including when the text is streamed in arbitrary pieces.
+
+Usage:
+    python -m tools.chunker_bench --sizes 1,10,100 --corpora prose,no-punctuation
+    python -m tools.chunker_bench --sizes 500 --skip-legacy
+    python -m tools.chunker_bench --verify --cases 2000
+"""
+import argparse
+import logging
+import random
+import re
+import sys
+import time
+from app.services.file_processor import FileProcessor
+from logging_config import app_logger
+
+CORPORA = ('prose', 'no-punctuation', 'no-whitespace', 'unicode')
+WORDS = ('the', 'report', 'summarizes', 'quarterly', 'revenue', 'growth', 'and', 'a',
+         'discussion', 'of', 'risks', 'in', 'supply', 'chain', 'operations', 'across', 'regions')
+
+def legacy_chunk_text(text, chunk_size=None, chunk_overlap=None):
+    """The original chunker, kept verbatim as the reference implementation"""
+    if chunk_size is None:
+        chunk_size = FileProcessor.CHUNK_SIZE
+    if chunk_overlap is None:
+        chunk_overlap = FileProcessor.CHUNK_OVERLAP
+    
+    if not text or len(text) == 0:
+        return []
+    
+    chunks = []
+    start = 0
+    text_length = len(text)
+    
+    while start < text_length:
+        end = start + chunk_size
+        
+        # If this is not the last chunk, try to break at a sentence or word boundary
+        if end < text_length:
+            # Look for sentence boundary (., !, ?)
+            for i in range(end, max(start, end - 100), -1):
+                if text[i] in '.!?\n':
+                    end = i + 1
+                    break
+            else:
+                # If no sentence boundary, look for word boundary
+                for i in range(end, max(start, end - 50), -1):
+                    if text[i].isspace():
+                        end = i
+                        break
+        
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        
+        # Move start position with overlap
+        start = end - chunk_overlap if end < text_length else text_length
+    
+    return chunks
+
+def make_corpus(kind, size, seed=0):
+    """Build about `size` characters of synthetic text of the given kind"""
+    rng = random.Random(seed)
+    block_words = rng.choices(WORDS, k=20000)
+    
+    if kind == 'prose':
+        parts = []
+        for i, word in enumerate(block_words):
+            parts.append(word)
+            parts.append('. ' if i % 15 == 14 else ('\n' if i % 97 == 96 else ' '))
+        block = ''.join(parts)
+    elif kind == 'no-punctuation':
+        # Long runs without sentence boundaries force the word-boundary search
+        block = ' '.join(block_words)
+    elif kind == 'no-whitespace':
+        # No boundaries at all: every chunk is cut at exactly chunk_size
+        block = ''.join(block_words)
+    elif kind == 'unicode':
+        separators = [' ', ' ', ' ', '　', '\t', '! ', '? ', '\n']
+        block = ''.join(word + rng.choice(separators) for word in block_words)
+    else:
+        raise ValueError(f"Unknown corpus: {kind}")
+    
+    repeats = size // len(block) + 1
+    return (block * repeats)[:size]
+
+def time_call(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def run_benchmark(sizes_mb, corpora, skip_legacy=False):
+    print(f"{'corpus':<16}{'size':>8}{'chunks':>10}{'linear s':>11}{'MB/s':>9}{'legacy s':>11}{'speedup':>9}")
+    for kind in corpora:
+        for size_mb in sizes_mb:
+            text = make_corpus(kind, int(size_mb * 1024 * 1024))
+            chunks, elapsed = time_call(FileProcessor.chunk_text, text)
+            row = f"{kind:<16}{size_mb:>6}MB{len(chunks):>10}{elapsed:>11.3f}{size_mb / elapsed:>9.1f}"
+            
+            if not skip_legacy:
+                legacy_chunks, legacy_elapsed = time_call(legacy_chunk_text, text)
+                if legacy_chunks != chunks:
+                    print(f"{row}  OUTPUT MISMATCH")
+                    return 1
+                row += f"{legacy_elapsed:>11.3f}{legacy_elapsed / elapsed:>8.2f}x"
+            print(row, flush=True)
+            del text, chunks
+    return 0
+
+def random_text(rng):
+    alphabet = ['a', 'b', 'word', ' ', '  ', '.', '!', '?', '\n', '\t', ' ', '　', 'xyz', 'é']
+    weights = [rng.random() for _ in alphabet]
+    length = rng.choice([0, 1, 5, 99, 100, 101, 999, 1000, 1001, 1002, 2500, 20000])
+    return ''.join(rng.choices(alphabet, weights=weights, k=length))
+
+def split_randomly(rng, text):
+    cut_count = min(len(text) + 1, rng.randint(0, 50))
+    cuts = sorted(rng.sample(range(len(text) + 1), cut_count))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+def run_verify(cases, seed=0):
+    """Compare both chunkers on random and pathological inputs"""
+    rng = random.Random(seed)
+    
+    # The word-boundary regex relies on \s agreeing with str.isspace()
+    space = re.compile(r'\s')
+    for code_point in range(sys.maxunicode + 1):
+        char = chr(code_point)
+        if bool(space.match(char)) != char.isspace():
+            print(f"\\s and str.isspace() disagree on U+{code_point:04X}")
+            return 1
+    
+    fixed = [
+        'a' * 5000,
+        ' ' * 5000,
+        '.' * 5000,
+        ('word ' * 2000).strip(),
+        'x' * 999 + '.' + 'y' * 3000,
+        'x' * 1000 + '\n' + 'y' * 3000,
+        'x' * 1001 + ' ' + 'y' * 3000,
+        make_corpus('unicode', 50000, seed),
+    ]
+    texts = fixed + [random_text(rng) for _ in range(cases)]
+    
+    for number, text in enumerate(texts):
+        # The overlap must stay below the shortest possible chunk (chunk_size - 99)
+        chunk_size = rng.choice([150, 300, 1000, 4000])
+        chunk_overlap = rng.choice([0, 50, min(200, chunk_size - 100)])
+        
+        expected = legacy_chunk_text(text, chunk_size, chunk_overlap)
+        whole = FileProcessor.chunk_text(text, chunk_size, chunk_overlap)
+        spans = list(FileProcessor.iter_chunk_spans(split_randomly(rng, text), chunk_size, chunk_overlap))
+        streamed = [chunk for _, _, chunk in spans]
+        if whole != expected or streamed != expected:
+            print(f"Mismatch on case {number} (length {len(text)}, chunk_size {chunk_size}, overlap {chunk_overlap})")
+            return 1
+        
+        # Each chunk must be exactly its byte range of the encoded text
+        encoded = text.encode('utf-8')
+        if any(encoded[start:end].decode('utf-8') != chunk for start, end, chunk in spans):
+            print(f"Wrong offsets on case {number} (length {len(text)}, chunk_size {chunk_size}, overlap {chunk_overlap})")
+            return 1
+    
+    print(f"OK: {len(texts)} cases produced identical chunks at the right offsets")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and verify the file chunker")
+    parser.add_argument('--sizes', default='1,10,100', help="Comma-separated corpus sizes in MB")
+    parser.add_argument('--corpora', default=','.join(CORPORA), help="Comma-separated corpus kinds")
+    parser.add_argument('--skip-legacy', action='store_true', help="Do not time the original algorithm")
+    parser.add_argument('--verify', action='store_true', help="Run the equivalence checks instead")
+    parser.add_argument('--cases', type=int, default=1000, help="Random cases for --verify")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    # chunk_text logs every call
+    app_logger.setLevel(logging.WARNING)
+    
+    if args.verify:
+        return run_verify(args.cases, args.seed)
+    sizes = [float(size) if '.' in size else int(size) for size in args.sizes.split(',')]
+    return run_benchmark(sizes, args.corpora.split(','), args.skip_legacy)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Convert stored chunk content to (or from) compressed storage
+
+Trains a zlib preset dictionary from a sample of the stored chunks, re-encodes
+every ContentChunks row with it in batches, then VACUUMs and prints database
+size and chunk read throughput before and after. Full-text index entries are
+left untouched because the decoded text does not change. Chunks that are
+ranges of the text store (see tools.rechunk) hold no content of their own and
+are skipped.
+
+Set CHUNK_COMPRESSION=zlib for the app to store new chunks compressed too.
+
+Usage:
+    python -m tools.compress_chunks database/instance/app.db
+    python -m tools.compress_chunks database/instance/app.db --no-dictionary --level 9
+    python -m tools.compress_chunks database/instance/app.db --decompress
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+from app.services import chunk_codec
+from app.services.database_service import get_db_connection, init_db
+
+def measure(conn, db_path):
+    """Database size on disk and the speed of reading and decoding every chunk"""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    size = os.path.getsize(db_path)
+    
+    started = time.perf_counter()
+    chunks = 0
+    stored_bytes = 0
+    text_bytes = 0
+    for (content,) in conn.execute('SELECT content FROM ContentChunks WHERE content IS NOT NULL'):
+        text = chunk_codec.decode(content, db_path)
+        chunks += 1
+        stored_bytes += len(content.encode('utf-8') if isinstance(content, str) else content)
+        text_bytes += len(text.encode('utf-8'))
+    elapsed = time.perf_counter() - started
+    
+    return {
+        'size_mb': size / 1024 / 1024,
+        'chunks': chunks,
+        'stored_mb': stored_bytes / 1024 / 1024,
+        'text_mb': text_bytes / 1024 / 1024,
+        'read_seconds': elapsed,
+        'chunks_per_second': chunks / elapsed if elapsed else 0.0,
+        'text_mb_per_second': text_bytes / 1024 / 1024 / elapsed if elapsed else 0.0,
+    }
+
+def sample_chunks(conn, db_path, count, seed=0):
+    ids = [row[0] for row in conn.execute('SELECT id FROM ContentChunks WHERE content IS NOT NULL')]
+    chosen = random.Random(seed).sample(ids, min(count, len(ids)))
+    samples = []
+    for chunk_id in chosen:
+        content = conn.execute('SELECT content FROM ContentChunks WHERE id = ?', (chunk_id,)).fetchone()[0]
+        samples.append(chunk_codec.decode(content, db_path))
+    return samples
+
+def reencode(conn, db_path, encode, batch_size):
+    """Rewrite every chunk with encode(text), one transaction per batch"""
+    last_id = 0
+    rewritten = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, content FROM ContentChunks WHERE id > ? AND content IS NOT NULL ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return rewritten
+        
+        updates = [(encode(chunk_codec.decode(row['content'], db_path)), row['id']) for row in rows]
+        conn.execute('BEGIN')
+        conn.executemany('UPDATE ContentChunks SET content = ? WHERE id = ?', updates)
+        conn.execute('COMMIT')
+        
+        last_id = rows[-1]['id']
+        rewritten += len(rows)
+
+def drop_unused_dictionaries(conn):
+    """Delete dictionaries no stored chunk refers to (chunks may be written while this runs)"""
+    dropped = 0
+    for (dictionary_id,) in conn.execute('SELECT id FROM ChunkDictionaries').fetchall():
+        header = struct.pack('>BI', chunk_codec.DICTIONARY_DEFLATE, dictionary_id)
+        in_use = conn.execute(
+            "SELECT 1 FROM ContentChunks WHERE typeof(content) = 'blob' AND substr(content, 1, 5) = ? LIMIT 1",
+            (header,)
+        ).fetchone()
+        if not in_use:
+            conn.execute('DELETE FROM ChunkDictionaries WHERE id = ?', (dictionary_id,))
+            dropped += 1
+    return dropped
+
+def print_report(before, after):
+    rows = [
+        ('database size (MB)', 'size_mb', '{:.2f}'),
+        ('chunks', 'chunks', '{}'),
+        ('stored chunks (MB)', 'stored_mb', '{:.2f}'),
+        ('chunk text (MB)', 'text_mb', '{:.2f}'),
+        ('read + decode all (s)', 'read_seconds', '{:.3f}'),
+        ('chunks / s', 'chunks_per_second', '{:,.0f}'),
+        ('text MB / s', 'text_mb_per_second', '{:.1f}'),
+    ]
+    print(f"\n{'':<24}{'before':>14}{'after':>14}")
+    for label, key, fmt in rows:
+        print(f"{label:<24}{fmt.format(before[key]):>14}{fmt.format(after[key]):>14}")
+    print(f"{'database size ratio':<24}{'':>14}{after['size_mb'] / before['size_mb']:>14.2f}")
+    print(f"{'stored chunks ratio':<24}{'':>14}{after['stored_mb'] / before['stored_mb']:>14.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress or decompress stored chunk content")
+    parser.add_argument('db_path', help="Path to the SQLite database")
+    parser.add_argument('--decompress', action='store_true', help="Store every chunk as plain text again")
+    parser.add_argument('--no-dictionary', action='store_true', help="Compress without a trained dictionary")
+    parser.add_argument('--level', type=int, default=chunk_codec.COMPRESSION_LEVEL, help="zlib level (1-9)")
+    parser.add_argument('--samples', type=int, default=2000, help="Chunks sampled to train the dictionary")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    db_path = args.db_path
+    if not os.path.exists(db_path):
+        print(f"No database at {db_path}")
+        return 1
+    
+    # Brings the schema up to date (compressed storage needs migration 3)
+    init_db(db_path)
+    conn = get_db_connection(db_path)
+    before = measure(conn, db_path)
+    if not before['chunks']:
+        print("No chunk holds its own content; nothing to re-encode")
+        conn.close()
+        return 0
+    
+    if args.decompress:
+        encode = lambda text: text
+    elif args.no_dictionary:
+        encode = lambda text: chunk_codec.encode(text, level=args.level)
+    else:
+        dictionary = chunk_codec.train_dictionary(sample_chunks(conn, db_path, args.samples))
+        conn.execute('BEGIN')
+        dictionary_id = chunk_codec.store_dictionary(conn, dictionary)
+        conn.execute('COMMIT')
+        print(f"Trained a {len(dictionary)} byte dictionary (id {dictionary_id})")
+        encode = lambda text: chunk_codec.encode(text, dictionary, dictionary_id, args.level)
+    
+    rewritten = reencode(conn, db_path, encode, args.batch_size)
+    print(f"Re-encoded {rewritten} chunks")
+    
+    dropped = drop_unused_dictionaries(conn)
+    if dropped:
+        print(f"Dropped {dropped} unused dictionaries")
+    conn.execute('VACUUM')
+    
+    after = measure(conn, db_path)
+    conn.close()
+    print_report(before, after)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""
+Local stand-in for the Gemini generateContent API
+
+Serves :generateContent and :streamGenerateContent?alt=sse with deterministic
+answers so chat (including streaming) can be exercised offline. Point the
+backend at it with LLM_API_BASE=http://127.0.0.1:<port>/v1beta.
+
+A share of requests can be failed on purpose (--error-rate) with a status drawn
+from --error-statuses; 429 answers carry a Retry-After header.
+
+The cachedContents API is emulated too: create (with Gemini's minimum size,
+--cache-min-tokens), get, TTL update and delete, and generateContent calls
+naming a cachedContent get its system instruction. Unknown or expired caches
+are answered with 404; --no-caching makes creating one fail with 400, as for
+models without caching.
+
+Usage:
+    python -m tools.fake_gemini --port 8089 --latency 0.2 --tokens-per-second 50
+    python -m tools.fake_gemini --port 8089 --error-rate 0.1 --error-statuses 429,503
+    python -m tools.fake_gemini --port 8089 --no-caching
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTE_PATTERN = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)$')
+CACHE_ROUTE_PATTERN = re.compile(r'^/v1beta/(?P<name>cachedContents(?:/[^/]+)?)$')
+TTL_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)s$')
+DEFAULT_CACHE_TTL = 3600
+
+def fake_answer(payload):
+    """Build a deterministic answer from a generateContent request body"""
+    contents = payload.get('contents', [])
+    question = ''
+    if contents:
+        question = ''.join(part.get('text', '') for part in contents[-1].get('parts', []))
+    if len(question) > 200:
+        # Summarization prompts carry whole documents; keep answers short
+        question = question[:200] + '...'
+    system_parts = payload.get('system_instruction', {}).get('parts', [])
+    context_chars = sum(len(part.get('text', '')) for part in system_parts)
+    return (
+        f"This is a fake answer to: {question}. "
+        f"The prompt carried {context_chars} characters of instructions and context "
+        f"and {len(contents) - 1} earlier turns."
+    )
+
+def usage_metadata(payload, answer, cached_tokens=0):
+    """Approximate Gemini usageMetadata (about four characters per token)"""
+    prompt_chars = len(json.dumps(payload))
+    prompt_tokens = prompt_chars // 4 + cached_tokens
+    response_tokens = max(1, len(answer) // 4)
+    usage = {
+        'promptTokenCount': prompt_tokens,
+        'candidatesTokenCount': response_tokens,
+        'totalTokenCount': prompt_tokens + response_tokens
+    }
+    if cached_tokens:
+        usage['cachedContentTokenCount'] = cached_tokens
+    return usage
+
+def parse_ttl(ttl):
+    """Seconds of a Duration string such as '3600s'"""
+    match = TTL_PATTERN.match(str(ttl))
+    if not match:
+        raise ValueError(f"Invalid ttl {ttl!r}")
+    return float(match.group(1))
+
+def candidate(text, finished=False):
+    body = {'content': {'role': 'model', 'parts': [{'text': text}]}}
+    if finished:
+        body['finishReason'] = 'STOP'
+    return body
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Request handler; behaviour is configured on the owning server"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        match = ROUTE_PATTERN.match(path)
+        cache_match = CACHE_ROUTE_PATTERN.match(path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if not match and not (cache_match and cache_match.group('name') == 'cachedContents'):
+            self._send_error(404, f'Unknown path {path}')
+            return
+        
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self._send_error(400, 'Invalid JSON payload')
+            return
+        
+        method = match.group('method') if match else 'cachedContents.create'
+        self.server.record_request(method, payload)
+        time.sleep(self.server.latency)
+        
+        status = self.server.injected_error()
+        if status:
+            headers = {'Retry-After': str(self.server.retry_after)} if status == 429 else {}
+            self._send_error(status, 'Injected error', headers)
+            return
+        
+        if not match:
+            self._create_cache(payload)
+            return
+        
+        cached_tokens = 0
+        if payload.get('cachedContent'):
+            cache = self.server.get_cache(payload['cachedContent'])
+            if cache is None:
+                self._send_error(404, f"CachedContent not found: {payload['cachedContent']}")
+                return
+            if cache['model'] != f"models/{match.group('model')}":
+                self._send_error(400, 'Model does not match the cached content')
+                return
+            if 'system_instruction' in payload:
+                self._send_error(400, 'system_instruction cannot be set with cachedContent')
+                return
+            # Answer as if the cached prefix had been sent with the request
+            payload = dict(payload, system_instruction=cache['system_instruction'],
+                           contents=cache['contents'] + payload.get('contents', []))
+            cached_tokens = cache['usageMetadata']['totalTokenCount']
+        
+        answer = fake_answer(payload)
+        if match.group('method') == 'streamGenerateContent':
+            self._stream(payload, answer, cached_tokens)
+        else:
+            self._pace(answer)
+            self._send_json(200, {
+                'candidates': [candidate(answer, finished=True)],
+                'usageMetadata': usage_metadata(payload, answer, cached_tokens),
+                'modelVersion': match.group('model')
+            })
+    
+    def do_GET(self):
+        cache = self._cache_request('cachedContents.get')
+        if cache is not None:
+            self._send_json(200, self.server.describe_cache(cache))
+    
+    def do_PATCH(self):
+        # Read the body first so a 404 leaves the keep-alive connection clean
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        cache = self._cache_request('cachedContents.patch')
+        if cache is None:
+            return
+        try:
+            ttl = parse_ttl(json.loads(body or b'{}').get('ttl', ''))
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        self._send_json(200, self.server.describe_cache(self.server.update_cache(cache['name'], ttl)))
+    
+    def do_DELETE(self):
+        cache = self._cache_request('cachedContents.delete')
+        if cache is not None:
+            self.server.delete_cache(cache['name'])
+            self._send_json(200, {})
+    
+    def _cache_request(self, method):
+        """Look up the cached content named in the path, answering 404 if there is none"""
+        match = CACHE_ROUTE_PATTERN.match(self.path.split('?', 1)[0])
+        if not match or match.group('name') == 'cachedContents':
+            self._send_error(404, f'Unknown path {self.path}')
+            return None
+        self.server.record_request(method, {'name': match.group('name')})
+        cache = self.server.get_cache(match.group('name'))
+        if cache is None:
+            self._send_error(404, f"CachedContent not found: {match.group('name')}")
+        return cache
+    
+    def _create_cache(self, payload):
+        if not self.server.caching:
+            self._send_error(400, 'Cached content is not supported for this model')
+            return
+        try:
+            ttl = parse_ttl(payload.get('ttl', f'{DEFAULT_CACHE_TTL}s'))
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        if not payload.get('model'):
+            self._send_error(400, 'model is required')
+            return
+        
+        tokens = len(json.dumps([payload.get('system_instruction'), payload.get('contents')])) // 4
+        if tokens < self.server.cache_min_tokens:
+            self._send_error(
+                400, f'Cached content is too small. total_token_count={tokens}, min_total_token_count={self.server.cache_min_tokens}'
+            )
+            return
+        
+        cache = self.server.create_cache(payload, ttl, tokens)
+        self._send_json(200, self.server.describe_cache(cache))
+    
+    def _pace(self, text):
+        """Sleep for as long as generating the text would take at the configured rate"""
+        if self.server.tokens_per_second:
+            time.sleep(max(1, len(text) // 4) / self.server.tokens_per_second)
+    
+    def _stream(self, payload, answer, cached_tokens=0):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        
+        pieces = re.findall(r'\S+\s*', answer)
+        for position, piece in enumerate(pieces):
+            self._pace(piece)
+            event = {'candidates': [candidate(piece, finished=position == len(pieces) - 1)]}
+            if position == len(pieces) - 1:
+                event['usageMetadata'] = usage_metadata(payload, answer, cached_tokens)
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8'))
+            self.wfile.flush()
+        self.close_connection = True
+    
+    def _send_error(self, status, message, headers=None):
+        self._send_json(status, {'error': {'code': status, 'message': message}}, headers)
+    
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """Threaded fake Gemini server that can run in the background of a test or benchmark"""
+    
+    daemon_threads = True
+    
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, tokens_per_second=0, verbose=False,
+                 error_rate=0.0, error_statuses=(500,), retry_after=1, seed=None, caching=True, cache_min_tokens=1024):
+        super().__init__((host, port), FakeGeminiHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.verbose = verbose
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.caching = caching
+        self.cache_min_tokens = cache_min_tokens
+        self.caches = {}  # name -> cached content, with its expiry as a time.time() value
+        self.requests = []
+        self.errors_injected = 0
+        self._random = random.Random(seed)
+        self._requests_lock = threading.Lock()
+        self._thread = None
+    
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1beta'
+    
+    def record_request(self, method, payload):
+        with self._requests_lock:
+            self.requests.append({'method': method, 'payload': payload})
+    
+    def injected_error(self):
+        """Status to fail the current request with, or None"""
+        with self._requests_lock:
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors_injected += 1
+                return self._random.choice(self.error_statuses)
+        return None
+    
+    def create_cache(self, payload, ttl, tokens):
+        cache = {
+            'name': f'cachedContents/{uuid.uuid4().hex[:12]}',
+            'model': payload['model'],
+            'system_instruction': payload.get('system_instruction', {}),
+            'contents': payload.get('contents', []),
+            'displayName': payload.get('displayName', ''),
+            'usageMetadata': {'totalTokenCount': tokens},
+            'expires_at': time.time() + ttl
+        }
+        with self._requests_lock:
+            self.caches[cache['name']] = cache
+        return cache
+    
+    def get_cache(self, name):
+        """A live cached content, or None if it is unknown or expired"""
+        with self._requests_lock:
+            cache = self.caches.get(name)
+            if cache is not None and cache['expires_at'] <= time.time():
+                del self.caches[name]
+                cache = None
+        return cache
+    
+    def update_cache(self, name, ttl):
+        with self._requests_lock:
+            self.caches[name]['expires_at'] = time.time() + ttl
+            return self.caches[name]
+    
+    def delete_cache(self, name):
+        with self._requests_lock:
+            self.caches.pop(name, None)
+    
+    def expire_caches(self):
+        """Expire every cached content now, as if their TTLs had run out"""
+        with self._requests_lock:
+            self.caches.clear()
+    
+    @staticmethod
+    def describe_cache(cache):
+        """The CachedContent resource returned by the API (without its contents)"""
+        expire_time = datetime.now(timezone.utc) + timedelta(seconds=cache['expires_at'] - time.time())
+        return {
+            'name': cache['name'],
+            'model': cache['model'],
+            'displayName': cache['displayName'],
+            'usageMetadata': cache['usageMetadata'],
+            'expireTime': expire_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        }
+    
+    def handle_error(self, request, client_address):
+        # Clients that give up (timeouts, cancelled calls) close their connection early
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+    
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Gemini API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before the first byte')
+    parser.add_argument('--tokens-per-second', type=float, default=0, help='Generation rate (0 = instant)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests to fail (0-1)')
+    parser.add_argument('--error-statuses', default='500', help='Comma-separated statuses for failed requests')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for error injection')
+    parser.add_argument('--no-caching', action='store_true', help='Fail every cachedContents create with 400')
+    parser.add_argument('--cache-min-tokens', type=int, default=1024, help='Smallest cachedContent accepted')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+    
+    server = FakeGeminiServer(
+        args.host, args.port, args.latency, args.tokens_per_second, args.verbose,
+        error_rate=args.error_rate,
+        error_statuses=[int(status) for status in args.error_statuses.split(',')],
+        retry_after=args.retry_after,
+        seed=args.seed,
+        caching=not args.no_caching,
+        cache_min_tokens=args.cache_min_tokens
+    )
+    print(f"Fake Gemini API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
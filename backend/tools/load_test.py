@@ -0,0 +1,403 @@
+"""
+Load test and latency benchmark for the discussion, file and chat endpoints
+
+By default starts the app (threaded werkzeug server, throwaway database) and
+tools.fake_gemini in-process, seeds a discussion with generated DOCX files, then
+drives each endpoint in turn with --concurrency clients for --requests calls.
+Reports p50/p95/p99 latency, throughput and errors per endpoint and writes them
+as JSON; --compare prints the change against an earlier results file and exits
+non-zero if any endpoint's p95 or throughput regressed beyond --threshold.
+
+--base-url targets an already running server instead (its LLM settings are
+then its own; the fake API options only apply in-process).
+
+Usage:
+    python -m tools.load_test
+    python -m tools.load_test --concurrency 16 --requests 400 --endpoints chat,chat_stream
+    python -m tools.load_test --llm-latency 0.5 --llm-error-rate 0.05 --output after.json --compare before.json
+    python -m tools.load_test --base-url http://127.0.0.1:5000 --endpoints list_discussions,get_discussion
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from tools.fake_gemini import FakeGeminiServer
+from tools.summary_check import make_docx
+
+class LoadContext:
+    """Ids and files the scenarios work on, plus a counter for unique names and questions"""
+    
+    def __init__(self, base_url, workdir):
+        self.base_url = base_url.rstrip('/')
+        self.workdir = workdir
+        self.discussion_id = None
+        self.file_id = None
+        self.docx_path = None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._pools = {}  # scenario -> list of ids created for it (e.g. discussions to delete)
+    
+    def next(self):
+        with self._lock:
+            return next(self._counter)
+    
+    def take(self, pool):
+        with self._lock:
+            items = self._pools.get(pool)
+            return items.pop() if items else None
+    
+    def put(self, pool, items):
+        with self._lock:
+            self._pools.setdefault(pool, []).extend(items)
+
+def check(response, *statuses):
+    if response.status_code not in statuses:
+        try:
+            detail = response.json().get('message')
+        except ValueError:
+            detail = response.text[:80]
+        raise RuntimeError(f"HTTP {response.status_code} {detail}")
+    return response
+
+def create_discussion(session, ctx, name):
+    response = check(session.post(f'{ctx.base_url}/api/discussions', json={'name': name}), 201)
+    return response.json()['data']['id']
+
+def upload(session, ctx, discussion_id, filename):
+    with open(ctx.docx_path, 'rb') as f:
+        return check(session.post(
+            f'{ctx.base_url}/api/discussions/{discussion_id}/files',
+            files={'files': (filename, f)}
+        ), 201, 202)
+
+# Scenarios: one request each, raising on an unexpected status
+
+def list_discussions(session, ctx):
+    check(session.get(f'{ctx.base_url}/api/discussions'), 200)
+
+def list_discussions_page(session, ctx):
+    check(session.get(f'{ctx.base_url}/api/discussions', params={'limit': 20, 'counts': 'true'}), 200)
+
+def get_discussion(session, ctx):
+    check(session.get(f'{ctx.base_url}/api/discussions/{ctx.discussion_id}'), 200)
+
+def create_discussion_scenario(session, ctx):
+    ctx.put('delete_discussion', [create_discussion(session, ctx, f'load {ctx.next()}')])
+
+def update_discussion(session, ctx):
+    check(session.put(
+        f'{ctx.base_url}/api/discussions/{ctx.discussion_id}',
+        json={'description': f'updated {ctx.next()}'}
+    ), 200)
+
+def delete_discussion(session, ctx):
+    discussion_id = ctx.take('delete_discussion') or create_discussion(session, ctx, f'load {ctx.next()}')
+    check(session.delete(f'{ctx.base_url}/api/discussions/{discussion_id}'), 200)
+
+def list_files(session, ctx):
+    check(session.get(f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/files'), 200)
+
+def file_status(session, ctx):
+    check(session.get(f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/files/{ctx.file_id}/status'), 200)
+
+def upload_file(session, ctx):
+    # Each upload goes to a fresh discussion so the per-discussion file limit is never hit
+    discussion_id = create_discussion(session, ctx, f'upload {ctx.next()}')
+    upload(session, ctx, discussion_id, 'load.docx')
+
+def chat(session, ctx):
+    # A new question every time, so the answer cache never hits
+    check(session.post(
+        f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/chat',
+        json={'message': f'What do the documents say about revenue growth? ({ctx.next()})'}
+    ), 200)
+
+def chat_cached(session, ctx):
+    check(session.post(
+        f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/chat',
+        json={'message': 'What do the documents say about supply chain risks?'}
+    ), 200)
+
+def chat_stream(session, ctx):
+    response = check(session.post(
+        f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/chat/stream',
+        json={'message': f'Summarize the regional operations ({ctx.next()})'},
+        stream=True
+    ), 200)
+    with response:
+        body = b''.join(response.iter_content(chunk_size=None))
+    if b'event: done' not in body:
+        raise RuntimeError("Stream ended without a done event")
+
+def chat_batch(session, ctx):
+    number = ctx.next()
+    check(session.post(
+        f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/chat/batch',
+        json={'messages': [f'Question {number}.{i} about quarterly revenue' for i in range(4)]}
+    ), 200)
+
+def summary(session, ctx):
+    check(session.post(f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/summary', json={}), 200)
+
+SCENARIOS = {
+    'list_discussions': list_discussions,
+    'list_discussions_page': list_discussions_page,
+    'get_discussion': get_discussion,
+    'create_discussion': create_discussion_scenario,
+    'update_discussion': update_discussion,
+    'delete_discussion': delete_discussion,
+    'list_files': list_files,
+    'file_status': file_status,
+    'upload_file': upload_file,
+    'chat': chat,
+    'chat_cached': chat_cached,
+    'chat_stream': chat_stream,
+    'chat_batch': chat_batch,
+    'summary': summary,
+}
+
+def percentile(sorted_values, fraction):
+    """Linearly interpolated percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def run_scenario(name, ctx, concurrency, total_requests):
+    """Run one scenario total_requests times over `concurrency` client threads"""
+    scenario = SCENARIOS[name]
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    remaining = itertools.count()
+    
+    def client():
+        with requests.Session() as session:
+            while next(remaining) < total_requests:
+                started = time.perf_counter()
+                try:
+                    scenario(session, ctx)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                except Exception as e:
+                    message = str(e)[:100]
+                    with lock:
+                        errors[message] = errors.get(message, 0) + 1
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+    
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies) + sum(errors.values()),
+        'succeeded': len(latencies),
+        'errors': sum(errors.values()),
+        'error_kinds': errors,
+        'seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+def seed(ctx, files):
+    """Create the discussion the read and chat scenarios use and wait for its files"""
+    ctx.docx_path = os.path.join(ctx.workdir, 'load.docx')
+    make_docx(ctx.docx_path, 80, seed=0)
+    
+    with requests.Session() as session:
+        ctx.discussion_id = create_discussion(session, ctx, 'load test')
+        for number in range(files):
+            # Distinct content per file, so nothing is deduplicated
+            path = os.path.join(ctx.workdir, f'seed{number}.docx')
+            make_docx(path, 80, seed=number + 1)
+            with open(path, 'rb') as f:
+                response = check(session.post(
+                    f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/files',
+                    files={'files': (f'seed{number}.docx', f)}
+                ), 201, 202)
+            ctx.file_id = response.json()['data']['uploaded'][0]['id']
+        
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            listed = check(session.get(f'{ctx.base_url}/api/discussions/{ctx.discussion_id}/files'), 200)
+            statuses = [f['status'] for f in listed.json()['data']]
+            if all(status != 'processing' for status in statuses):
+                if 'failed' in statuses:
+                    raise RuntimeError("A seed file failed to process")
+                return
+            time.sleep(0.2)
+        raise RuntimeError("Seed files were still processing after 120s")
+
+def start_local_server(workdir, args):
+    """Start the fake Gemini API and the app in this process; returns (base_url, stop)"""
+    fake = FakeGeminiServer(
+        latency=args.llm_latency,
+        tokens_per_second=args.llm_tokens_per_second,
+        error_rate=args.llm_error_rate,
+        error_statuses=[int(status) for status in args.llm_error_statuses.split(',')],
+        seed=0
+    ).start()
+    
+    # The app reads its configuration from the environment when created
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(workdir, 'app.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'LLM_API_BASE': fake.base_url,
+        'LLM_API_KEY': 'fake',
+    })
+    from werkzeug.serving import make_server
+    from app import create_app
+    from logging_config import app_logger
+    app_logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    def stop():
+        server.shutdown()
+        thread.join()
+        fake.stop()
+    
+    return f'http://127.0.0.1:{server.server_port}', stop, fake
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    print(f"{'endpoint':<24}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results.items():
+        cells = [stats['p50_ms'], stats['p95_ms'], stats['p99_ms']]
+        print(f"{name:<24}{stats['requests']:>6}{stats['errors']:>8}{stats['throughput_rps'] or 0:>9.1f}"
+              + ''.join(f"{cell:>10.1f}" if cell is not None else f"{'-':>10}" for cell in cells))
+        for kind, count in stats['error_kinds'].items():
+            print(f"{'':<24}{count:>6} x {kind}")
+
+def compare(previous, results, threshold):
+    """Print the change per endpoint; returns the names that regressed"""
+    regressed = []
+    print(f"\nCompared with {previous['meta'].get('commit')} ({previous['meta'].get('started_at')}):")
+    print(f"{'endpoint':<24}{'p95 ms':>18}{'req/s':>18}")
+    for name, stats in results.items():
+        before = previous['endpoints'].get(name)
+        if not before or not before['p95_ms'] or not stats['p95_ms']:
+            continue
+        p95_change = stats['p95_ms'] / before['p95_ms'] - 1
+        rps_change = stats['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0
+        flag = ''
+        if p95_change > threshold or rps_change < -threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<24}{before['p95_ms']:>8.1f} {p95_change:>+8.0%}{before['throughput_rps']:>8.1f} {rps_change:>+8.0%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API endpoints")
+    parser.add_argument('--base-url', help="Test a running server instead of starting one")
+    parser.add_argument('--endpoints', default=','.join(SCENARIOS), help="Comma-separated scenarios")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+    parser.add_argument('--llm-requests', type=int, default=None,
+                        help="Requests per LLM endpoint (chat, summary...), default --requests")
+    parser.add_argument('--seed-files', type=int, default=3, help="Files in the seeded discussion")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="Fake API seconds before answering")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=0, help="Fake API generation rate")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="Share of fake API calls that fail")
+    parser.add_argument('--llm-error-statuses', default='500,503,429')
+    parser.add_argument('--output', default='load_results.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Regression threshold (0.2 = 20%%)")
+    args = parser.parse_args()
+    
+    names = args.endpoints.split(',')
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown endpoints: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+        return 2
+    
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    stop = fake = None
+    try:
+        if args.base_url:
+            base_url = args.base_url
+        else:
+            base_url, stop, fake = start_local_server(workdir, args)
+        
+        ctx = LoadContext(base_url, workdir)
+        seed(ctx, args.seed_files)
+        
+        started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        results = {}
+        for name in names:
+            total = args.requests
+            if name.startswith(('chat', 'summary')) and args.llm_requests is not None:
+                total = args.llm_requests
+            results[name] = run_scenario(name, ctx, args.concurrency, total)
+            print(f"  {name}: {results[name]['throughput_rps']} req/s, p95 {results[name]['p95_ms']} ms", flush=True)
+        
+        output = {
+            'meta': {
+                'commit': git_commit(),
+                'started_at': started_at,
+                'base_url': args.base_url or 'in-process',
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'llm_requests': args.llm_requests,
+                'seed_files': args.seed_files,
+                'llm_latency': args.llm_latency,
+                'llm_tokens_per_second': args.llm_tokens_per_second,
+                'llm_error_rate': args.llm_error_rate,
+                'llm_errors_injected': fake.errors_injected if fake else None,
+            },
+            'endpoints': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        
+        print()
+        print_results(results)
+        print(f"\nResults written to {args.output}")
+        
+        if args.compare:
+            with open(args.compare) as f:
+                regressed = compare(json.load(f), results, args.threshold)
+            if regressed:
+                print(f"Regressed beyond {args.threshold:.0%}: {', '.join(regressed)}")
+                return 1
+        return 0
+    finally:
+        if stop:
+            stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Chunk stored content again with other chunk settings, without parsing the files
+
+Every content whose text is in the text store has its chunks replaced by the
+chunks of that text under --chunk-size / --chunk-overlap (by default the
+CHUNK_SIZE / CHUNK_OVERLAP settings), one transaction per content. Content
+chunked before the text store existed has its text extracted once from the
+first of its uploaded files still on disk; content with none keeps its chunks.
+
+Set the same CHUNK_SIZE and CHUNK_OVERLAP for the app so new uploads match,
+and restart it so cached retrieval indexes, prompt prefixes and answers are
+rebuilt from the new chunks.
+
+Usage:
+    python -m tools.rechunk database/instance/app.db
+    python -m tools.rechunk database/instance/app.db --chunk-size 1500 --chunk-overlap 300
+    python -m tools.rechunk database/instance/app.db --stored-only
+"""
+import argparse
+import os
+import sys
+import time
+from app.services import text_store
+from app.services.database_service import get_db_connection, init_db, transaction
+from app.services.file_processor import FileProcessor
+from app.services.ingestion_service import store_chunks
+
+def stored_contents(conn):
+    """(content_hash, chunk_count, [(file_id, file_path), ...]) of every chunked content"""
+    contents = []
+    for row in conn.execute('SELECT content_hash, chunk_count FROM ContentBlobs WHERE chunk_count IS NOT NULL'):
+        files = conn.execute(
+            'SELECT id, file_path FROM Files WHERE content_hash = ? ORDER BY id', (row['content_hash'],)
+        ).fetchall()
+        if files:
+            contents.append((row['content_hash'], row['chunk_count'], [tuple(file) for file in files]))
+    return contents
+
+def storage_size(conn, db_path):
+    """Bytes taken by the database and by the text store"""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    text_bytes = 0
+    for folder, _, names in os.walk(text_store.text_dir(db_path)):
+        text_bytes += sum(os.path.getsize(os.path.join(folder, name)) for name in names)
+    return os.path.getsize(db_path), text_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-chunk stored content from the text store")
+    parser.add_argument('db_path', help="Path to the SQLite database")
+    parser.add_argument('--chunk-size', type=int, default=FileProcessor.CHUNK_SIZE)
+    parser.add_argument('--chunk-overlap', type=int, default=FileProcessor.CHUNK_OVERLAP)
+    parser.add_argument('--stored-only', action='store_true',
+                        help="Skip content whose text would first have to be extracted from its file")
+    args = parser.parse_args()
+    
+    db_path = args.db_path
+    if not os.path.exists(db_path):
+        print(f"No database at {db_path}")
+        return 1
+    if not 0 <= args.chunk_overlap < args.chunk_size:
+        print("--chunk-overlap must be at least 0 and less than --chunk-size")
+        return 1
+    
+    # Brings the schema up to date (chunk offsets need migration 7)
+    init_db(db_path)
+    conn = get_db_connection(db_path)
+    db_before, text_before = storage_size(conn, db_path)
+    
+    started = time.perf_counter()
+    rechunked = extracted = skipped = 0
+    chunks_before = chunks_after = 0
+    for content_hash, chunk_count, files in stored_contents(conn):
+        file_id, file_path = files[0]
+        if not text_store.exists(db_path, content_hash):
+            on_disk = [(fid, path) for fid, path in files if os.path.exists(path)]
+            if args.stored_only or not on_disk:
+                skipped += 1
+                continue
+            file_id, file_path = on_disk[0]
+            extracted += 1
+        
+        try:
+            # Extract (if needed) and chunk before taking the write lock
+            spans = FileProcessor.process_file(
+                db_path, content_hash, file_path, args.chunk_size, args.chunk_overlap
+            )
+            with transaction(db_path, write=True) as db:
+                new_count = store_chunks(db_path, file_id, content_hash, spans)
+                db.execute(
+                    "UPDATE Files SET chunk_count = ? WHERE content_hash = ? AND status = 'ready'",
+                    (new_count, content_hash)
+                )
+        except Exception as e:
+            print(f"Could not re-chunk content {content_hash[:12]}: {e}")
+            skipped += 1
+            continue
+        
+        rechunked += 1
+        chunks_before += chunk_count
+        chunks_after += new_count
+    elapsed = time.perf_counter() - started
+    
+    conn.execute('VACUUM')
+    db_after, text_after = storage_size(conn, db_path)
+    conn.close()
+    
+    print(f"\nRe-chunked {rechunked} contents ({extracted} extracted from their files) in {elapsed:.1f}s; skipped {skipped}")
+    print(f"Chunks: {chunks_before} -> {chunks_after} "
+          f"(chunk size {args.chunk_size}, overlap {args.chunk_overlap})")
+    print(f"Database: {db_before / 1024 / 1024:.2f}MB -> {db_after / 1024 / 1024:.2f}MB, "
+          f"text store: {text_before / 1024 / 1024:.2f}MB -> {text_after / 1024 / 1024:.2f}MB")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+End-to-end check of the map-reduce summary endpoint against the fake Gemini API
+
+Starts tools.fake_gemini in the background, creates a throwaway database with
+generated DOCX files and calls POST /api/discussions/<id>/summary three times:
+cold, again unchanged (every partial summary must be reused), and after one
+more file is uploaded (only that file's branch and the reduce steps above it
+may call the LLM).
+
+Usage:
+    python -m tools.summary_check
+    python -m tools.summary_check --files 6 --paragraphs 120 --map-tokens 1500 --latency 0.2
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from tools.fake_gemini import FakeGeminiServer
+
+WORDS = ('the', 'report', 'summarizes', 'quarterly', 'revenue', 'growth', 'and', 'a',
+         'discussion', 'of', 'risks', 'in', 'supply', 'chain', 'operations', 'across', 'regions')
+
+def reduce_plan(nodes, fan_in):
+    """(reduce calls, tree levels) SummaryService needs to merge this many summaries"""
+    calls = levels = 0
+    while nodes > 1:
+        groups = -(-nodes // fan_in)
+        if nodes > fan_in and nodes % fan_in == 1:
+            groups -= 1
+        calls += groups
+        levels += 1
+        nodes = groups
+    return calls, levels
+
+def make_docx(path, paragraphs, seed):
+    import docx
+    rng = random.Random(seed)
+    document = docx.Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(' '.join(rng.choices(WORDS, k=60)) + '.')
+    document.save(path)
+
+def upload(client, discussion_id, path):
+    with open(path, 'rb') as f:
+        response = client.post(
+            f'/api/discussions/{discussion_id}/files',
+            data={'files': [(f, os.path.basename(path))]},
+            content_type='multipart/form-data'
+        )
+    if response.status_code != 201:
+        raise RuntimeError(f"Upload of {path} failed: {response.json}")
+
+def summarize(client, server, discussion_id):
+    requests_before = len(server.requests)
+    started = time.perf_counter()
+    response = client.post(f'/api/discussions/{discussion_id}/summary', json={})
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError(f"Summary failed: {response.json}")
+    stats = response.json['data']['stats']
+    stats['seconds'] = elapsed
+    stats['server_requests'] = len(server.requests) - requests_before
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Check summary caching against the fake Gemini API")
+    parser.add_argument('--files', type=int, default=4, help="Files uploaded before the first summary")
+    parser.add_argument('--paragraphs', type=int, default=80, help="Paragraphs per generated file")
+    parser.add_argument('--map-tokens', type=int, default=1000, help="SUMMARY_MAP_TOKENS")
+    parser.add_argument('--fan-in', type=int, default=3, help="SUMMARY_REDUCE_FAN_IN")
+    parser.add_argument('--concurrency', type=int, default=4, help="LLM_MAX_CONCURRENCY")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake API seconds per call")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='summary_check_')
+    server = FakeGeminiServer(latency=args.latency).start()
+    try:
+        # The app reads its configuration from the environment when created
+        os.environ.update({
+            'DATABASE_PATH': os.path.join(workdir, 'app.db'),
+            'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+            'ASYNC_INGESTION': 'false',
+            'LLM_API_BASE': server.base_url,
+            'LLM_API_KEY': 'fake',
+            'SUMMARY_MAP_TOKENS': str(args.map_tokens),
+            'SUMMARY_REDUCE_FAN_IN': str(args.fan_in),
+            'LLM_MAX_CONCURRENCY': str(args.concurrency),
+        })
+        from app import create_app
+        client = create_app().test_client()
+        
+        discussion_id = client.post('/api/discussions', json={'name': 'summary check'}).json['data']['id']
+        paths = []
+        for number in range(args.files + 1):
+            path = os.path.join(workdir, f'doc{number}.docx')
+            make_docx(path, args.paragraphs, seed=number)
+            paths.append(path)
+        for path in paths[:-1]:
+            upload(client, discussion_id, path)
+        
+        runs = [('cold', summarize(client, server, discussion_id))]
+        runs.append(('unchanged', summarize(client, server, discussion_id)))
+        upload(client, discussion_id, paths[-1])
+        runs.append(('one file added', summarize(client, server, discussion_id)))
+        
+        print(f"{'run':<16}{'map':>6}{'reduce':>8}{'reused':>8}{'LLM calls':>11}{'seconds':>9}")
+        for name, stats in runs:
+            print(f"{name:<16}{stats['map_tasks']:>6}{stats['reduce_tasks']:>8}{stats['reused']:>8}"
+                  f"{stats['llm_calls']:>11}{stats['seconds']:>9.2f}")
+        
+        cold, unchanged, added = (stats for _, stats in runs)
+        problems = []
+        if any(stats['llm_calls'] != stats['server_requests'] for _, stats in runs):
+            problems.append("LLM call counts do not match the requests the fake API received")
+        if unchanged['llm_calls'] != 0:
+            problems.append("an unchanged discussion called the LLM again")
+        # The new file's whole branch is new; above it, appending a node changes at
+        # most the last two groups of each level
+        new_maps = added['map_tasks'] - cold['map_tasks']
+        branch_calls = new_maps + reduce_plan(new_maps, args.fan_in)[0]
+        allowed = branch_calls + 2 * reduce_plan(args.files + 1, args.fan_in)[1]
+        print(f"one file added: {added['llm_calls']} LLM calls, at most {allowed} allowed "
+              f"({branch_calls} for the new file's branch)")
+        if added['llm_calls'] > allowed:
+            problems.append("adding one file recomputed more than its own branch and the reduce steps above it")
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        if not problems:
+            print("OK")
+        return 1 if problems else 0
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
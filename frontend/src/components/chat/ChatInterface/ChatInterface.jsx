@@ -9,6 +9,12 @@ const ChatInterface = ({ discussionId, filesCount }) => {
   const [messages, setMessages] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState('');
+  const [conversationId, setConversationId] = useState(null);
+
+  // Conversations belong to one discussion
+  useEffect(() => {
+    setConversationId(null);
+  }, [discussionId]);
 
   const handleSendMessage = async (messageText) => {
     if (filesCount === 0) {
@@ -25,13 +31,15 @@ const ChatInterface = ({ discussionId, filesCount }) => {
     setIsLoading(true);
     
     try {
-      // Build history for Gemini API
-      const history = messages.map(msg => ({
-        role: msg.isUser ? 'user' : 'model',
-        parts: [{ text: msg.text }]
-      }));
+      // The server keeps the history, so only the conversation ID is sent
+      let activeConversationId = conversationId;
+      if (activeConversationId === null) {
+        const conversation = await chatService.createConversation(discussionId);
+        activeConversationId = conversation.id;
+        setConversationId(activeConversationId);
+      }
       
-      const response = await chatService.sendMessage(discussionId, messageText, history);
+      const response = await chatService.sendMessage(discussionId, messageText, activeConversationId);
       
       // Add AI response to the list
       const aiMessage = { text: response.message, isUser: false };
@@ -3,12 +3,22 @@ import './FileStatus.css';
 const FileStatus = ({ uploaded, errors }) => {
   if (!uploaded && !errors) return null;
 
+  // Files accepted for background processing are only done once they are ready
+  const processing = (uploaded || []).filter((file) => file.status === 'processing');
+  const ready = (uploaded || []).filter((file) => file.status !== 'processing');
+
   return (
     <div className="file-status">
-      {uploaded && uploaded.length > 0 && (
+      {processing.length > 0 && (
+        <div className="file-status__processing">
+          <span className="material-symbols-outlined">hourglass_top</span>
+          <span>Processing {processing.length} file(s)...</span>
+        </div>
+      )}
+      {ready.length > 0 && (
         <div className="file-status__success">
           <span className="material-symbols-outlined">check_circle</span>
-          <span>Successfully uploaded {uploaded.length} file(s)</span>
+          <span>Successfully uploaded {ready.length} file(s)</span>
         </div>
       )}
       {errors && errors.length > 0 && (
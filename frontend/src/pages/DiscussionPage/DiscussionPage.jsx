@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Button from '../../components/common/Button/Button';
 import Modal from '../../components/common/Modal/Modal';
@@ -11,6 +11,7 @@ import ChatInterface from '../../components/chat/ChatInterface/ChatInterface';
 import LoadingSpinner from '../../components/common/LoadingSpinner/LoadingSpinner';
 import ErrorMessage from '../../components/common/ErrorMessage/ErrorMessage';
 import { discussionService, fileService } from '../../services/api';
+import { FILE_STATUS_POLL_INTERVAL } from '../../services/utils/constants';
 import './DiscussionPage.css';
 
 const DiscussionPage = () => {
@@ -26,10 +27,15 @@ const DiscussionPage = () => {
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [uploadStatus, setUploadStatus] = useState(null);
+  const pollRef = useRef(0);
 
   useEffect(() => {
     fetchDiscussion();
     fetchFiles();
+    // Stop polling the files of the previous discussion
+    return () => {
+      pollRef.current += 1;
+    };
   }, [id]);
 
   const fetchDiscussion = async () => {
@@ -71,6 +77,46 @@ const DiscussionPage = () => {
     }
   };
 
+  // Poll files accepted for background processing until each is ready or has failed
+  const waitForProcessing = async (uploaded) => {
+    const poll = ++pollRef.current;
+    let pending = uploaded.filter((file) => file.status === 'processing');
+
+    while (pending.length > 0) {
+      await new Promise((resolve) => setTimeout(resolve, FILE_STATUS_POLL_INTERVAL));
+      if (poll !== pollRef.current) return;
+
+      // A status that could not be fetched is asked for again next time
+      const statuses = await Promise.all(
+        pending.map((file) => fileService.getStatus(id, file.id).catch(() => null))
+      );
+      if (poll !== pollRef.current) return;
+
+      const finished = {};
+      statuses.forEach((status) => {
+        if (status && status.status !== 'processing') {
+          finished[status.id] = status;
+        }
+      });
+      if (Object.keys(finished).length === 0) continue;
+
+      setUploadStatus((current) => ({
+        uploaded: current.uploaded
+          .filter((file) => !finished[file.id] || finished[file.id].status !== 'failed')
+          .map((file) => (finished[file.id] ? { ...file, status: 'ready', chunks: finished[file.id].chunks } : file)),
+        errors: [
+          ...(current.errors || []),
+          ...Object.values(finished)
+            .filter((status) => status.status === 'failed')
+            .map((status) => ({ filename: status.filename, error: status.error })),
+        ],
+      }));
+      pending = pending.filter((file) => !finished[file.id]);
+    }
+
+    await fetchFiles();
+  };
+
   const handleFileUpload = async (selectedFiles) => {
     try {
       setIsUploading(true);
@@ -85,6 +131,8 @@ const DiscussionPage = () => {
       });
       
       await fetchFiles();
+      // Uploads answered with 202 are still being processed in the background
+      waitForProcessing(result.uploaded);
     } catch (err) {
       setError(err.message || 'Failed to upload files');
     } finally {
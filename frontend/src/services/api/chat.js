@@ -1,14 +1,33 @@
 import { API_BASE_URL, API_ENDPOINTS } from '../utils/constants';
 
 export const chatService = {
+  // Start a conversation; the server keeps its history
+  createConversation: async (discussionId) => {
+    const response = await fetch(`${API_BASE_URL}${API_ENDPOINTS.CONVERSATIONS(discussionId)}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({}),
+    });
+    
+    const data = await response.json();
+    
+    if (!data.success) {
+      throw new Error(data.message || 'Failed to start conversation');
+    }
+    
+    return data.data;
+  },
+
   // Send message
-  sendMessage: async (discussionId, message, history = []) => {
+  sendMessage: async (discussionId, message, conversationId) => {
     const response = await fetch(`${API_BASE_URL}${API_ENDPOINTS.CHAT(discussionId)}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ message, history }),
+      body: JSON.stringify({ message, conversation_id: conversationId }),
     });
     
     const data = await response.json();
@@ -34,5 +34,17 @@ export const fileService = {
     
     return data.data;
   },
+
+  // Get the processing status of an uploaded file
+  getStatus: async (discussionId, fileId) => {
+    const response = await fetch(`${API_BASE_URL}${API_ENDPOINTS.FILE_STATUS(discussionId, fileId)}`);
+    const data = await response.json();
+    
+    if (!data.success) {
+      throw new Error(data.message || 'Failed to fetch file status');
+    }
+    
+    return data.data;
+  },
 };
 
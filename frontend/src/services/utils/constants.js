@@ -3,9 +3,14 @@ export const API_BASE_URL = '/api';
 export const API_ENDPOINTS = {
   DISCUSSIONS: '/discussions',
   FILES: (discussionId) => `/discussions/${discussionId}/files`,
+  FILE_STATUS: (discussionId, fileId) => `/discussions/${discussionId}/files/${fileId}/status`,
   CHAT: (discussionId) => `/discussions/${discussionId}/chat`,
+  CONVERSATIONS: (discussionId) => `/discussions/${discussionId}/conversations`,
 };
 
+// How often files still being processed in the background are checked
+export const FILE_STATUS_POLL_INTERVAL = 1500; // ms
+
 export const FILE_CONSTRAINTS = {
   MAX_FILES: 30,
   MAX_FILE_SIZE: 50 * 1024 * 1024, // 50MB
@@ -1,11 +1,11 @@
 import os
-import requests
 import logging
 from logging_config import app_logger, error_logger
+from app.services.async_llm_client import get_async_llm_client
 
-def get_gemini_response(user_message, history=None):
+def build_request(user_message, history=None):
     """
-    Sends a chat message to Gemini 2.5 Flash API and returns the AI response text.
+    Builds the endpoint, headers and payload of a Gemini 2.5 Flash chat request.
     """
 
     system_prompt = """You are an AI assistant that specializes in requirement gap clarification for Salesforce implementation projects.  
@@ -47,14 +47,37 @@ def get_gemini_response(user_message, history=None):
         },
         "contents": contents
     }
+    return endpoint, payload, headers
+
+def get_gemini_response(user_message, history=None):
+    """
+    Sends a chat message to Gemini 2.5 Flash API and returns the AI response text.
+    """
+    endpoint, payload, headers = build_request(user_message, history)
     try:
         app_logger.info(f"Gemini API user message recieved")
-        response = requests.post(endpoint, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+        # Through the async client, so the call shares its concurrency and rate limits
+        data = get_async_llm_client().submit(endpoint, payload, headers).result()
         ai_text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
         app_logger.info(f"Gemini API response generated")
         return ai_text
     except Exception as e:
         error_logger.error(f"Gemini API Error: {e}", exc_info=True)
         return f"[Gemini API Error]: {str(e)}"
+
+def get_gemini_responses(user_messages, history=None, timeout=None):
+    """
+    Sends several chat messages (each with the same history) concurrently and
+    returns the AI response texts in the same order.
+    """
+    calls = [build_request(user_message, history) for user_message in user_messages]
+    app_logger.info(f"Gemini API {len(calls)} user messages received")
+    responses = []
+    for data, error in get_async_llm_client().post_many(calls, timeout):
+        if error is not None:
+            responses.append(f"[Gemini API Error]: {str(error)}")
+            continue
+        ai_text = data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
+        responses.append(ai_text)
+    app_logger.info(f"Gemini API responses generated")
+    return responses